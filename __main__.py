@@ -0,0 +1,5 @@
+import sys
+from diffcount import cli
+
+if __name__ == '__main__':
+    sys.exit(cli.main())
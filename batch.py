@@ -0,0 +1,229 @@
+''' Headless reconciliation of many SOL/TEW pairs at once, without the interactive menus. '''
+
+import os
+import re
+import csv
+import sys
+import json
+import logging
+import tempfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+import diffcount.state as state
+import diffcount.cache as disk_cache
+import diffcount.explain as explain_index
+import diffcount.columns as columns
+import diffcount.profiling as profiling
+import diffcount.diffcount as diffcount
+
+def read_manifest(manifest_filename):
+    '''Reads the pairs to reconcile from a manifest.
+
+        The manifest is either a JSON list of objects, or a CSV file with a header,
+        and each entry has the keys 'sol' and 'tew' (paths to the exports),
+        optionally 'name' and 'output'. Relative paths are taken from the manifest folder.
+        An export split in several files is given as a JSON list of paths, or in a CSV
+        file as the paths separated by ';'.
+    '''
+    with open(manifest_filename, newline='') as file:
+        if manifest_filename.lower().endswith('.json'):
+            entries = json.load(file)
+        else:
+            entries = list(csv.DictReader(file))
+
+    base_path = os.path.dirname(os.path.abspath(manifest_filename))
+    pairs = []
+    for i, entry in enumerate(entries):
+        if 'sol' not in entry or 'tew' not in entry:
+            raise KeyError(f'Manifest entry {i} needs both a "sol" and a "tew" file.')
+
+        pairs.append({
+            'name': entry.get('name') or f'{i + 1}',
+            'sol': manifest_paths(base_path, entry['sol']),
+            'tew': manifest_paths(base_path, entry['tew']),
+            'output': entry.get('output') or None,
+        })
+
+    return pairs
+
+def manifest_paths(base_path, paths):
+    '''One path of a manifest entry, or the list of them for an export split in several files.'''
+    if isinstance(paths, str):
+        paths = paths.split(';')
+    paths = [os.path.join(base_path, path.strip()) for path in paths]
+
+    return paths[0] if len(paths) == 1 else paths
+
+# 'sol' or 'tew' as a word of its own in a filename, like 2024-05_EMEA_SOL.xlsx, and
+# the part number of an export split in several files, like may_sol_part2.xlsx.
+REPORT_TOKEN = re.compile(r'(?<![a-z])(sol|tew)(?:[ _-]?part[ _-]?(\d+))?(?![a-z0-9])')
+
+def pair_directory(path, extensions=columns.INPUT_EXTENSIONS):
+    '''Pairs the exports in a folder by name: 'may_sol.xlsx' goes with 'may_tew.csv'.
+
+        The pair name is the filename without the extension and without the 'sol'/'tew' word.
+        Files without a match are logged and left out. Exports split in several files are
+        named like 'may_sol_part1.xlsx', 'may_sol_part2.xlsx', and read as one.
+    '''
+    found = {'sol': {}, 'tew': {}}
+
+    for filename in sorted(os.listdir(path)):
+        stem, extension = os.path.splitext(filename)
+        if extension.lower() not in extensions:
+            continue
+
+        match = REPORT_TOKEN.search(stem.lower())
+        if match is None:
+            continue
+
+        name = (stem[:match.start()] + stem[match.end():]).strip(' _-.') or match.group(1)
+        part = int(match.group(2) or 0)
+        found[match.group(1)].setdefault(name, {})[part] = os.path.join(path, filename)
+
+    pairs = []
+    for name in sorted(set(found['sol']) | set(found['tew'])):
+        if name not in found['sol'] or name not in found['tew']:
+            logging.log(logging.WARNING, f'No matching SOL/TEW file for [{name}]. Skipping it.')
+            continue
+
+        sol, tew = ([parts[i] for i in sorted(parts)] for parts in (found['sol'][name], found['tew'][name]))
+        pairs.append({'name': name, 'sol': sol[0] if len(sol) == 1 else sol, 'tew': tew[0] if len(tew) == 1 else tew, 'output': None})
+
+    return pairs
+
+def report_summary(data):
+    '''The rows of a finished report, its rows by status, and the categories its mismatches come from.'''
+    status_counts = data['status'].value_counts()
+    categories = diffcount.mismatch_summary(data)
+    categories = categories[categories.mismatch_rows > 0]
+
+    return {
+        'rows': int(data.shape[0]),
+        'status': {status: int(status_counts.get(status, 0)) for status in columns.STATUS_TYPES},
+        # Which categories the MISMATCH rows differ in, the most frequent first.
+        'mismatch_categories': [
+            {'category': row.category, 'rows': int(row.mismatch_rows),
+                'only_category_rows': int(row.only_category_rows), 'abs_difference': float(row.abs_difference)}
+            for row in categories.itertuples(index=False)
+        ],
+    }
+
+def reconcile_pair(pair, output_path, sidecar=False, chunked=False, constant_memory=False, state_path=None, profile=False, cprofile=None, lean=False,
+        abs_tolerance=columns.MISMATCH_ABS_TOLERANCE, rel_tolerance=columns.MISMATCH_REL_TOLERANCE, cache=None,
+        shard_by=None, shard_rows=columns.SHARD_ROWS, shard_workbooks=False, explain=False):
+    '''Runs the whole comparison for one pair, and saves its report.
+
+        With a `state_path`, the pair is reconciled incrementally against its last
+        result (see state.py), and a '-delta' report with the status changes is saved too.
+        With `profile`, the stage timings of the pair are returned in the summary, under 'stages',
+        and with `cprofile`, a cProfile dump of the pair is saved as '<cprofile>-<name>.prof'.
+        With `explain`, the explain index of the report is saved next to it (see explain.py),
+        except for incremental runs, which only read the changed groups. Incremental runs
+        do not use the `cache` either, as they hash the source rows of each group.
+
+        Never raises: errors are returned in the summary, so one bad pair
+        does not stop the others.
+    '''
+    output = pair['output'] or f'diffcount-{pair["name"]}.xlsx'
+    output = os.path.join(output_path, output)
+    summary = {'name': pair['name'], 'sol': pair['sol'], 'tew': pair['tew'], 'output': output}
+
+    if profile or cprofile:
+        profiling.enable(cprofile=cprofile is not None)
+
+    try:
+        if state_path is not None:
+            state_filename = os.path.join(state_path, f'{pair["name"]}.sqlite')
+            data, delta = state.reconcile_incremental(pair['sol'], pair['tew'], state_filename,
+                abs_tolerance, rel_tolerance, sidecar=sidecar, chunked=chunked, lean=lean)
+
+            summary['delta_output'] = state.delta_filename(output)
+            summary['changed_status'] = int(len(delta))
+            diffcount.style_and_save(delta, summary['delta_output'], constant_memory=constant_memory,
+                shard_by=shard_by, shard_rows=shard_rows, shard_workbooks=shard_workbooks)
+        else:
+            # The source rows are written out to a temporary folder as they are read (see explain.py).
+            with tempfile.TemporaryDirectory(prefix='diffcount-explain-') if explain else contextlib.nullcontext() as runs_folder:
+                sol_data = diffcount.load_sol_report(pair['sol'], sidecar=sidecar, chunked=chunked, lean=lean, cache=cache, explain=runs_folder)
+                tew_data = diffcount.load_tew_report(pair['tew'], sidecar=sidecar, chunked=chunked, lean=lean, cache=cache, explain=runs_folder)
+                if explain:
+                    (sol_data, sol_runs), (tew_data, tew_runs) = sol_data, tew_data
+                    summary['explain_output'] = explain_index.index_filename(output)
+                    explain_index.write_index(summary['explain_output'], sol_runs + tew_runs)
+
+            data = diffcount.merge_reports(sol_data, tew_data)
+            data = diffcount.fix_merged_dataframe(data, abs_tolerance, rel_tolerance)
+
+        diffcount.style_and_save(data, output, constant_memory=constant_memory,
+            shard_by=shard_by, shard_rows=shard_rows, shard_workbooks=shard_workbooks)
+    except Exception as ex:
+        logging.log(logging.ERROR, f'Could not reconcile [{pair["name"]}]: {ex!r}')
+        summary.update({'success': False, 'error': repr(ex)})
+        return summary
+    finally:
+        profiler = profiling.disable()
+        if profiler is not None and profile:
+            summary['stages'] = profiler.records
+        if profiler is not None and cprofile:
+            stem, extension = os.path.splitext(cprofile)
+            profiler.write_cprofile(f'{stem}-{pair["name"]}{extension or ".prof"}')
+
+    summary['success'] = True
+    summary.update(report_summary(data))
+
+    return summary
+
+def run_batch(arguments):
+    '''Entry point of `python -m diffcount batch`. Returns the exit status:
+        0 if every pair was reconciled, 1 if any of them failed, 2 if there was nothing to do.
+    '''
+    logging.basicConfig(level=logging.INFO, style='{', datefmt='%H:%M:%S', format='[{asctime} {levelname}] {message}', stream=sys.stderr)
+
+    pairs = []
+    if arguments.manifest:
+        pairs += read_manifest(arguments.manifest)
+    if arguments.directory:
+        pairs += pair_directory(arguments.directory)
+
+    if not pairs:
+        logging.log(logging.ERROR, 'No SOL/TEW pairs to reconcile.')
+        return 2
+
+    os.makedirs(arguments.output_dir, exist_ok=True)
+    if arguments.state_dir:
+        os.makedirs(arguments.state_dir, exist_ok=True)
+        if arguments.cache is not None:
+            logging.log(logging.WARNING, '--cache is not used with --state-dir. The exports will be read in full.')
+    logging.log(logging.INFO, f'Reconciling {len(pairs)} pairs with {arguments.workers} workers.')
+
+    # The workers share the cache folder, so a pair sharing an export with another reads it once.
+    report_cache = disk_cache.from_arguments(arguments)
+
+    with ProcessPoolExecutor(max_workers=arguments.workers) as pool:
+        futures = [pool.submit(reconcile_pair, pair, arguments.output_dir,
+            arguments.sidecar, arguments.chunked, arguments.constant_memory, arguments.state_dir,
+            bool(arguments.profile), arguments.cprofile, arguments.lean,
+            arguments.abs_tolerance, arguments.rel_tolerance, report_cache,
+            arguments.shard_by, arguments.shard_rows, arguments.shard_workbooks, arguments.explain)
+            for pair in pairs]
+        results = [future.result() for future in futures]
+
+    if arguments.profile:
+        # The stages ran in the workers. Each pair brought its own timings back.
+        with open(arguments.profile, 'w') as file:
+            json.dump({'pairs': [{'name': result['name'], 'stages': result.get('stages', [])} for result in results]}, file, indent=2)
+
+    summary = {
+        'pairs': len(results),
+        'failed': sum(1 for result in results if not result['success']),
+        'results': results,
+    }
+
+    text = json.dumps(summary, indent=2)
+    if arguments.summary:
+        with open(arguments.summary, 'w') as file:
+            file.write(text)
+    print(text)
+
+    return 1 if summary['failed'] else 0
@@ -0,0 +1,120 @@
+''' Benchmarks of the pipeline over synthetic exports (see synthetic.py).
+
+    For each size and input format, times and memory-profiles every stage, and saving the
+    report in each output mode (split in several sheets when it does not fit in one). Run with:
+
+        python -m diffcount.benchmark --sizes 10000 100000 --output bench.json
+'''
+
+import os
+import sys
+import json
+import logging
+import argparse
+import tempfile
+
+import diffcount.columns as columns
+import diffcount.profiling as profiling
+import diffcount.synthetic as synthetic
+import diffcount.diffcount as diffcount
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 10000000]
+INPUT_FORMATS = ['xlsx', 'csv', 'parquet']
+OUTPUT_MODES = ['default', 'constant_memory']
+
+def run_case(sol_filename, tew_filename, output_modes, output_path):
+    '''Runs the whole pipeline once, profiling each stage. Returns the stage records.'''
+    profiler = profiling.enable()
+    try:
+        sol_data = diffcount.load_sol_report(sol_filename)
+        tew_data = diffcount.load_tew_report(tew_filename)
+
+        data = diffcount.merge_reports(sol_data, tew_data)
+        data = diffcount.fix_merged_dataframe(data)
+
+        # A result with more rows than fit in a sheet is split in several (see style_and_save).
+        sharded = data.shape[0] > columns.SHARD_ROWS
+
+        for mode in output_modes:
+            diffcount.style_and_save(data, os.path.join(output_path, f'result-{mode}.xlsx'),
+                constant_memory=(mode == 'constant_memory'))
+            # Tell the output modes apart in the results.
+            profiler.records[-1]['stage'] = f'style_and_save[{mode}{", sharded" if sharded else ""}]'
+    finally:
+        profiling.disable()
+
+    return profiler.records
+
+def run_benchmarks(sizes, input_formats, output_modes, workdir, seed=0, extra_columns=0, variant_share=None):
+    '''Generates the exports for each size, and runs every input format over them.'''
+    results = []
+
+    for rows in sizes:
+        logging.log(logging.INFO, f'Generating synthetic exports with {rows} SOL rows.')
+        sol, tew = synthetic.generate_exports(rows, seed=seed, extra_columns=extra_columns,
+            variant_share=variant_share)
+
+        for input_format in input_formats:
+            if input_format in ('xlsx', 'xls') and max(len(sol), len(tew)) > columns.SHARD_ROWS:
+                logging.log(logging.WARNING, f'{rows} rows do not fit in a {input_format} file. Skipping it.')
+                continue
+
+            sol_filename = synthetic.write_export(sol, os.path.join(workdir, f'sol-{rows}.{input_format}'))
+            tew_filename = synthetic.write_export(tew, os.path.join(workdir, f'tew-{rows}.{input_format}'))
+
+            logging.log(logging.INFO, f'Running {rows} rows from {input_format}.')
+            stages = run_case(sol_filename, tew_filename, output_modes, workdir)
+
+            results.append({
+                'rows': rows,
+                'input_format': input_format,
+                'input_bytes': os.path.getsize(sol_filename) + os.path.getsize(tew_filename),
+                'stages': stages,
+            })
+
+            os.remove(sol_filename)
+            os.remove(tew_filename)
+
+    return results
+
+def print_table(results):
+    print(f"\n{'rows':>10} {'format':>8}  {'stage':32} {'wall (s)':>9} {'cpu (s)':>9} {'peak (MB)':>10}")
+    for result in results:
+        for stage in result['stages']:
+            print(f"{result['rows']:>10} {result['input_format']:>8}  {stage['stage']:32} "
+                f"{stage['wall_seconds']:>9.3f} {stage['cpu_seconds']:>9.3f} {stage['peak_memory_mb']:>10.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='diffcount.benchmark',
+        description='Times and memory-profiles each stage of DiffCount over synthetic exports.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+        help='SOL rows of each benchmark. Default: 10k, 100k, 1M and 10M.')
+    parser.add_argument('--input-formats', nargs='+', choices=INPUT_FORMATS, default=INPUT_FORMATS)
+    parser.add_argument('--output-modes', nargs='+', choices=OUTPUT_MODES, default=OUTPUT_MODES)
+    parser.add_argument('--extra-columns', type=int, default=0,
+        help='Unused columns added to the exports, as the real ones are much wider.')
+    parser.add_argument('--variant-share', type=float,
+        help='Share of groups on a locale that needs an exception or a renaming. Default: spread evenly.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='Where to keep the generated files. Default: a temporary folder.')
+    parser.add_argument('--output', help='Save the results as JSON.')
+    arguments = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, style='{', datefmt='%H:%M:%S', format='[{asctime} {levelname}] {message}', stream=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as temporary:
+        workdir = arguments.workdir or temporary
+        os.makedirs(workdir, exist_ok=True)
+
+        results = run_benchmarks(arguments.sizes, arguments.input_formats, arguments.output_modes,
+            workdir, seed=arguments.seed, extra_columns=arguments.extra_columns,
+            variant_share=arguments.variant_share)
+
+    print_table(results)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump({'results': results}, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+''' On-disk cache of the processed reports, so an export that was already read (by any run,
+    from any folder) is never parsed again.
+
+    Each entry is the output of load_sol_report/load_tew_report, saved as Parquet and keyed by
+    the contents of the export, the known layouts of its role (columns.EXPORT_SCHEMAS) and the
+    version of the processing code. Editing the export, the layouts or the code makes a new key, and the old entry is left
+    to be evicted. When the cache grows past its size limit, the least recently used
+    entries are removed first. '''
+
+import os
+import json
+import hashlib
+import logging
+import functools
+import tempfile
+import pandas
+
+import diffcount.util as util
+import diffcount.columns as columns
+import diffcount.readers as readers
+
+# Size limit of the cache folder, unless told otherwise.
+CACHE_BYTES = 2 << 30
+
+# The modules whose code decides what a processed report looks like.
+CODE_MODULES = ['diffcount.py', 'readers.py', 'columns.py', 'schemas.py']
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    '''A hash of the processing code, so a change to it does not reuse old entries.'''
+    digest = hashlib.sha256()
+    path = os.path.dirname(os.path.abspath(__file__))
+
+    for module in CODE_MODULES:
+        with open(os.path.join(path, module), 'rb') as file:
+            digest.update(file.read())
+
+    return digest.hexdigest()[:16]
+
+def cache_key(filename, role):
+    '''The key of the processed report of an export, as a 'sol' or 'tew' one.'''
+    digest = hashlib.sha256()
+    digest.update(util.file_hash(filename).encode())
+    digest.update(json.dumps([role, columns.EXPORT_SCHEMAS[role]], sort_keys=True).encode())
+    digest.update(code_version().encode())
+
+    return digest.hexdigest()
+
+def from_arguments(arguments):
+    '''The cache asked for with `--cache`, or None.'''
+    if arguments.cache is None:
+        return None
+
+    max_bytes = CACHE_BYTES if arguments.cache_size is None else arguments.cache_size << 20
+    return ReportCache(os.path.expanduser(arguments.cache), max_bytes)
+
+class ReportCache:
+    '''A folder of processed reports, limited to `max_bytes`.'''
+
+    def __init__(self, path, max_bytes=CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def entry_filename(self, key):
+        return os.path.join(self.path, key + '.parquet')
+
+    def load(self, filename, role, load_report):
+        '''The processed report of `filename`, from the cache if it is there.
+            Otherwise `load_report()` makes it, and it is saved for next time.
+        '''
+        key = cache_key(filename, role)
+        entry = self.entry_filename(key)
+
+        data = self.read(entry, role)
+        if data is not None:
+            logging.log(logging.INFO, f'Cache hit for {filename}: reading [{entry}] instead.')
+            return data
+
+        logging.log(logging.INFO, f'Cache miss for {filename}.')
+        data = load_report()
+
+        if self.write(data, entry):
+            self.evict()
+
+        return data
+
+    def read(self, entry, role):
+        '''An entry of the cache, or None if it is missing or cannot be read.'''
+        if not os.path.exists(entry):
+            return None
+
+        try:
+            data = pandas.read_parquet(entry)
+        except ImportError:
+            # No pyarrow.
+            return None
+        except (OSError, ValueError) as ex:
+            # Half-written or damaged. It is made again.
+            logging.log(logging.WARNING, f'Could not read cache entry [{entry}]: {ex}')
+            self.remove(entry)
+            return None
+
+        # Marks it as recently used.
+        os.utime(entry)
+
+        # Parquet has no mixed-type columns, so ids come back as numbers. The key columns
+        # get their usual dtype back, so they compare the same as freshly read ones.
+        key_dtypes = {col: dtype for col, dtype in columns.COLUMN_DTYPES[role].items() if dtype == 'object'}
+        return readers.apply_dtypes(data, key_dtypes)
+
+    def write(self, data, entry):
+        '''Saves an entry. Returns whether it could be saved.'''
+        os.makedirs(self.path, exist_ok=True)
+
+        # Written aside and moved in place, so no one reads a half-written entry.
+        file_descriptor, temporary = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        os.close(file_descriptor)
+        try:
+            data.to_parquet(temporary, index=False)
+            os.replace(temporary, entry)
+        except (ImportError, OSError, ValueError, TypeError) as ex:
+            # Like ids mixing numbers and text, which Parquet cannot keep (pyarrow raises a TypeError).
+            logging.log(logging.WARNING, f'Could not save cache entry [{entry}]: {ex}')
+            self.remove(temporary)
+            return False
+
+        logging.log(logging.INFO, f'Saved cache entry [{entry}].')
+        return True
+
+    def evict(self):
+        '''Removes the least recently used entries until the cache fits in its size limit.'''
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.parquet'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                # Evicted by another run at the same time.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            self.remove(os.path.join(self.path, name))
+            total -= size
+            logging.log(logging.INFO, f'Evicted cache entry [{name}] ({size} bytes), the cache is over {self.max_bytes} bytes.')
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,364 @@
+''' Command line of DiffCount: the arguments, the interactive menus, and the dispatch to the
+    batch, serve, periods and explain commands.
+
+    This module only imports what the menus need. The processing modules (and pandas,
+    numpy and xlsxwriter with them) are imported once there is data to process, so
+    `--help`, the greeting and the file picker show up right away. '''
+
+import os
+import logging
+import argparse
+import tempfile
+import threading
+import importlib
+import diffcount.util as util
+import diffcount.columns as columns
+import diffcount.profiling as profiling
+from diffcount.util import UserQuitException
+from datetime import datetime
+from colorama import Fore, Style
+from colorama import init as colorama_init
+from sys import stdout
+
+# Where `--cache` keeps the processed exports, if no folder is given.
+DEFAULT_CACHE_PATH = os.path.join('~', '.cache', 'diffcount')
+
+def add_logging_handler(logging_filename, logging_level = logging.DEBUG):
+    '''With the logging module already configured, appends a file as logging output.'''
+    logging_file = logging.FileHandler(logging_filename)
+    logging_file.setLevel(logging_level)
+    logging_file.setFormatter(logging.Formatter(fmt='[%(asctime)s %(levelname)s] %(message)s',datefmt='%H:%M:%S'))
+
+    logging.log(logging.INFO, f'Setting up logging file as [{logging_filename}]')
+
+    logger = logging.getLogger()
+    logger.addHandler(logging_file)
+
+def parse_arguments(argv=None):
+    # Options for both the interactive mode and the batch command.
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--sidecar', action='store_true',
+        help='Keep a Parquet copy of each export next to it, so re-runs on the same export skip parsing it.')
+    common.add_argument('--chunked', action='store_true',
+        help='Aggregate each export chunk by chunk, for exports that do not fit in memory.')
+    common.add_argument('--lean', action='store_true',
+        help='Read the keys as categoricals and the whole-number counts as small integers, to use less memory.')
+    common.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_PATH, metavar='FOLDER',
+        help=f'Keep each processed export in a cache folder (default: {DEFAULT_CACHE_PATH}), so any later run on '
+             'the same export skips reading it.')
+    common.add_argument('--cache-size', type=int, metavar='MB',
+        help='Size limit of the cache. The least recently used exports are removed first. Default: 2048.')
+    common.add_argument('--abs-tolerance', type=float, default=columns.MISMATCH_ABS_TOLERANCE,
+        help='Counts that differ by at most this much still match. Default: exact.')
+    common.add_argument('--rel-tolerance', type=float, default=columns.MISMATCH_REL_TOLERANCE,
+        help='Counts that differ by at most this share of the larger one (like 0.01 for 1%%) still match. Default: exact.')
+    common.add_argument('--constant-memory', action='store_true',
+        help='Stream the report to disk row by row, instead of holding the whole workbook in memory.')
+    common.add_argument('--shard-by', choices=['tgroup', 'rows'],
+        help='Split the report rows in several sheets, one per vendor (tgroup) or every --shard-rows rows, '
+             'after an index sheet linking to each one.')
+    common.add_argument('--shard-rows', type=int, default=columns.SHARD_ROWS, metavar='N',
+        help='Most rows in one sheet. Reports with more are split by rows, even without --shard-by. Default: Excel\'s limit.')
+    common.add_argument('--shard-workbooks', action='store_true',
+        help='Save each shard as a workbook of its own, all at the same time, next to the report (which keeps the index).')
+    common.add_argument('--profile', metavar='FILE.json',
+        help='Save the wall time, CPU time, peak memory and rows in/out of each stage as JSON. '
+             'Stages run in worker processes are recorded per pair in batch mode only.')
+    common.add_argument('--cprofile', metavar='FILE.prof',
+        help='Also save a cProfile dump of the run. In batch mode, one dump per pair, named FILE-<pair>.prof.')
+
+    parser = argparse.ArgumentParser(prog='diffcount', parents=[common],
+        description='Compares the billing reports by SOL and TEW, and makes a comparison report.')
+    parser.add_argument('--parallel', action='store_true',
+        help='Choose both files first, then read and process them at the same time, in two processes.')
+    parser.add_argument('--state',
+        help='SQLite file keeping the last result. Only the groups that changed since then are '
+             'processed again, and their status changes are saved in a "-delta" report.')
+    parser.add_argument('--explain', action='store_true',
+        help='Also save the export rows behind each group next to the report, for the explain command.')
+
+    commands = parser.add_subparsers(dest='command')
+    batch_parser = commands.add_parser('batch', parents=[common],
+        help='Reconcile many SOL/TEW pairs without any menus, and print a JSON summary.')
+    batch_parser.add_argument('--manifest',
+        help='JSON or CSV file listing the pairs, with the keys "sol", "tew" and optionally "name" and "output".')
+    batch_parser.add_argument('--directory',
+        help='Folder with exports named like "may_sol.xlsx" and "may_tew.xlsx", paired by name.')
+    batch_parser.add_argument('--output-dir', default='.',
+        help='Where to write the reports. Default: current folder.')
+    batch_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+        help='How many pairs to reconcile at the same time. Default: number of cores.')
+    batch_parser.add_argument('--summary',
+        help='Also write the JSON summary to this file.')
+    batch_parser.add_argument('--state-dir',
+        help='Folder keeping the last result of each pair (by name), so re-runs are incremental (see --state).')
+    batch_parser.add_argument('--explain', action='store_true',
+        help='Also save the export rows behind each group next to each report, for the explain command.')
+
+    serve_parser = commands.add_parser('serve', parents=[common],
+        help='Run a local HTTP service that keeps the processed reports in memory, for quick re-checks.')
+    serve_parser.add_argument('--host', default='127.0.0.1',
+        help='Address to listen on. Default: this machine only.')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+        help='Processes reading the exports. Default: number of cores.')
+    serve_parser.add_argument('--cache-entries', type=int,
+        help='Processed reports kept in memory. Default: 32.')
+    serve_parser.add_argument('--upload-dir',
+        help='Where to keep uploaded exports. Default: a temporary folder, removed on exit.')
+
+    periods_parser = commands.add_parser('periods', parents=[common],
+        help='Keep the results of many monthly pairs in a history, and ask how the groups evolved.')
+    periods_parser.add_argument('--history', required=True,
+        help='Folder keeping one result per period. Created if needed.')
+    periods_parser.add_argument('--manifest',
+        help='Pairs to add, as for batch. The pair name is the period name, like "2024-05".')
+    periods_parser.add_argument('--directory',
+        help='Folder with exports named like "2024-05_sol.xlsx" and "2024-05_tew.xlsx", to add.')
+    periods_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+        help='How many periods to reconcile at the same time. Default: number of cores.')
+    query = periods_parser.add_mutually_exclusive_group()
+    query.add_argument('--stayed', nargs=2, metavar=('STATUS', 'N'),
+        help='The groups with this status in each of the last N periods, like "--stayed MISMATCH 3".')
+    query.add_argument('--new', metavar='STATUS',
+        help='The groups with this status that did not have it the period before, like "--new SOL_MISSING".')
+    periods_parser.add_argument('--period',
+        help='The period the query looks back from. Default: the latest one.')
+    periods_parser.add_argument('--output',
+        help='Save the rows of the groups found, in the periods looked at, as .xlsx or .csv.')
+
+    explain_parser = commands.add_parser('explain',
+        help='Show the export rows behind a group of a report saved with --explain.')
+    explain_parser.add_argument('index',
+        help='The explain index next to the report, like "diffcount-2024-05-31.explain.parquet".')
+    explain_parser.add_argument('--project', required=True,
+        help='The projectId of the group.')
+    explain_parser.add_argument('--target',
+        help='The target of the group, as in the report. Default: every target of the project.')
+    explain_parser.add_argument('--tgroup',
+        help='The tgroup of the group. Default: every tgroup.')
+    explain_parser.add_argument('--output',
+        help='Save the rows as .xlsx or .csv, instead of printing them.')
+
+    arguments = parser.parse_args(argv)
+    if arguments.shard_rows < 1:
+        parser.error('--shard-rows needs at least 1 row per sheet.')
+    if arguments.command == 'batch' and not (arguments.manifest or arguments.directory):
+        parser.error('batch needs a --manifest or a --directory.')
+    if arguments.command == 'periods' and arguments.stayed and not (arguments.stayed[1].isdigit() and int(arguments.stayed[1]) >= 1):
+        parser.error('--stayed needs a status and a number of periods (at least 1), like "--stayed MISMATCH 3".')
+
+    return arguments
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+
+    if arguments.command == 'batch':
+        import diffcount.batch as batch
+        return batch.run_batch(arguments)
+
+    if arguments.command == 'periods':
+        import diffcount.periods as periods
+        return periods.run_periods(arguments)
+
+    if arguments.command == 'explain':
+        import diffcount.explain as explain
+        return explain.run_explain(arguments)
+
+    if arguments.command == 'serve':
+        import diffcount.service as service
+        return service.run_service(arguments)
+
+    if arguments.profile or arguments.cprofile:
+        profiling.enable(cprofile=arguments.cprofile is not None)
+
+    try:
+        return run_interactive(arguments)
+    finally:
+        profiler = profiling.disable()
+        if profiler is not None and arguments.profile:
+            profiler.write_json(arguments.profile)
+        if profiler is not None and arguments.cprofile:
+            profiler.write_cprofile(arguments.cprofile)
+
+def open_cache(arguments):
+    '''The cache asked for with `--cache`, or None. Only opened once a file is chosen,
+        as the cache module brings pandas along, which would delay the file picker.
+    '''
+    if arguments.cache is None:
+        return None
+
+    import diffcount.cache as cache
+    return cache.from_arguments(arguments)
+
+def run_interactive(arguments):
+    '''The menu-driven comparison of one SOL file and one TEW file.'''
+    colorama_init()
+    # Greeting
+    print(Fore.YELLOW + 'DiffCount.' + Style.RESET_ALL)
+    print('SAP LX tool for comparing billing requests by SOL and TEW.')
+    print('Hosted at https://github.wdf.sap.corp/I567680/DiffCount.')
+    print('--------------------------------------------------\n\n')
+
+    logging.basicConfig(level=logging.DEBUG, style='{', datefmt='%H:%M:%S', format='[{asctime} {levelname}] {message}', stream=stdout)
+    add_logging_handler(f'diffcount_logs.log') # log-diffcount-{datetime.utcnow().strftime("%Y-%m-%d")}.log
+
+    # The files are picked long before there is anything to process,
+    # so the processing module (pandas and all) is imported meanwhile.
+    threading.Thread(target=importlib.import_module, args=('diffcount.diffcount',), daemon=True).start()
+
+    # Both files are chosen first, and only then loaded together.
+    defer_loading = arguments.parallel or arguments.state is not None
+
+    # The incremental run only reads the changed groups, so it has no source rows for the others.
+    explain = arguments.explain and arguments.state is None
+    if arguments.explain and not explain:
+        logging.log(logging.WARNING, '--explain is not supported with --state. No explain index will be saved.')
+    # The incremental run hashes the source rows of each group, which the cache does not keep.
+    if arguments.cache is not None and arguments.state is not None:
+        logging.log(logging.WARNING, '--cache is not used with --state. The exports will be read in full.')
+    sol_runs = tew_runs = None
+    # The source rows are written out to a temporary folder as they are read (see explain.py).
+    # It is removed once the index is saved, or when DiffCount exits.
+    runs_folder = tempfile.TemporaryDirectory(prefix='diffcount-explain-') if explain else None
+    explain_folder = runs_folder.name if explain else None
+
+    #===================================
+    # 1. SOL File
+    #===================================
+    while True:
+        try:
+            print( Fore.YELLOW + 'Step 1.' + Style.RESET_ALL + ' Please select the SOL file [.xls, .xlsx, .csv, .parquet].')
+            sol_filename = util.choose_file( columns.INPUT_EXTENSIONS )
+            if defer_loading:
+                # Loaded together with the TEW file, once it is chosen.
+                break
+            import diffcount.diffcount as diffcount
+            sol_data = diffcount.load_sol_report(sol_filename, sidecar=arguments.sidecar, chunked=arguments.chunked, lean=arguments.lean,
+                cache=open_cache(arguments), explain=explain_folder)
+            if explain:
+                sol_data, sol_runs = sol_data
+
+            break
+        except PermissionError:
+            print('Oh no! Permission denied!\nClose the file in excel so we can proceed.')
+            answer = util.make_menu(['Try Again', 'Quit'])
+            if answer == 'Quit':
+                return
+        except KeyError as ex:
+            print(f'Oh no! It seems you have gotten the wrong file! {ex}')
+            answer = util.make_menu(['Try Again', 'Quit'])
+            if answer == 'Quit':
+                return
+        except UserQuitException as ex:
+            print(f'\nGoodbye!')
+            return
+
+    if not defer_loading:
+        logging.log(logging.INFO, f'Success! There are {sol_data.shape[0]} rows in the processed SOL file.')
+
+    #===================================
+    # 2. TEW File
+    #===================================
+    while True:
+        try:
+            print( Fore.YELLOW + 'Step 2.' + Style.RESET_ALL + ' Please select the TEW file [.xls, .xlsx, .csv, .parquet].')
+            tew_filename = util.choose_file( columns.INPUT_EXTENSIONS )
+            if defer_loading:
+                break
+            import diffcount.diffcount as diffcount
+            tew_data = diffcount.load_tew_report(tew_filename, sidecar=arguments.sidecar, chunked=arguments.chunked, lean=arguments.lean,
+                cache=open_cache(arguments), explain=explain_folder)
+            if explain:
+                tew_data, tew_runs = tew_data
+            break
+        except PermissionError:
+            print('Oh no! Permission denied!\nClose the file in excel so we can proceed.')
+            answer = util.make_menu(['Try Again', 'Quit'])
+            if answer == 'Quit':
+                return
+        except KeyError as ex:
+            print(f'Oh no! Maybe it\'s the pivot table, but it seems you have gotten the wrong file! {ex}')
+            answer = util.make_menu(['Try Again', 'Quit'])
+            if answer == 'Quit':
+                return
+        except UserQuitException as ex:
+            print(f'\nGoodbye!')
+            return
+
+    if not defer_loading:
+        logging.log(logging.INFO, f'Success! There are {tew_data.shape[0]} rows in the processed TEW file.')
+
+    #===================================
+    # 1+2. Both Files at Once
+    #===================================
+    while defer_loading:
+        try:
+            import diffcount.diffcount as diffcount
+            if arguments.state is not None:
+                import diffcount.state as state
+                print( Fore.YELLOW + 'Loading.' + Style.RESET_ALL + f' Updating the last result kept in [{arguments.state}].')
+                data, delta = state.reconcile_incremental(sol_filename, tew_filename, arguments.state,
+                    arguments.abs_tolerance, arguments.rel_tolerance,
+                    sidecar=arguments.sidecar, chunked=arguments.chunked, lean=arguments.lean)
+                sol_data = tew_data = None
+            else:
+                print( Fore.YELLOW + 'Loading.' + Style.RESET_ALL + ' Reading the SOL and TEW files at the same time.')
+                sol_data, tew_data = diffcount.load_reports_parallel(sol_filename, tew_filename,
+                    sidecar=arguments.sidecar, chunked=arguments.chunked, lean=arguments.lean, cache=open_cache(arguments),
+                    explain=explain_folder)
+                if explain:
+                    (sol_data, sol_runs), (tew_data, tew_runs) = sol_data, tew_data
+            break
+        except PermissionError:
+            print('Oh no! Permission denied!\nClose the file in excel so we can proceed.')
+            answer = util.make_menu(['Try Again', 'Quit'])
+            if answer == 'Quit':
+                return
+        except KeyError as ex:
+            print(f'Oh no! It seems you have gotten the wrong file! {ex}')
+            return
+
+    if sol_data is not None and defer_loading:
+        logging.log(logging.INFO, f'Success! There are {sol_data.shape[0]} rows in the processed SOL file.')
+        logging.log(logging.INFO, f'Success! There are {tew_data.shape[0]} rows in the processed TEW file.')
+
+    #===================================
+    # 3. Merging Data
+    #===================================
+    result_filename = 'diffcount-' + datetime.utcnow().strftime('%Y-%m-%d') + '.xlsx'
+    print( Fore.YELLOW + 'Step 3.' + Style.RESET_ALL + f' Creating report file [{result_filename}].')
+
+    if arguments.state is None:
+        data = diffcount.merge_reports(sol_data, tew_data)
+        data = diffcount.fix_merged_dataframe(data, arguments.abs_tolerance, arguments.rel_tolerance)
+
+    logging.log(logging.INFO, f'Success! The resulting file {result_filename} will have {data.shape[0]} rows.')
+
+    # Save the file.
+    try:
+        diffcount.style_and_save(data, result_filename, constant_memory=arguments.constant_memory,
+            shard_by=arguments.shard_by, shard_rows=arguments.shard_rows, shard_workbooks=arguments.shard_workbooks)
+
+        if explain:
+            import diffcount.explain as explain_index
+            explain_index.write_index(explain_index.index_filename(result_filename), sol_runs + tew_runs)
+            runs_folder.cleanup()
+
+        if arguments.state is not None:
+            print(f'There are {len(delta)} groups with a different status than in the last run.')
+            diffcount.style_and_save(delta, state.delta_filename(result_filename), constant_memory=arguments.constant_memory,
+                shard_by=arguments.shard_by, shard_rows=arguments.shard_rows, shard_workbooks=arguments.shard_workbooks)
+    except PermissionError:
+        print('Oh no! Permission denied!\nClose the file in excel so we can proceed.')
+        answer = util.make_menu(['Try Again', 'Quit'])
+        if answer == 'Quit':
+            return
+    except Exception as ex:
+        logging.exception(f'Could not save resulting file! {ex} ')
+        return
+
+    #===================================
+    # 3. Checking and Printing
+    #===================================
+    diffcount.sanity_check_data(data,tew_data,sol_data)
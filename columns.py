@@ -1,5 +1,8 @@
 
 
+# Files offered in the file picker, and read by the batch and serve commands.
+INPUT_EXTENSIONS = ('.xls', '.xlsx', '.csv', '.parquet')
+
 SOL_COLUMN_MAPPING = {
     'projectId': 'External Project ID',
     'projectName': 'Content Name',
@@ -30,6 +33,16 @@ SOL_UNIT_NAME_MAPPING = {
     'sol_edc7':'EDC7',
 }
 
+# Targets in SOL come as 'enUS', and get an underscore to match TEW ('en_US').
+# These ones do not receive an underscore, and are renamed to the value instead.
+SOL_TARGET_EXCEPTIONS = {
+    'ckb': 'ckb',
+    'ceb': 'ceb',
+    'eo': 'eo',
+    'hil': 'hil',
+    'cnr': 'sla_ME',
+}
+
 SOL_GROUPBY_COLUMNS = [ 'projectId', 'projectName', 'target', 'tgroup']
 SOL_SUM_COLUMNS = ['sol_total'] + list(SOL_UNIT_NAME_MAPPING.keys())
 
@@ -61,15 +74,37 @@ TEW_COLUMN_MAPPING = {
     'tew_edc7':'STATS_VOLUME_MACHINE_TRANSLATION_EDC_WORDS_CATEGORY7_WORDCOUNT',
 }
 
+# Targets in TEW that are named differently than in SOL.
+TEW_TARGET_RENAMING = {
+    'sr_RS_Latn' : 'sr_RS',
+    'az_AZ_Latn' : 'az_AZ',
+    'bs_BA_Latn' : 'bs_BA',
+    'sr_RS_Cyrl' : 'sr_CP',
+}
+
 TEW_GROUPBY_COLUMNS = [ 'projectId','tew_name', 'target', 'tgroup' ]
 
+# TEW splits some counts in two (the fuzzy matches, and the fuzzy repeats).
+# They are added up into one column after aggregating, and the parts dropped.
+TEW_DERIVED_COLUMNS = {
+    'tew_95': ['tew_95_a', 'tew_95_b'],
+    'tew_85': ['tew_85_a', 'tew_85_b'],
+    'tew_75': ['tew_75_a', 'tew_75_b'],
+}
+
 JOIN_KEY_COLUMNS = [ 'projectId', 'target', 'tgroup' ]
 
+# Id columns, normalised as they are read, so the same id is the same value in every format
+# (see readers.normalize_ids).
+ID_COLUMNS = [ 'projectId' ]
+
 FINAL_COLUMN_ORDER = [
     # Group-By Columns
     'projectId', 'projectName', 'target', 'tgroup',
     # Generated as 'ok' if totals match, else 'mismatch'
     'status',
+    # Bit i is set if the i-th pair of MISMATCH_PAIRS does not match.
+    'mismatch_mask',
     # START OF COLUMN PAIRS.
     'sol_total', 'tew_total',
     'sol_no_match', 'tew_no_match',
@@ -108,4 +143,67 @@ FINAL_COLUMN_PAIRS = [
     ('sol_edc5','tew_edc5'),
     ('sol_edc6','tew_edc6'),
     ('sol_edc7','tew_edc7')
-]
\ No newline at end of file
+]
+
+# Every status a row of the report can have.
+STATUS_TYPES = ["SOL_MISSING", "TEW_MISSING", "OK", "MISMATCH"]
+
+# Extra sheets of the report, each summing the rows by one column (see diffcount.summary_tables).
+SUMMARY_SHEETS = {
+    'Summary by Vendor': 'tgroup',
+    'Summary by Language': 'target',
+    'Summary by Status': 'status',
+}
+
+# Excel's row limit, counting the header. A report with more rows is split in several sheets.
+EXCEL_MAX_ROWS = 1048576
+SHARD_ROWS = EXCEL_MAX_ROWS - 1
+
+# Every pair that is compared, the totals first. The order gives the bits of 'mismatch_mask'.
+MISMATCH_PAIRS = [('sol_total', 'tew_total')] + FINAL_COLUMN_PAIRS
+
+# Counts that differ by at most the absolute tolerance, or by at most the relative
+# tolerance times the larger of the two, still match. Exact by default.
+MISMATCH_ABS_TOLERANCE = 0.0
+MISMATCH_REL_TOLERANCE = 0.0
+
+# Explicit dtypes for the mapped columns, so the readers do not need to guess
+# (and do not keep everything as python objects). Key columns stay as text,
+# since they are compared against the other report.
+SOL_COLUMN_DTYPES = {
+    'projectId': 'object',
+    'projectName': 'object',
+    'target': 'object',
+    'tgroup': 'object',
+    'step': 'object',
+    'sol_total': 'float64',
+    'sol_total_unit': 'object',
+    'sls_unit': 'object',
+}
+
+TEW_COLUMN_DTYPES = {
+    'projectId': 'object',
+    'target': 'object',
+    'tgroup': 'object',
+    'tew_name': 'object',
+}
+TEW_COLUMN_DTYPES.update({
+    col: 'float64' for col in TEW_COLUMN_MAPPING.keys() if col.startswith('tew_') and col != 'tew_name'
+})
+
+COLUMN_DTYPES = {'sol': SOL_COLUMN_DTYPES, 'tew': TEW_COLUMN_DTYPES}
+
+# Every known layout of each export, by version, oldest first: the columns to read
+# and the columns added up out of them. The version of a file is told by its header
+# alone (see schemas.py), so a new layout of an export only needs an entry here.
+EXPORT_SCHEMAS = {
+    'sol': {
+        'v1': {'mapping': SOL_COLUMN_MAPPING, 'derived': {}},
+    },
+    'tew': {
+        'v1': {'mapping': TEW_COLUMN_MAPPING, 'derived': TEW_DERIVED_COLUMNS},
+    },
+}
+
+# How many rows the streaming readers hold at a time before handing a chunk over.
+READ_CHUNK_SIZE = 50000
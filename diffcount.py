@@ -1,186 +1,420 @@
 ''' DiffCount. Compares two reports of billing/wordcount and makes a comparison report. '''
 
+import os
 import logging
+import functools
 import pandas
 import numpy
 import diffcount.util as util
 import diffcount.columns as columns
-from diffcount.util import UserQuitException
-from datetime import datetime
-from colorama import Fore, Style
-from colorama import init as colorama_init
-from sys import stdout
+import diffcount.readers as readers
+import diffcount.schemas as schemas
+import diffcount.explain as explain_index
+import diffcount.profiling as profiling
+from concurrent.futures import ProcessPoolExecutor
 
-from xlsxwriter.utility import xl_col_to_name
+import xlsxwriter
 
-def add_logging_handler(logging_filename, logging_level = logging.DEBUG):
-    '''With the logging module already configured, appends a file as logging output.'''
-    logging_file = logging.FileHandler(logging_filename)
-    logging_file.setLevel(logging_level)
-    logging_file.setFormatter(logging.Formatter(fmt='[%(asctime)s %(levelname)s] %(message)s',datefmt='%H:%M:%S'))
+# What each report is aggregated by.
+GROUPBY_COLUMNS = {'sol': columns.SOL_GROUPBY_COLUMNS, 'tew': columns.TEW_GROUPBY_COLUMNS}
 
-    logging.log(logging.INFO, f'Setting up logging file as [{logging_filename}]')
+# Partial sums kept before adding them up, when aggregating an export chunk by chunk.
+COMBINE_ROWS = 1000000
 
-    logger = logging.getLogger()
-    logger.addHandler(logging_file)
+# How many numeric cells per column are looked at to guess its width, when saving in constant memory mode.
+WIDTH_SAMPLE_SIZE = 10000
 
-def get_dataframe(filename, column_mapping):
-    '''Loads a XLSX file as a dataframe, pulling the columns in the mapping,
+# First sheet of a sharded report, linking to the shards.
+INDEX_SHEET = 'Index'
+
+# Cells of the report marked as not matching.
+MISMATCH_FORMAT = {'bg_color': '#FFC7CE', 'font_color': '#9C0006'}
+
+@profiling.profiled()
+def get_dataframe(filename, column_mapping, sidecar=False, lean=False, sheets=None, column_dtypes=None):
+    '''Loads a XLSX/XLS/CSV/Parquet file as a dataframe, pulling the columns in the mapping,
         and renaming them as the mapping asks.
 
         Example:
         column_mapping = { 'value' : 'Item Value'}
         will take the column named 'Item Value' and make it accessible as
         df['value'].
+
+        Only the mapped columns are ever parsed, and the rows are streamed in
+        chunks (see readers.py), so memory depends on the mapping, not on how
+        wide the export is. A missing column raises a KeyError before any row is read.
+
+        With `sidecar`, the mapped columns are also kept in a Parquet file next to the
+        export, and later runs on the same (unchanged) export read that instead.
+
+        With `lean`, the keys are read as categoricals and the whole-number counts
+        as small integers (see readers.compact_dtypes), to use less memory.
+
+        A workbook is read from every sheet with the mapped columns (or only from the given
+        `sheets`), and a list of files is read as one export, one file after the other.
+
+        The columns are cast to `column_dtypes`, usually the dtypes of the load plan (see schemas.py).
     '''
-    logging.log(logging.INFO, f"Reading dataframe from file: {filename}")
-    loaded_file = pandas.read_excel(filename)
+    logging.log(logging.INFO, f"Reading dataframe from file: {filename}" + (f" (sheet {', '.join(sheets)})" if sheets else ''))
 
-    original_cols = column_mapping.values()
-    for col in original_cols:
-        if col not in loaded_file.columns:
-            print( Fore.YELLOW + f"Error! " + Style.RESET_ALL + f"  Invalid Excel Format. Column named <{col}> not found.")
-            # The line below will throw a convenient exception. This error message above is just more user-friendly.
+    if not isinstance(filename, (str, os.PathLike)):
+        # An export split in several files, read as one.
+        return readers.concat_chunks([get_dataframe(part, column_mapping, sidecar=sidecar, lean=lean, column_dtypes=column_dtypes)
+            for part in filename])
 
-    data = loaded_file[ (column_mapping.values()) ].copy()
-    data.rename(columns=util.reverse_dict(column_mapping), inplace=True)
+    if sidecar:
+        return readers.read_with_sidecar(filename, column_mapping, lean=lean, column_dtypes=column_dtypes)
 
-    return data
+    return readers.read_dataframe(filename, column_mapping, lean=lean, sheets=sheets, column_dtypes=column_dtypes)
 
 def fix_sol_target(row):
     '''For a target like 'enUS', we need to convert it to 'en_US'.'''
-    # These do not receive an underscore.
-    exceptions = ['ckb', 'ceb', 'eo', 'hil', 'cnr']
-
-    if row not in exceptions:
-        row = row[:2] + "_" + row[2:]
+    # Some do not receive an underscore, or are renamed (see columns.SOL_TARGET_EXCEPTIONS).
+    if row in columns.SOL_TARGET_EXCEPTIONS:
+        return columns.SOL_TARGET_EXCEPTIONS[row]
 
-    if row == 'cnr':
-        row = 'sla_ME'
-
-    return row
+    return row[:2] + "_" + row[2:]
 
 def fix_tew_target(row):
     '''Change the name of the target so that it matches the SOL one.'''
-    renaming_values = {
-        'sr_RS_Latn' : 'sr_RS',
-        'az_AZ_Latn' : 'az_AZ',
-        'bs_BA_Latn' : 'bs_BA',
-        'sr_RS_Cyrl' : 'sr_CP'
-    }
+    return columns.TEW_TARGET_RENAMING.get(row, row)
 
-    if row in list(renaming_values.keys()):
-        row = renaming_values[row]
+def normalize_targets(targets, fix_target):
+    '''Applies `fix_target` to a column of targets, once per distinct target.
 
-    return row
+        An export has a few hundred languages but many thousand rows, so the
+        column is encoded as a categorical, only its categories are fixed,
+        and the fixed names are broadcast back to the rows. Missing targets stay missing.
+    '''
+    categorical = pandas.Categorical(targets)
 
-def fix_sol_dataframe(data):
-    # There are a lot of zeroed rows (~5x the content rows) that really need to be filtered
-    # But apparently, there may be relevant negative values.
-    data = data[data.sol_total != 0].copy()
-    data.loc[:,'tgroup']= 'SAPLSP' + data.tgroup
-    data.target = data.target.apply(lambda x: fix_sol_target(x))
+    fixed_categories = numpy.array([fix_target(target) for target in categorical.categories] + [numpy.nan], dtype=object)
+    # Missing values have the code -1, which picks the trailing NaN above.
+    fixed = fixed_categories[categorical.codes]
 
-    # There are some rows in SOL without any LSP, while in TEW that isn't the case.
-    # They are used only for internal recordkeeping, and therefore not for billing.
-    data = data[ data['tgroup'].isnull() == False ]
+    return pandas.Series(fixed, index=targets.index, name=targets.name, dtype=object)
 
-    # Latinization does not affect billing, so it is irrelevant to us.
-    data = data[ data['step'] != 'LATINIZE']
-    del data['step']
+def add_prefix(values, prefix):
+    '''prefix + values. Categorical columns stay categorical, and only their categories are renamed.'''
+    if isinstance(values.dtype, pandas.CategoricalDtype):
+        return values.cat.rename_categories(prefix + values.cat.categories.astype(str))
 
-    # Every line will have a SLS_UNIT, and we need to have each SLS_UNIT count in a different
-    # column. It follows, then, that for each line, we copy the billing quantity to the matching
-    # SLS_UNIT-specific column.
-    for new_name, unit_key_name in columns.SOL_UNIT_NAME_MAPPING.items():
-        # If a row has SLS_UNIT = 100_MATCH, then the column '100_MATCH' is assigned as billing quantity.
-        data[new_name] = \
-            numpy.select(
-               [data.sls_unit != unit_key_name, True],
-               [0, data.sol_total])
+    return prefix + values
+
+def uncategorize(data):
+    '''Turns categorical columns back into plain objects. Used on the aggregated reports,
+        which have few rows, so the merge and the report can fill in values freely.
+    '''
+    for col in data.columns:
+        if isinstance(data[col].dtype, pandas.CategoricalDtype):
+            data[col] = data[col].astype(object)
+
+    return data
+
+def fix_sol_keys(data):
+    '''The target and tgroup of raw SOL rows, as they are named in TEW. Returns (target, tgroup).'''
+    return normalize_targets(data.target, fix_sol_target), add_prefix(data.tgroup, 'SAPLSP')
+
+def fix_tew_keys(data):
+    '''The target and tgroup of raw TEW rows, as they are named in SOL. Returns (target, tgroup).'''
+    return normalize_targets(data.target, fix_tew_target), data.tgroup
+
+def sol_kept_rows(data):
+    '''The raw SOL rows that count for billing. The others are left out of the report.'''
+    # All the row filters are combined into one mask, so the frame is only copied once.
+    return (
+        # There are a lot of zeroed rows (~5x the content rows) that really need to be filtered
+        # But apparently, there may be relevant negative values.
+        (data.sol_total != 0)
+        # There are some rows in SOL without any LSP, while in TEW that isn't the case.
+        # They are used only for internal recordkeeping, and therefore not for billing.
+        & data['tgroup'].notnull()
+        # Latinization does not affect billing, so it is irrelevant to us.
+        & (data['step'] != 'LATINIZE')
+    )
+
+def tew_kept_rows(data):
+    '''The raw TEW rows that count. The others are left out of the report.'''
+    # There are a lot of zeroed rows (~5x the content rows) that really need to be filtered
+    # But apparently, there may be relevant negative values.
+    return data.tew_total != 0
+
+@profiling.profiled()
+def fix_sol_dataframe(data):
+    data = data.loc[sol_kept_rows(data), [col for col in data.columns if col != 'step']]
+    data.target, data.tgroup = fix_sol_keys(data)
 
     # Sometimes the billing quantity is not summed in words, but in hours.
-    # We need to discard those. Also, sol_total_unit is not needed afterwards.
+    # We need to discard those from the total. The SLS_UNIT-specific columns below
+    # still take the quantity as it was, so we keep a copy of it before zeroing.
+    unit_quantity = data['sol_total'].to_numpy(dtype='float64', copy=True)
     data.loc[data['sol_total_unit'] == 'H', 'sol_total'] = 0
     del data['sol_total_unit']
 
-    # After the above change, we do not need the SLS_UNIT column anymore,
-    # and it needs to be removed before the GROUP BY
-    del data['sls_unit']
+    grouped = data.groupby(columns.SOL_GROUPBY_COLUMNS, as_index=False, sort=True, observed=True)
+    result = grouped['sol_total'].sum()
 
-    data = data.groupby(columns.SOL_GROUPBY_COLUMNS, as_index=False).agg( 'sum' )
+    # Every line will have a SLS_UNIT, and we need to have each SLS_UNIT count in a different
+    # column. It follows, then, that for each line, we add the billing quantity to the matching
+    # SLS_UNIT-specific column of its group. This is done for all units at once (see pivot_sol_units).
+    group_ids = grouped.ngroup().to_numpy(dtype='float64', na_value=-1).astype('int64')
+    unit_sums = pivot_sol_units(data['sls_unit'], unit_quantity, group_ids, len(result))
 
-    return data
+    for i, new_name in enumerate(columns.SOL_UNIT_NAME_MAPPING.keys()):
+        result[new_name] = unit_sums[:, i]
 
-def fix_tew_dataframe(data):
-    # There are a lot of zeroed rows (~5x the content rows) that really need to be filtered
-    # But apparently, there may be relevant negative values.
-    data = data[data.tew_total != 0].copy()
-    data.target = data.target.apply(lambda x: fix_tew_target(x))
+    return uncategorize(result)
+
+def pivot_sol_units(sls_unit, quantity, group_ids, n_groups):
+    '''Sums the billing quantity of each row into the column of its SLS_UNIT, per group.
+
+        Returns a (groups x units) array, with the units in the order of
+        columns.SOL_UNIT_NAME_MAPPING. Rows with an unknown SLS_UNIT, or with
+        no group (group id -1), are left out, as are missing quantities.
+    '''
+    unit_keys = list(columns.SOL_UNIT_NAME_MAPPING.values())
+    n_units = len(unit_keys)
+
+    # Unknown units get the code -1.
+    unit_codes = pandas.Categorical(sls_unit, categories=unit_keys).codes.astype('int64')
 
-    data = data.groupby(columns.TEW_GROUPBY_COLUMNS, as_index=False).agg( 'sum' )
+    valid = (group_ids >= 0) & (unit_codes >= 0)
+    cells = group_ids[valid] * n_units + unit_codes[valid]
+    weights = numpy.nan_to_num(quantity[valid])
+
+    unit_sums = numpy.bincount(cells, weights=weights, minlength=n_groups * n_units)
+    return unit_sums.reshape(n_groups, n_units)
+
+@profiling.profiled()
+def fix_tew_dataframe(data, derived=columns.TEW_DERIVED_COLUMNS):
+    data = data.loc[tew_kept_rows(data), list(data.columns)]
+    data.target, data.tgroup = fix_tew_keys(data)
+
+    data = data.groupby(columns.TEW_GROUPBY_COLUMNS, as_index=False, observed=True).agg( 'sum' )
+    data = uncategorize(data)
 
     # We need to sum the fuzzy match and the fuzzy repeats, each pair at the time
     # STATS_VOLUME_MEDIUM_FUZZY_MATCH_WORDS + STATS_VOLUME_MEDIUM_FUZZY_REPEATS_WORDS, for example.
     # In the dataframe, they are named tew_85_a, tew_85_b, respectively.
     # So we will create a column tew_85, which is their sum, and delete the two original columns.
-    to_sum_cols = ['tew_95', 'tew_85', 'tew_75']
-    for col in to_sum_cols:
-        name_a = col + '_a'
-        name_b = col + '_b'
+    # Which columns are summed depends on the version of the export (see schemas.py).
+    for col, parts in derived.items():
+        data[col] = data[parts[0]]
+        for part in parts[1:]:
+            data[col] = data[col] + data[part]
 
-        data[col] = data[name_a] + data[name_b]
-
-        del data[name_a]
-        del data[name_b]
-        pass
+        for part in parts:
+            del data[part]
 
     return data
 
-def style_and_save(data, filename):
+def source_rows(data, plan, filename, sheet=None, first_row=0):
+    '''The raw rows that make up each group of the report, to explain it later (see explain.py):
+        the kept rows, under their names in the export, with their join keys as in the report,
+        and where they come from. `source_row` is the row in the export, counting the header
+        as row 1, and from `first_row` on (rows of earlier chunks). For a file read through its
+        sidecar, which holds all its sheets, the rows are counted across them.
+    '''
+    keep = (sol_kept_rows(data) if plan.role == 'sol' else tew_kept_rows(data)).to_numpy(dtype=bool)
+    kept = data[keep]
 
-    #===================================
-    # 1. Reorder all columns
-    #===================================
+    rows = pandas.DataFrame({'role': plan.role, 'projectId': kept['projectId'].to_numpy()})
+    rows['target'], rows['tgroup'] = (key.to_numpy() for key in (fix_sol_keys(kept) if plan.role == 'sol' else fix_tew_keys(kept)))
+    rows['source_file'] = str(filename)
+    rows['source_sheet'] = sheet
+    rows['source_row'] = numpy.flatnonzero(keep) + first_row + 2
 
-    cols = data.columns.values.tolist()
-    try:
-        for col_in_order in columns.FINAL_COLUMN_ORDER:
-            cols.remove(col_in_order)
-        # '+cols' to make so that columns outside the
-        # constant still exist, but in the end.
-        cols = columns.FINAL_COLUMN_ORDER + cols
-    except ValueError as ex:
-        print('Trying to get columns that do not exist in the final col order. ')
-        print(set(columns.FINAL_COLUMN_ORDER) - set(cols))
+    for col, original in plan.column_mapping.items():
+        rows[original] = kept[col].to_numpy()
 
-    data = data[cols]
+    return uncategorize(rows)
 
-    # AESTHETIC CHOICE
-    show_as_indexes = False
-    # It is basically a matter of presentation whether we
-    # want to set a column with a simple index, if the join
-    # columns should themselves be the index.
-    if show_as_indexes:
-        data.set_index(columns.JOIN_KEY_COLUMNS, inplace=True)
+def track_source_rows(chunks, plan, filename, sheet, folder, runs):
+    '''Passes the chunks on, while writing the source_rows of each one to a run in `folder`
+        (see explain.write_run), added to `runs`.
+    '''
+    first_row = 0
+    for chunk in chunks:
+        runs.append(explain_index.write_run(source_rows(chunk, plan, filename, sheet, first_row), plan, folder))
+        first_row += chunk.shape[0]
+        yield chunk
+
+def fix_report_dataframe(data, plan):
+    '''fix_sol_dataframe or fix_tew_dataframe, as the load plan of the export asks (see schemas.py).'''
+    if plan.role == 'sol':
+        return fix_sol_dataframe(data)
+    return fix_tew_dataframe(data, plan.derived)
+
+def write_constant_memory(data, filename, sheet_name='Sheet1', column_order=None, marked_cells=None, mark_format=None, workbook=None):
+    '''Writes the dataframe with xlsxwriter's constant memory mode, row by row,
+        so only the current row is held in memory instead of the whole workbook.
+
+        The layout is the same as data.to_excel(): a header row, and the index in column A.
+        With `column_order`, the columns are written in that order, without reordering
+        (and so copying) the dataframe first.
+        `marked_cells` ({position in column_order: boolean rows}) are written with `mark_format`,
+        as cells cannot be formatted once their row is done.
+        With a `workbook` (opened in constant memory mode), the sheet is added to it instead.
+        Returns (workbook, worksheet), still open, so formatting can be added before closing.
+    '''
+    column_order = list(data.columns) if column_order is None else column_order
+
+    if workbook is None:
+        workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    worksheet = workbook.add_worksheet(sheet_name)
+
+    # Same look as the header pandas writes.
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    worksheet.write_row(0, 1, [str(col) for col in column_order], header_format)
+
+    # Row -> positions to mark in it.
+    marks = {}
+    for position, rows in (marked_cells or {}).items():
+        for i in numpy.flatnonzero(rows):
+            marks.setdefault(i, []).append(position)
+    cell_format = workbook.add_format(mark_format) if marks else None
+
+    rows = zip(data.index, *[data[col] for col in column_order])
+    for i, row in enumerate(rows):
+        # Missing values are left as blank cells (NaN != NaN).
+        values = [None if value != value else value for value in row]
+        worksheet.write_row(i + 1, 0, values)
+
+        for position in marks.get(i, ()):
+            # +1, as the first column is the index.
+            worksheet.write(i + 1, position + 1, values[position + 1], cell_format)
+
+    return workbook, worksheet
+
+@profiling.profiled()
+def summary_tables(data):
+    '''The report summed up by vendor, by language and by status (see columns.SUMMARY_SHEETS),
+        so nobody has to pivot the detail sheet by hand.
+
+        The detail rows are grouped only once, by all three columns together. Each summary
+        then adds up that (small) result. Returns {sheet name: table}, each table indexed by its
+        column, with the rows, the SOL and TEW totals, their difference, and, but for the
+        status summary, the rows of each status.
+    '''
+    dimensions = list(columns.SUMMARY_SHEETS.values())
 
-    #===================================
-    # 2. Create an Excel Writer
-    #===================================
+    cube = data.groupby(dimensions, sort=False, dropna=False).agg(
+        rows=('status', 'size'), sol_total=('sol_total', 'sum'), tew_total=('tew_total', 'sum'))
+    cube = cube.reset_index()
 
-    writer = pandas.ExcelWriter(filename, engine='xlsxwriter')
-    data.to_excel(writer)
+    # Other statuses, like REMOVED in the delta report, go after the usual ones.
+    statuses = columns.STATUS_TYPES + sorted(set(cube['status'].dropna()) - set(columns.STATUS_TYPES))
+
+    tables = {}
+    for sheet_name, dimension in columns.SUMMARY_SHEETS.items():
+        table = cube.groupby(dimension, sort=True, dropna=False)[['rows', 'sol_total', 'tew_total']].sum()
+        table['difference'] = table['tew_total'] - table['sol_total']
+
+        if dimension != 'status':
+            by_status = cube.pivot_table(index=dimension, columns='status', values='rows', aggfunc='sum', fill_value=0, dropna=False)
+            table = table.join(by_status.reindex(columns=statuses, fill_value=0))
+        else:
+            table = table.reindex(statuses, fill_value=0)
 
-    workbook  = writer.book
-    worksheet = writer.sheets['Sheet1']
+        tables[sheet_name] = table
+
+    return tables
+
+def write_summary_sheets(workbook, tables):
+    '''Adds a sheet per summary table after the detail sheet, laid out like data.to_excel().
+        Written cell by cell, so it also works in constant memory mode.
+    '''
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+
+    for sheet_name, table in tables.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [table.index.name] + [str(col) for col in table.columns], header_format)
+
+        for i, row in enumerate(table.itertuples(index=True, name=None)):
+            worksheet.write_row(i + 1, 0, [None if value != value else value for value in row])
+
+        worksheet.set_column(0, 0, width=max([len(str(table.index.name))] + [len(str(value)) for value in table.index]) + 2)
+        util.autowidth_excel_columns(table, worksheet)
+        worksheet.freeze_panes(1, 1)
+
+def sheet_names(names, taken=()):
+    '''Valid, unique sheet names for the given names: at most 31 characters, without []:*?/\\,
+        and different from the `taken` ones (ignoring case, as Excel does).
+    '''
+    taken = {name.lower() for name in taken}
+    result = []
+
+    for name in names:
+        name = ''.join('_' if char in '[]:*?/\\' else char for char in str(name)).strip("'") or '_'
+        # Excel does not take an apostrophe at either end, also once cut to 31 characters.
+        candidate = name[:31].rstrip("'")
+        i = 1
+        while candidate.lower() in taken:
+            i += 1
+            suffix = f' ~{i}'
+            candidate = name[:31 - len(suffix)] + suffix
+
+        taken.add(candidate.lower())
+        result.append(candidate)
+
+    return result
+
+def report_shards(data, shard_by='rows', shard_rows=columns.SHARD_ROWS):
+    '''Splits the report rows into shards of at most `shard_rows` rows, either in order ('rows'),
+        or one per vendor ('tgroup'), a vendor with too many rows taking several shards.
+        Returns a list of (sheet name, row positions).
+    '''
+    if shard_by == 'rows':
+        starts = range(0, max(data.shape[0], 1), shard_rows)
+        names = [f'Rows {start + 1}-{min(start + shard_rows, data.shape[0])}' for start in starts]
+        positions = [numpy.arange(start, min(start + shard_rows, data.shape[0])) for start in starts]
+    elif shard_by == 'tgroup':
+        vendors = data['tgroup'].astype(object).where(data['tgroup'].notnull(), '(no vendor)').astype(str)
+        codes, uniques = pandas.factorize(vendors, sort=True)
+        # The rows of each vendor, in their order in the report.
+        order = numpy.argsort(codes, kind='stable')
+        bounds = numpy.cumsum(numpy.bincount(codes, minlength=len(uniques)))[:-1]
+
+        names, positions = [], []
+        for vendor, rows in zip(uniques, numpy.split(order, bounds)):
+            pieces = range(0, len(rows), shard_rows)
+            for i, start in enumerate(pieces):
+                names.append(vendor if len(pieces) == 1 else f'{vendor} ({i + 1})')
+                positions.append(rows[start:start + shard_rows])
+    else:
+        raise ValueError(f'Unknown shard mode <{shard_by}>, expected "rows" or "tgroup".')
+
+    return list(zip(sheet_names(names, taken=[INDEX_SHEET] + list(columns.SUMMARY_SHEETS)), positions))
+
+def write_detail_sheet(writer, workbook, data, cols, sheet_name, constant_memory=False, show_as_indexes=False):
+    '''Writes the report rows as one sheet, with the status/mismatch colors, the column widths
+        and the frozen header. `writer` is the pandas ExcelWriter, unless in `constant_memory` mode.
+    '''
+    # The counts that do not match are marked right in the cells, computed here in one
+    # pass (see mismatch_flags), instead of as formulas Excel evaluates cell by cell on opening.
+    marked_cells = mismatch_cells(data, cols)
+
+    if constant_memory:
+        workbook, worksheet = write_constant_memory(data, None, sheet_name, column_order=cols,
+            marked_cells=marked_cells, mark_format=MISMATCH_FORMAT, workbook=workbook)
+    else:
+        data.to_excel(writer, sheet_name=sheet_name)
+
+        worksheet = writer.sheets[sheet_name]
+
+        mark_format = workbook.add_format(MISMATCH_FORMAT)
+        for position, rows in marked_cells.items():
+            values = data[cols[position]].to_numpy()
+            for i in numpy.flatnonzero(rows):
+                # +1, as the first column is the index.
+                worksheet.write(i + 1, position + 1, None if values[i] != values[i] else values[i], mark_format)
     max_row = data.shape[0]
 
     cell_format = workbook.add_format()
     cell_format.set_bold()
     cell_format.set_font_color('red')
 
-    bad_format = workbook.add_format({'bg_color': '#FFC7CE',
-                            'font_color': '#9C0006'})
+    bad_format = workbook.add_format(MISMATCH_FORMAT)
 
     ok_format = workbook.add_format({'bg_color': '#C6EFCE',
                             'font_color': '#006100'})
@@ -200,7 +434,7 @@ def style_and_save(data, filename):
         worksheet.set_column('A:A', options={'hidden':True})
 
     #===================================
-    # 3. Conditional Formatting of 'Ok' and 'Mismatch' strings.
+    # Conditional Formatting of 'Ok' and 'Mismatch' strings.
     #===================================
     # Rules have a 'last added' priority.
 
@@ -228,163 +462,500 @@ def style_and_save(data, filename):
                                 'value':     '"SOL_MISSING"',
                                 'format':    weird2_format})
 
-    util.autowidth_excel_columns(data,worksheet)
+    util.autowidth_excel_columns(data,worksheet, sample_size=WIDTH_SAMPLE_SIZE if constant_memory else None, column_order=cols)
+
+    # Makes the first row always visible, even if the user scrolls down.
+    worksheet.freeze_panes(1, 0)
+
+def open_workbook(filename, constant_memory=False):
+    '''Returns (pandas ExcelWriter, or None in `constant_memory` mode, xlsxwriter workbook).'''
+    if constant_memory:
+        return None, xlsxwriter.Workbook(filename, {'constant_memory': True})
+
+    writer = pandas.ExcelWriter(filename, engine='xlsxwriter')
+    return writer, writer.book
+
+def close_workbook(writer, workbook):
+    if writer is None:
+        workbook.close()
+    else:
+        writer.close()
+
+def write_shard_workbook(data, filename, cols, sheet_name, constant_memory=False):
+    '''Saves one shard as a workbook of its own. Runs in a worker process.'''
+    writer, workbook = open_workbook(filename, constant_memory)
+    write_detail_sheet(writer, workbook, data, cols, sheet_name, constant_memory)
+    close_workbook(writer, workbook)
+
+    logging.log(logging.INFO, f'Saved shard [{sheet_name}] as {filename}.')
+
+def shard_filename(filename, i):
+    '''diffcount-2024-05-01.xlsx gives diffcount-2024-05-01-001.xlsx for the first shard.'''
+    stem, extension = os.path.splitext(filename)
+    return f'{stem}-{i + 1:03}{extension}'
+
+def write_index_sheet(workbook, data, shards, shard_filenames=None):
+    '''Adds the sheet listing the shards, each with a link to it (to its sheet, or to
+        its workbook in `shard_filenames`), its rows by status and its totals.
+    '''
+    worksheet = workbook.add_worksheet(INDEX_SHEET)
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+
+    header = ['shard', 'rows'] + columns.STATUS_TYPES + ['sol_total', 'tew_total']
+    if shard_filenames is not None:
+        header.append('file')
+    worksheet.write_row(0, 0, header, header_format)
+
+    status = data['status'].to_numpy()
+    for i, (name, rows) in enumerate(shards):
+        if shard_filenames is None:
+            # Apostrophes in a quoted sheet name are doubled, as in Excel formulas.
+            quoted = name.replace("'", "''")
+            worksheet.write_url(i + 1, 0, f"internal:'{quoted}'!A1", string=name)
+        else:
+            # Relative, so the report and its shards can be moved together.
+            worksheet.write_url(i + 1, 0, f'external:{os.path.basename(shard_filenames[i])}', string=name)
+
+        counts = pandas.Series(status[rows]).value_counts()
+        worksheet.write_row(i + 1, 1, [len(rows)] + [int(counts.get(name, 0)) for name in columns.STATUS_TYPES]
+            + [float(data['sol_total'].to_numpy()[rows].sum()), float(data['tew_total'].to_numpy()[rows].sum())])
+        if shard_filenames is not None:
+            worksheet.write(i + 1, len(header) - 1, os.path.basename(shard_filenames[i]))
+
+    worksheet.set_column(0, 0, width=max([len('shard')] + [len(name) for name, rows in shards]) + 2)
+    worksheet.set_column(1, len(header) - 1, width=max(len(col) for col in header) + 2)
+    worksheet.freeze_panes(1, 1)
+
+@profiling.profiled()
+def style_and_save(data, filename, constant_memory=False, summaries=True,
+        shard_by=None, shard_rows=columns.SHARD_ROWS, shard_workbooks=False):
+    '''Saves the report as a XLSX file, with the columns in order and the status/mismatch colors.
+
+        With `constant_memory`, the rows are streamed to the file as they are written,
+        and the column widths are estimated from a sample of the numeric cells.
+        With `summaries`, the sheets of summary_tables are added after the detail sheet.
+
+        With `shard_by` ('rows' or 'tgroup', see report_shards), the rows are split in sheets
+        of at most `shard_rows` rows, after an index sheet linking to each one. With
+        `shard_workbooks`, each shard is saved as a workbook of its own instead (see
+        shard_filename), all at the same time, and the report only keeps the index and summaries.
+        A report too large for one sheet is always split by rows.
+    '''
 
     #===================================
-    # 4. Conditional Formatting of Number Cols.
+    # 1. Reorder all columns
     #===================================
 
-    for sol_col_title, tew_col_title in columns.FINAL_COLUMN_PAIRS:
-        sol_col_i = columns.FINAL_COLUMN_ORDER.index(sol_col_title)
-        tew_col_i = columns.FINAL_COLUMN_ORDER.index(tew_col_title)
+    cols = data.columns.values.tolist()
+    try:
+        for col_in_order in columns.FINAL_COLUMN_ORDER:
+            cols.remove(col_in_order)
+        # '+cols' to make so that columns outside the
+        # constant still exist, but in the end.
+        cols = columns.FINAL_COLUMN_ORDER + cols
+    except ValueError as ex:
+        logging.log(logging.WARNING, f'Trying to get columns that do not exist in the final col order: {set(columns.FINAL_COLUMN_ORDER) - set(cols)}')
 
-        # Adding one because the first column in Excel is the index.
-        if not show_as_indexes:
-            sol_col_i += 1
-            tew_col_i += 1
+    if not constant_memory:
+        # The streamed writer takes the order as it is, so only pandas needs the copy.
+        data = data[cols]
 
-        sol_col = xl_col_to_name(sol_col_i)
-        tew_col = xl_col_to_name(tew_col_i)
-        worksheet.conditional_format(1,tew_col_i, max_row, tew_col_i, {
-                        'type':     'formula',
-                        'criteria':f'=${sol_col}2<>${tew_col}2',
-                        'format':   bad_format
-                    })
+    # AESTHETIC CHOICE
+    show_as_indexes = False
+    # It is basically a matter of presentation whether we
+    # want to set a column with a simple index, if the join
+    # columns should themselves be the index.
+    if show_as_indexes:
+        data.set_index(columns.JOIN_KEY_COLUMNS, inplace=True)
 
-    # Makes the first row always visible, even if the user scrolls down.
-    worksheet.freeze_panes(1, 0)
+    shard_rows = min(shard_rows, columns.SHARD_ROWS)
+    if shard_by is None and data.shape[0] > shard_rows:
+        logging.log(logging.WARNING, f'{data.shape[0]} rows are more than {shard_rows} for one sheet. Splitting them by rows.')
+        shard_by = 'rows'
+
+    #===================================
+    # 2. Create an Excel Writer, and write the rows
+    #===================================
 
-    writer.close()
+    writer, workbook = open_workbook(filename, constant_memory)
+
+    if shard_by is None:
+        write_detail_sheet(writer, workbook, data, cols, 'Sheet1', constant_memory, show_as_indexes)
+    else:
+        shards = report_shards(data, shard_by, shard_rows)
+        logging.log(logging.INFO, f'Splitting the report in {len(shards)} shards by {shard_by}.')
+
+        if shard_workbooks:
+            shard_filenames = [shard_filename(filename, i) for i in range(len(shards))]
+            write_index_sheet(workbook, data, shards, shard_filenames)
+
+            # One after the other inside a batch worker (see util.pool_workers).
+            workers = util.pool_workers(len(shards))
+            if workers <= 1:
+                for i, (name, rows) in enumerate(shards):
+                    write_shard_workbook(data.iloc[rows], shard_filenames[i], cols, name, constant_memory)
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(write_shard_workbook, data.iloc[rows], shard_filenames[i], cols, name, constant_memory)
+                        for i, (name, rows) in enumerate(shards)]
+                    for future in futures:
+                        future.result()
+        else:
+            # The index goes first. Sheets are written in order in constant memory mode.
+            write_index_sheet(workbook, data, shards)
+            for name, rows in shards:
+                write_detail_sheet(writer, workbook, data.iloc[rows], cols, name, constant_memory, show_as_indexes)
+
+    if summaries:
+        write_summary_sheets(workbook, summary_tables(data))
+
+    close_workbook(writer, workbook)
     logging.log(logging.INFO, f'Saved file successfully as {filename}.')
 
-def fix_merged_dataframe(data):
+def report_parts(filename, role, sidecar=False):
+    '''The parts of an export that can be read on their own: each sheet with export rows of each
+        file, as exports too large for one sheet are split across sheets or files.
+        Returns a list of (filename, sheet names, load plan). The sheets are None for the formats
+        without sheets, and for files read through their sidecar, which holds all their sheets.
+    '''
+    parts = []
+    for part in util.file_list(filename):
+        # Each file gets its own plan, so a split export may even mix versions.
+        plan = schemas.load_plan(part, role, sidecar=sidecar)
+
+        if sidecar and readers.detect_format(part) != 'parquet':
+            parts.append((part, None, plan))
+            continue
+
+        for sheet in readers.data_sheets(part, plan.column_mapping):
+            parts.append((part, None if sheet is None else [sheet], plan))
+
+    return parts
+
+def load_part(filename, sheets, plan, sidecar=False, chunked=False, lean=False, explain=None):
+    '''Reads and processes one part of an export (see report_parts). Runs in a worker process
+        when the export has several parts. With `explain`, a folder, the source_rows of the part are
+        written to runs there as they are read (see explain.write_run), and (data, runs) is returned.
+    '''
+    fix_dataframe = functools.partial(fix_report_dataframe, plan=plan)
+    sheet = sheets[0] if sheets else None
+
+    if chunked:
+        chunks = readers.iter_with_sidecar(filename, plan.column_mapping, lean=lean, column_dtypes=plan.dtypes) if sidecar \
+            else readers.iter_dataframe(filename, plan.column_mapping, lean=lean, sheets=sheets, column_dtypes=plan.dtypes)
+        if not explain:
+            return aggregate_chunks(chunks, fix_dataframe, GROUPBY_COLUMNS[plan.role])
+
+        runs = []
+        data = aggregate_chunks(track_source_rows(chunks, plan, filename, sheet, explain, runs), fix_dataframe, GROUPBY_COLUMNS[plan.role])
+        return data, runs
+
+    raw = get_dataframe(filename, plan.column_mapping, sidecar=sidecar, lean=lean, sheets=sheets, column_dtypes=plan.dtypes)
+    if explain:
+        return fix_dataframe(raw), [explain_index.write_run(source_rows(raw, plan, filename, sheet), plan, explain)]
+
+    return fix_dataframe(raw)
+
+def load_report(filename, role, sidecar=False, chunked=False, lean=False, cache=None, explain=None, workers=None):
+    '''Reads and processes a SOL or TEW export (by `role`), ready for the merge.
+
+        The header is read first, to pick the load plan of the export's version (see schemas.py),
+        so a wrong file is turned down before anything else is read.
+        With a `cache` (see cache.py), an export processed before is not read again.
+
+        `filename` may also be a list of files, for an export split in several. An export
+        in several parts (files, or sheets of a workbook) has each part read and aggregated
+        in its own process, and the partial sums added up, the same as aggregate_chunks does.
+        The result is the same as for the export in one sheet, for whole-number counts
+        (see aggregate_chunks). At most `workers` parts are read at the same time. By default,
+        one per core, or one after the other when already in a worker process (see util.pool_workers),
+        so nested pools do not start a process per core in each worker.
+
+        With `explain`, a folder, returns (data, runs holding the source rows of its groups),
+        written there for explain.write_index. Those need the raw rows, so the cache is not
+        used then.
+    '''
+    if cache is not None and not explain:
+        return cache.load(filename, role,
+            lambda: load_report(filename, role, sidecar=sidecar, chunked=chunked, lean=lean))
+
+    parts = report_parts(filename, role, sidecar=sidecar)
+    if len(parts) == 1:
+        return load_part(*parts[0], sidecar=sidecar, chunked=chunked, lean=lean, explain=explain)
+
+    workers = util.pool_workers(len(parts)) if workers is None else min(workers, len(parts))
+    if workers <= 1:
+        logging.log(logging.INFO, f'Reading the {len(parts)} parts of the {role.upper()} export one after the other.')
+        results = [load_part(part, sheets, plan, sidecar, chunked, lean, explain) for part, sheets, plan in parts]
+    else:
+        logging.log(logging.INFO, f'Reading the {len(parts)} parts of the {role.upper()} export, {workers} at the same time.')
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(load_part, part, sheets, plan, sidecar, chunked, lean, explain) for part, sheets, plan in parts]
+            results = [future.result() for future in futures]
+
+    if explain:
+        return (combine_partial_sums([data for data, rows in results], GROUPBY_COLUMNS[role]),
+            [run for data, runs in results for run in runs])
+
+    return combine_partial_sums(results, GROUPBY_COLUMNS[role])
+
+def load_sol_report(filename, sidecar=False, chunked=False, lean=False, cache=None, explain=None):
+    '''Reads and processes a SOL export, ready for the merge (see load_report).'''
+    return load_report(filename, 'sol', sidecar=sidecar, chunked=chunked, lean=lean, cache=cache, explain=explain)
+
+def load_tew_report(filename, sidecar=False, chunked=False, lean=False, cache=None, explain=None):
+    '''Reads and processes a TEW export, ready for the merge (see load_report).'''
+    return load_report(filename, 'tew', sidecar=sidecar, chunked=chunked, lean=lean, cache=cache, explain=explain)
+
+def load_reports_parallel(sol_filename, tew_filename, sidecar=False, chunked=False, lean=False, cache=None, explain=None):
+    '''Reads and processes both exports at the same time, each in its own process.
+
+        Parsing a workbook is CPU-bound and holds the GIL, so threads would not help here.
+        The two reports are independent until the merge, so the wall time is about
+        that of the slower file. Returns (sol_data, tew_data).
+    '''
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        sol_future = pool.submit(load_sol_report, sol_filename, sidecar, chunked, lean, cache, explain)
+        tew_future = pool.submit(load_tew_report, tew_filename, sidecar, chunked, lean, cache, explain)
+
+        return sol_future.result(), tew_future.result()
+
+@profiling.profiled()
+def aggregate_chunks(chunks, fix_dataframe, groupby_columns, combine_rows=COMBINE_ROWS):
+    '''Out-of-core version of fix_dataframe(whole_export), for exports larger than memory.
+
+        Each chunk is filtered and aggregated on its own by `fix_dataframe` (every
+        column it outputs is a sum), and the partial sums are added up by
+        `groupby_columns`. Only one chunk of raw rows is in memory at a time, and
+        the partial sums are combined once they outgrow the groups seen so far, so
+        memory depends on the number of groups instead of on the number of rows.
+
+        The result is exactly that of fix_dataframe(whole_export) for whole-number counts,
+        as the exports have: floats add those up exactly (below 2**53) in any order.
+        Fractional counts are added up in another order than the rows, so their sums may
+        differ in the last bits, and the exact comparisons of fix_merged_dataframe with them.
+    '''
+    combined = None
+    pending = []
+    pending_rows = 0
+
+    for chunk in chunks:
+        part = fix_dataframe(chunk)
+        pending.append(part)
+        pending_rows += part.shape[0]
+
+        if pending_rows >= max(combine_rows, 0 if combined is None else combined.shape[0]):
+            combined = combine_partial_sums([combined] + pending, groupby_columns)
+            pending = []
+            pending_rows = 0
+
+    return combine_partial_sums([combined] + pending, groupby_columns)
+
+def combine_partial_sums(parts, groupby_columns):
+    '''Adds up partial aggregates that share the same group-by columns.'''
+    data = pandas.concat([part for part in parts if part is not None], ignore_index=True)
+
+    return data.groupby(groupby_columns, as_index=False, sort=True, observed=True).sum()
+
+def encode_join_keys(sol_keys, tew_keys):
+    '''Dictionary-encodes the join key columns of both reports into shared integer codes.
+
+        Each key column gets one dictionary for both reports, sorted where the values
+        allow it, and the codes of all key columns are folded into a single int64 key,
+        in the order of the columns. So sorting by that key sorts by the first
+        key column (projectId) as well.
+
+        Returns (sol_key, tew_key, dictionaries), with a dictionary per key column.
+    '''
+    n_sol = len(sol_keys)
+    combined = numpy.zeros(n_sol + len(tew_keys), dtype='int64')
+    dictionaries = {}
+
+    for col in sol_keys.columns:
+        values = numpy.concatenate([sol_keys[col].to_numpy(dtype=object), tew_keys[col].to_numpy(dtype=object)])
+        try:
+            codes, uniques = pandas.factorize(values, sort=True, use_na_sentinel=False)
+        except TypeError:
+            # Mixed types (like numbers and text in the same column) cannot be sorted.
+            logging.log(logging.WARNING, f'Join column <{col}> has mixed types. The report will not be sorted by it.')
+            codes, uniques = pandas.factorize(values, sort=False, use_na_sentinel=False)
+
+        combined = combined * max(len(uniques), 1) + codes
+        dictionaries[col] = uniques
+
+    return combined[:n_sol], combined[n_sol:], dictionaries
+
+def decode_join_keys(key, dictionaries):
+    '''The inverse of encode_join_keys: gives back a column of values per key column.'''
+    decoded = {}
+
+    for col in reversed(list(dictionaries.keys())):
+        uniques = dictionaries[col]
+        key, codes = numpy.divmod(key, max(len(uniques), 1))
+        decoded[col] = numpy.asarray(uniques, dtype=object)[codes]
+
+    return {col: decoded[col] for col in dictionaries.keys()}
+
+@profiling.profiled()
+def merge_reports(sol_data, tew_data, on=columns.JOIN_KEY_COLUMNS):
+    '''Outer join of the processed SOL and TEW reports.
+
+        Same result as pandas.merge(sol_data, tew_data, 'outer', on=on), but the
+        join runs as one sort-merge over integer codes instead of over three text
+        columns, and the rows come out already ordered by projectId.
+    '''
+    sol_key, tew_key, dictionaries = encode_join_keys(sol_data[on], tew_data[on])
+
+    left = sol_data.drop(columns=on)
+    left['_join_key'] = sol_key
+    right = tew_data.drop(columns=on)
+    right['_join_key'] = tew_key
+
+    data = pandas.merge(left, right, 'outer', on='_join_key', sort=True)
+
+    decoded = decode_join_keys(data.pop('_join_key').to_numpy(), dictionaries)
+
+    # Put the key columns back where they were in the SOL report.
+    for col in on:
+        position = min(sol_data.columns.get_loc(col), len(data.columns))
+        data.insert(position, col, decoded[col])
+
+    return data
+
+@profiling.profiled()
+def fix_merged_dataframe(data, abs_tolerance=columns.MISMATCH_ABS_TOLERANCE, rel_tolerance=columns.MISMATCH_REL_TOLERANCE):
 
     # We by default take the name of the sol report, but sometimes
     # it is missing, so we fix that by using the TEW name instead.
     data.loc[data['projectName'].isnull(), 'projectName'] = data.loc[data['projectName'].isnull(), 'tew_name']
     del data['tew_name']
 
+    # Every pair of counts is compared at once, see mismatch_flags.
+    flags = mismatch_flags(data, abs_tolerance, rel_tolerance)
+
     # We create a status column based on if totals match, or if one of
     # the reports does not have this data point.
     data['status'] = numpy.select([
         (data.sol_total.isnull()),
         (data.tew_total.isnull()),
-        (data.tew_total == data.sol_total),
-        (data.tew_total != data.sol_total)],
-        ["SOL_MISSING", "TEW_MISSING","OK", "MISMATCH"])
+        (~flags[:, 0])],
+        ["SOL_MISSING", "TEW_MISSING","OK"], "MISMATCH")
+    data['mismatch_mask'] = pack_mismatch_flags(flags)
 
     # After merging, we do not want to left blank cells instead of zeroes.
     data.loc[data['tew_total'].isnull(), 'tew_total'] = 0
     data.loc[data['sol_total'].isnull(), 'sol_total'] = 0
 
-
-    data.sort_values(by=['projectId'], inplace=True)
+    # The rows are already ordered by projectId, see merge_reports.
 
     return data
 
-def sanity_check_data(data,tew_data,sol_data):
-    """ Convenience printing after we have already done everything.
-    This function could also be used to check 'data' against the two original files, too.  """
-    print("\nRows by status:")
-    status_types = ["SOL_MISSING", "TEW_MISSING", "OK", "MISMATCH"]
-    for type in status_types:
-        print(f"\t{type:20} : { len( data.loc[ data.status == type ] ) }")
+#===================================
+# Mismatch analysis
+#===================================
 
-    print(f"\n\t{'Total':20} : { len(data) } \n")
-    pass
+def mismatch_flags(data, abs_tolerance=columns.MISMATCH_ABS_TOLERANCE, rel_tolerance=columns.MISMATCH_REL_TOLERANCE, pairs=columns.MISMATCH_PAIRS):
+    '''Compares every SOL/TEW pair of columns in one vectorized pass.
 
-def main():
-    colorama_init()
-    # Greeting
-    print(Fore.YELLOW + 'DiffCount.' + Style.RESET_ALL)
-    print('SAP LX tool for comparing billing requests by SOL and TEW.')
-    print('Hosted at https://github.wdf.sap.corp/I567680/DiffCount.')
-    print('--------------------------------------------------\n\n')
+        Two counts match if they differ by at most `abs_tolerance`, or by at most
+        `rel_tolerance` times the larger of the two (like math.isclose). Missing
+        counts are taken as 0, as Excel did with blank cells.
+        Returns a boolean array with a row per row of `data` and a column per pair, True on mismatch.
+    '''
+    sol = data[[sol_col for sol_col, tew_col in pairs]].to_numpy(dtype='float64', na_value=0)
+    tew = data[[tew_col for sol_col, tew_col in pairs]].to_numpy(dtype='float64', na_value=0)
 
-    logging.basicConfig(level=logging.DEBUG, style='{', datefmt='%H:%M:%S', format='[{asctime} {levelname}] {message}', stream=stdout)
-    add_logging_handler(f'diffcount_logs.log') # log-diffcount-{datetime.utcnow().strftime("%Y-%m-%d")}.log
+    allowed = numpy.maximum(abs_tolerance, rel_tolerance * numpy.maximum(numpy.abs(sol), numpy.abs(tew)))
+    return numpy.abs(tew - sol) > allowed
 
-    #===================================
-    # 1. SOL File
-    #===================================
-    while True:
-        try:
-            print( Fore.YELLOW + 'Step 1.' + Style.RESET_ALL + ' Please select the SOL file [.xls, .xlsx].')
-            sol_filename = util.choose_file( ('.xls', '.xlsx', '.csv') )
-            sol_data = get_dataframe(sol_filename, columns.SOL_COLUMN_MAPPING)
-            sol_data = fix_sol_dataframe(sol_data)
-
-            break
-        except PermissionError:
-            print('Oh no! Permission denied!\nClose the file in excel so we can proceed.')
-            answer = util.make_menu(['Try Again', 'Quit'])
-            if answer == 'Quit':
-                return
-        except KeyError as ex:
-            print(f'Oh no! It seems you have gotten the wrong file! {ex}')
-            answer = util.make_menu(['Try Again', 'Quit'])
-            if answer == 'Quit':
-                return
-        except UserQuitException as ex:
-            print(f'\nGoodbye!')
-            return
-
-
-    logging.log(logging.INFO, f'Success! There are {sol_data.shape[0]} rows in the processed SOL file.')
+def pack_mismatch_flags(flags):
+    '''Folds the flags of each row into one integer, with bit i for the i-th pair.'''
+    return flags.astype('int64') @ (1 << numpy.arange(flags.shape[1], dtype='int64'))
 
-    #===================================
-    # 2. TEW File
-    #===================================
-    while True:
-        try:
-            print( Fore.YELLOW + 'Step 2.' + Style.RESET_ALL + ' Please select the TEW file [.xls, .xlsx].')
-            tew_filename = util.choose_file( ('.xls', '.xlsx', '.csv') )
-            tew_data = get_dataframe(tew_filename, columns.TEW_COLUMN_MAPPING)
-            tew_data = fix_tew_dataframe(tew_data)
-            break
-        except PermissionError:
-            print('Oh no! Permission denied!\nClose the file in excel so we can proceed.')
-            answer = util.make_menu(['Try Again', 'Quit'])
-            if answer == 'Quit':
-                return
-        except KeyError as ex:
-            print(f'Oh no! Maybe it\'s the pivot table, but it seems you have gotten the wrong file! {ex}')
-            answer = util.make_menu(['Try Again', 'Quit'])
-            if answer == 'Quit':
-                return
-        except UserQuitException as ex:
-            print(f'\nGoodbye!')
-            return
-
-    logging.log(logging.INFO, f'Success! There are {tew_data.shape[0]} rows in the processed TEW file.')
+def get_mismatch_flags(data, pairs=columns.MISMATCH_PAIRS):
+    '''The mismatch flags of a finished report, unpacked from its `mismatch_mask` column.
+        Rows without a mask (like the ones kept from an older state file) are compared again, exactly.
+    '''
+    if 'mismatch_mask' not in data.columns:
+        return mismatch_flags(data, pairs=pairs)
 
-    #===================================
-    # 3. Merging Data
-    #===================================
-    result_filename = 'diffcount-' + datetime.utcnow().strftime('%Y-%m-%d') + '.xlsx'
-    print( Fore.YELLOW + 'Step 3.' + Style.RESET_ALL + f' Creating report file [{result_filename}].')
+    masks = data['mismatch_mask'].to_numpy(dtype='float64', na_value=-1)
+    flags = (masks.astype('int64')[:, None] >> numpy.arange(len(pairs))) & 1 == 1
 
-    data = pandas.merge(sol_data, tew_data, 'outer', on=columns.JOIN_KEY_COLUMNS)
-    data = fix_merged_dataframe(data)
+    missing = masks < 0
+    if missing.any():
+        flags[missing] = mismatch_flags(data[missing], pairs=pairs)
 
-    logging.log(logging.INFO, f'Success! The resulting file {result_filename} will have {data.shape[0]} rows.')
+    return flags
 
-    # Save the file.
-    try:
-        style_and_save(data, result_filename)
-    except PermissionError:
-        print('Oh no! Permission denied!\nClose the file in excel so we can proceed.')
-        answer = util.make_menu(['Try Again', 'Quit'])
-        if answer == 'Quit':
-            return
-    except Exception as ex:
-        logging.exception(f'Could not save resulting file! {ex} ')
-        return
+def category_name(sol_col):
+    '''sol_no_match gives no_match'''
+    return sol_col[len('sol_'):]
 
-    #===================================
-    # 3. Checking and Printing
-    #===================================
-    sanity_check_data(data,tew_data,sol_data)
+def mismatch_summary(data, pairs=columns.MISMATCH_PAIRS):
+    '''Which categories drive the mismatches. For each pair of columns:
+        - mismatch_rows: MISMATCH rows where this category differs,
+        - only_category_rows: MISMATCH rows where this is the only category (besides the total) that differs,
+        - ok_rows: OK rows (the totals match) where this category still differs,
+        - abs_difference: sum of |TEW - SOL| over its mismatch_rows.
+
+        Returns a dataframe with a row per category, the ones with the most mismatch_rows first.
+    '''
+    flags = get_mismatch_flags(data, pairs)
+    mismatch = (data['status'] == 'MISMATCH').to_numpy()
+    ok = (data['status'] == 'OK').to_numpy()
+
+    sol = data[[sol_col for sol_col, tew_col in pairs]].to_numpy(dtype='float64', na_value=0)
+    tew = data[[tew_col for sol_col, tew_col in pairs]].to_numpy(dtype='float64', na_value=0)
+    differences = numpy.abs(tew - sol) * flags
+
+    # Categories only, the total is the first pair.
+    only_one = flags[:, 1:].sum(axis=1) == 1
+
+    summary = pandas.DataFrame({
+        'category': [category_name(sol_col) for sol_col, tew_col in pairs],
+        'mismatch_rows': flags[mismatch].sum(axis=0),
+        'only_category_rows': flags[mismatch & only_one].sum(axis=0),
+        'ok_rows': flags[ok].sum(axis=0),
+        'abs_difference': differences[mismatch].sum(axis=0),
+    })
+    # The total mismatches in every MISMATCH row, so it is left out of 'only'.
+    summary.loc[0, 'only_category_rows'] = 0
+
+    return summary.sort_values(by='mismatch_rows', ascending=False, kind='stable', ignore_index=True)
+
+def mismatch_cells(data, column_order, pairs=columns.FINAL_COLUMN_PAIRS):
+    '''The TEW cells to mark in the report, as {position in column_order: boolean rows}.'''
+    flags = get_mismatch_flags(data)
+    # FINAL_COLUMN_PAIRS are the pairs after the total in MISMATCH_PAIRS.
+    first = columns.MISMATCH_PAIRS.index(pairs[0])
+
+    return {
+        column_order.index(tew_col): flags[:, first + i]
+        for i, (sol_col, tew_col) in enumerate(pairs)
+        if tew_col in column_order and flags[:, first + i].any()
+    }
+
+def sanity_check_data(data,tew_data,sol_data):
+    """ Convenience printing after we have already done everything.
+    This function could also be used to check 'data' against the two original files, too.  """
+    print("\nRows by status:")
+    # Counted in one pass, instead of filtering the data once per status.
+    status_counts = data['status'].value_counts()
+    for type in columns.STATUS_TYPES:
+        print(f"\t{type:20} : { status_counts.get(type, 0) }")
+
+    print(f"\n\t{'Total':20} : { len(data) } \n")
+
+    summary = mismatch_summary(data)
+    summary = summary[(summary.mismatch_rows > 0) | (summary.ok_rows > 0)]
+    if len(summary):
+        print("Categories that differ (rows in MISMATCH, where it is the only one, rows in OK):")
+        for row in summary.itertuples(index=False):
+            print(f"\t{row.category:20} : {row.mismatch_rows:8} {row.only_category_rows:8} {row.ok_rows:8}")
+        print()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # The entry point is in cli.py, which only imports this module once there is data to process.
+    import diffcount.cli as cli
+    cli.main()
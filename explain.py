@@ -0,0 +1,202 @@
+''' Explain index of a report: the export rows that make up each of its groups, so a MISMATCH
+    can be traced back to the rows behind it without reading the exports again.
+
+    With `--explain`, the rows kept from both exports (see diffcount.source_rows) are saved
+    next to the report, as Parquet:
+
+        diffcount-2024-05-31.xlsx
+        diffcount-2024-05-31.explain.parquet
+
+    Each row has its group (projectId, target, tgroup, as in the report), its role ('sol' or
+    'tew'), where it comes from (source_file, source_sheet, source_row) and its cells as they
+    are in the export. The rows of each part of an export are written out to sorted runs as
+    they are read, a chunk at a time with --chunked, so they are never all kept in memory, and
+    the runs are then merged. The index being sorted by group, a lookup only reads the row
+    groups that may hold the group asked for. Run with:
+
+        python -m diffcount explain diffcount-2024-05-31.explain.parquet --project 12345 --target de-DE
+'''
+
+import os
+import sys
+import logging
+import tempfile
+import numpy
+import pandas
+
+import diffcount.columns as columns
+
+# Rows per Parquet row group. Smaller groups make lookups read less, and the file larger.
+ROW_GROUP_SIZE = 10_000
+
+# Rows of each run read at a time, when merging them into the index (see merge_runs).
+MERGE_BATCH_ROWS = 2_000
+
+# The order of the rows found.
+SORT_COLUMNS = columns.JOIN_KEY_COLUMNS + ['role', 'source_file', 'source_row']
+
+def index_filename(report_filename):
+    '''The explain index kept next to a report.'''
+    return os.path.splitext(report_filename)[0] + '.explain.parquet'
+
+def run_schema(plan):
+    '''The columns of the source rows of an export read with `plan` (see diffcount.source_rows).
+        Fixed ahead, so every chunk of the export is written alike, whatever its cells hold.
+    '''
+    import pyarrow
+
+    fields = [(col, pyarrow.string()) for col in ['role'] + columns.JOIN_KEY_COLUMNS + ['source_file', 'source_sheet']]
+    fields.append(('source_row', pyarrow.int64()))
+    for col, original in plan.column_mapping.items():
+        fields.append((original, pyarrow.float64() if plan.dtypes.get(col) == 'float64' else pyarrow.string()))
+
+    return pyarrow.schema(fields)
+
+def group_order(rows):
+    '''The key the index is sorted by: the group of each row (JOIN_KEY_COLUMNS), as one text.
+        The separator comes before any printable character, so the texts sort like the groups.
+    '''
+    keys = [rows[col].fillna('').astype(str) for col in columns.JOIN_KEY_COLUMNS]
+    return (keys[0] + '\x1f' + keys[1] + '\x1f' + keys[2]).to_numpy(dtype=object)
+
+def write_run(rows, plan, folder):
+    '''Writes source rows of an export read with `plan` (all those of a part, or of a chunk with
+        --chunked) to a new Parquet file (a run) in `folder`, sorted by group. Returns its filename.
+        write_index merges the runs of both exports. The folder is a temporary one of the caller,
+        which removes it with the runs once done, or if anything fails.
+    '''
+    try:
+        import pyarrow
+        import pyarrow.parquet as parquet
+    except ImportError:
+        raise ImportError('Saving the explain index needs the `pyarrow` module. Please install it.')
+
+    schema = run_schema(plan)
+
+    # Parquet has no mixed-type columns, and the export cells may mix numbers and text.
+    # With --lean, text columns may also be read as numbers.
+    for field in schema:
+        if field.type == pyarrow.string():
+            rows[field.name] = rows[field.name].where(rows[field.name].isna(), rows[field.name].astype(str))
+
+    # Stable, so the rows of a group stay in the order of the export.
+    rows = rows.iloc[numpy.argsort(group_order(rows), kind='stable')]
+
+    handle, run = tempfile.mkstemp(prefix=f'{plan.role}-', suffix='.parquet', dir=folder)
+    os.close(handle)
+    parquet.write_table(pyarrow.Table.from_pandas(rows, schema=schema, preserve_index=False), run,
+        row_group_size=ROW_GROUP_SIZE)
+
+    return run
+
+def merge_runs(runs, batch_rows=MERGE_BATCH_ROWS):
+    '''Yields the rows of the sorted runs as dataframes, all in one order by group (a k-way merge).
+        Only `batch_rows` rows of each run are in memory at a time.
+
+        The rows up to the smallest of the last groups read from each run can be given out:
+        every row still unread comes after them.
+    '''
+    import pyarrow.parquet as parquet
+
+    batches = [parquet.ParquetFile(run).iter_batches(batch_size=batch_rows) for run in runs]
+    heads = {}
+
+    def read_next(i):
+        batch = next(batches[i], None)
+        if batch is None:
+            heads.pop(i, None)
+        else:
+            rows = batch.to_pandas()
+            heads[i] = (rows, group_order(rows))
+
+    for i in range(len(runs)):
+        read_next(i)
+
+    while heads:
+        cutoff = min(order[-1] for rows, order in heads.values())
+        taken = []
+        for i, (rows, order) in list(heads.items()):
+            count = numpy.searchsorted(order, cutoff, side='right')
+            taken.append(rows.iloc[:count])
+            if count == len(order):
+                read_next(i)
+            else:
+                heads[i] = (rows.iloc[count:], order[count:])
+
+        merged = pandas.concat(taken, ignore_index=True)
+        yield merged.iloc[numpy.argsort(group_order(merged), kind='stable')]
+
+def write_index(filename, runs):
+    '''Saves the runs of both exports (see write_run) as the explain index of a report.
+        They are merged, so the whole index is sorted by group, and the statistics of each
+        row group let lookups skip all the others. SOL and TEW rows have different cells,
+        so the ones a row does not have are left empty.
+    '''
+    import pyarrow
+    import pyarrow.parquet as parquet
+
+    schema = pyarrow.unify_schemas([parquet.read_schema(run) for run in runs])
+    saved = 0
+    pending = []
+    pending_rows = 0
+
+    def write_rows(writer, rows):
+        table = pyarrow.Table.from_pandas(rows.reindex(columns=schema.names), schema=schema, preserve_index=False)
+        writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+
+    with parquet.ParquetWriter(filename + '.tmp', schema) as writer:
+        # The merged batches are of any size, so they are gathered in full row groups.
+        for rows in merge_runs(runs):
+            pending.append(rows)
+            pending_rows += len(rows)
+            if pending_rows >= ROW_GROUP_SIZE:
+                rows = pandas.concat(pending, ignore_index=True)
+                full = len(rows) - len(rows) % ROW_GROUP_SIZE
+                write_rows(writer, rows.iloc[:full])
+                pending = [rows.iloc[full:]]
+                pending_rows = len(rows) - full
+                saved += full
+
+        if pending_rows:
+            write_rows(writer, pandas.concat(pending, ignore_index=True))
+            saved += pending_rows
+
+    os.replace(filename + '.tmp', filename)
+
+    logging.log(logging.INFO, f'Saved the explain index of {saved} rows as [{filename}].')
+
+def lookup(filename, project_id, target=None, tgroup=None):
+    '''The source rows of a group, or of all the groups of a project (and target).
+        Only the columns that the rows found have a value in are kept.
+    '''
+    filters = [('projectId', '==', str(project_id))]
+    if target is not None:
+        filters.append(('target', '==', target))
+    if tgroup is not None:
+        filters.append(('tgroup', '==', tgroup))
+
+    rows = pandas.read_parquet(filename, filters=filters)
+    rows = rows.sort_values(by=SORT_COLUMNS, ignore_index=True)
+    return rows.dropna(axis='columns', how='all')
+
+def run_explain(arguments):
+    '''Entry point of `python -m diffcount explain`. Prints the source rows of a group,
+        or saves them with `--output`.
+    '''
+    logging.basicConfig(level=logging.INFO, style='{', datefmt='%H:%M:%S', format='[{asctime} {levelname}] {message}', stream=sys.stderr)
+
+    rows = lookup(arguments.index, arguments.project, target=arguments.target, tgroup=arguments.tgroup)
+    counts = rows['role'].value_counts() if not rows.empty else {}
+    logging.log(logging.INFO, f'Found {counts.get("sol", 0)} SOL rows and {counts.get("tew", 0)} TEW rows.')
+
+    if arguments.output:
+        if arguments.output.lower().endswith('.csv'):
+            rows.to_csv(arguments.output, index=False)
+        else:
+            rows.to_excel(arguments.output, index=False)
+        logging.log(logging.INFO, f'Saved them as [{arguments.output}].')
+    else:
+        with pandas.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+            print(rows.to_string(index=False))
+
+    return 0
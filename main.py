@@ -1,3 +1,5 @@
-from diffcount import diffcount
+from diffcount import cli
 
-diffcount.main()
\ No newline at end of file
+# The guard is needed by the process pools, which import this file again in each worker on Windows.
+if __name__ == '__main__':
+    cli.main()
@@ -0,0 +1,249 @@
+''' Comparison over many periods. Each monthly SOL/TEW pair is reconciled once, and its
+    result is kept in a history folder, one Parquet file per period:
+
+        history/period=2024-05/data.parquet
+        history/periods.json            Which exports (and file hashes) each period came from.
+
+    The questions about how a group (projectId, target, tgroup) evolved, like which groups
+    stayed MISMATCH for 3 periods or which are newly SOL_MISSING this month, are answered
+    from the history alone, reading only the columns and periods they need. Run with:
+
+        python -m diffcount periods --history history/ --directory exports/ --stayed MISMATCH 3
+'''
+
+import os
+import re
+import sys
+import json
+import logging
+import numpy
+import pandas
+from concurrent.futures import ProcessPoolExecutor
+
+import diffcount.util as util
+import diffcount.batch as batch
+import diffcount.state as state
+import diffcount.cache as disk_cache
+import diffcount.columns as columns
+import diffcount.diffcount as diffcount
+
+# Period names are folder names too. Named like 2024-05, they also sort in time order.
+PERIOD_NAME = re.compile(r'^[\w.-]+$')
+
+# What a query needs to know of each group, in each period.
+STATUS_COLUMNS = columns.JOIN_KEY_COLUMNS + ['period', 'status']
+
+#===================================
+# Storing
+#===================================
+def period_filename(history_path, period):
+    return os.path.join(history_path, f'period={period}', 'data.parquet')
+
+def read_periods(history_path):
+    '''The periods in the history, in time order, with the exports each one came from.'''
+    filename = os.path.join(history_path, 'periods.json')
+    if not os.path.exists(filename):
+        return {}
+
+    with open(filename) as file:
+        return dict(sorted(json.load(file).items()))
+
+def write_periods(history_path, periods):
+    filename = os.path.join(history_path, 'periods.json')
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(dict(sorted(periods.items())), file, indent=2)
+    os.replace(filename + '.tmp', filename)
+
+def write_period(history_path, period, data):
+    '''Saves the result of one period, replacing the one kept before.'''
+    data = diffcount.uncategorize(data[columns.FINAL_COLUMN_ORDER].copy())
+    # Parquet has no mixed-type columns, and ids may mix numbers and text.
+    data['projectId'] = data['projectId'].astype(str)
+    data = data.sort_values(by=columns.JOIN_KEY_COLUMNS, ignore_index=True)
+
+    filename = period_filename(history_path, period)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    data.to_parquet(filename + '.tmp', index=False)
+    os.replace(filename + '.tmp', filename)
+
+def read_history(history_path, periods=None, only_columns=None):
+    '''The rows kept for the given periods (by default all of them), with a `period` column.
+        With `only_columns`, only those columns are read.
+    '''
+    known = read_periods(history_path)
+    periods = list(known) if periods is None else [period for period in known if period in periods]
+
+    parts = []
+    for period in periods:
+        part = pandas.read_parquet(period_filename(history_path, period),
+            columns=None if only_columns is None else [col for col in only_columns if col != 'period'])
+        part.insert(0, 'period', period)
+        parts.append(part)
+
+    if not parts:
+        return pandas.DataFrame(columns=list(only_columns or ['period']))
+
+    history = pandas.concat(parts, ignore_index=True)
+    return history if only_columns is None else history[list(only_columns)]
+
+#===================================
+# Ingesting
+#===================================
+def reconcile_period(pair, sidecar=False, chunked=False, lean=False, cache=None,
+        abs_tolerance=columns.MISMATCH_ABS_TOLERANCE, rel_tolerance=columns.MISMATCH_REL_TOLERANCE):
+    '''The result of one pair, like fix_merged_dataframe gives. Runs in a worker process.'''
+    sol_data = diffcount.load_sol_report(pair['sol'], sidecar=sidecar, chunked=chunked, lean=lean, cache=cache)
+    tew_data = diffcount.load_tew_report(pair['tew'], sidecar=sidecar, chunked=chunked, lean=lean, cache=cache)
+
+    data = diffcount.merge_reports(sol_data, tew_data)
+    return diffcount.fix_merged_dataframe(data, abs_tolerance, rel_tolerance)
+
+def ingest(pairs, history_path, workers=1, **options):
+    '''Adds the pairs to the history, as one period each, named after the pair.
+
+        A period already kept from the same exports (by their hashes) is not read again.
+        One kept from other exports is replaced. `options` go to reconcile_period.
+        Returns the names of the periods that were (re)computed.
+    '''
+    os.makedirs(history_path, exist_ok=True)
+    periods = read_periods(history_path)
+
+    pending = []
+    for pair in pairs:
+        if not PERIOD_NAME.match(pair['name']):
+            raise ValueError(f'Period names can only have letters, digits, "_", "-" and ".", not <{pair["name"]}>.')
+
+        hashes = {'sol_hash': util.file_hash(pair['sol']), 'tew_hash': util.file_hash(pair['tew'])}
+        kept = periods.get(pair['name'], {})
+        if all(kept.get(key) == value for key, value in hashes.items()):
+            logging.log(logging.INFO, f'Period [{pair["name"]}] is already in the history.')
+            continue
+
+        pending.append((pair, hashes))
+
+    logging.log(logging.INFO, f'Reconciling {len(pending)} periods with {workers} workers.')
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(pair, hashes, pool.submit(reconcile_period, pair, **options)) for pair, hashes in pending]
+
+        for pair, hashes, future in futures:
+            data = future.result()
+            write_period(history_path, pair['name'], data)
+
+            periods[pair['name']] = {'sol': pair['sol'], 'tew': pair['tew'], 'rows': int(data.shape[0]), **hashes}
+            # Saved after each period, so an error later on keeps the ones done.
+            write_periods(history_path, periods)
+
+    return [pair['name'] for pair, hashes in pending]
+
+#===================================
+# Querying
+#===================================
+def status_matrix(history):
+    '''The status of each group (rows) in each period (columns, in time order).
+        A group missing from both exports of a period has no status there (NaN).
+    '''
+    matrix = history.pivot_table(index=columns.JOIN_KEY_COLUMNS, columns='period', values='status',
+        aggfunc='first', observed=True)
+    return matrix.reindex(columns=sorted(matrix.columns))
+
+def periods_until(history_path, period=None):
+    '''The periods up to `period` (by default, the latest one), in time order.'''
+    periods = list(read_periods(history_path))
+    if period is None:
+        return periods
+    if period not in periods:
+        raise KeyError(f'No period <{period}> in the history. Known: {", ".join(periods)}.')
+
+    return periods[:periods.index(period) + 1]
+
+def stayed(history_path, status, count, period=None):
+    '''The groups with `status` in each of the last `count` periods up to `period`.
+
+        Returns (keys of the groups, the periods looked at).
+    '''
+    if count < 1:
+        # periods[-0:] would be every period.
+        raise ValueError(f'Asked for {count} periods, needs at least 1.')
+
+    periods = periods_until(history_path, period)[-count:]
+    if len(periods) < count:
+        raise ValueError(f'Only {len(periods)} periods in the history, {count} asked for.')
+
+    matrix = status_matrix(read_history(history_path, periods, STATUS_COLUMNS))
+    matrix = matrix.reindex(columns=periods)
+    found = (matrix == status).all(axis=1)
+
+    return matrix.index[found].to_frame(index=False), periods
+
+def new_status(history_path, status, period=None):
+    '''The groups with `status` in `period` (by default, the latest one), which did not have
+        it in the period before. In the first period, every group with `status` is new.
+
+        Returns (keys of the groups, the periods looked at).
+    '''
+    periods = periods_until(history_path, period)[-2:]
+    if not periods:
+        raise ValueError('The history is empty.')
+
+    matrix = status_matrix(read_history(history_path, periods, STATUS_COLUMNS))
+    matrix = matrix.reindex(columns=periods)
+    found = matrix[periods[-1]] == status
+    if len(periods) == 2:
+        found &= matrix[periods[0]] != status
+
+    return matrix.index[found].to_frame(index=False), periods
+
+def group_rows(history_path, keys, periods):
+    '''The rows kept for the given groups, in the given periods, each group's periods together.'''
+    history = read_history(history_path, periods)
+    rows = history[numpy.isin(state.key_strings(history), state.key_strings(keys))]
+
+    return rows.sort_values(by=columns.JOIN_KEY_COLUMNS + ['period'], ignore_index=True)
+
+#===================================
+# Command
+#===================================
+def run_periods(arguments):
+    '''Entry point of `python -m diffcount periods`. Ingests the pairs given, if any,
+        answers the query asked, if any, and prints a JSON summary.
+    '''
+    logging.basicConfig(level=logging.INFO, style='{', datefmt='%H:%M:%S', format='[{asctime} {levelname}] {message}', stream=sys.stderr)
+
+    pairs = []
+    if arguments.manifest:
+        pairs += batch.read_manifest(arguments.manifest)
+    if arguments.directory:
+        pairs += batch.pair_directory(arguments.directory)
+
+    ingested = ingest(pairs, arguments.history, workers=arguments.workers,
+        sidecar=arguments.sidecar, chunked=arguments.chunked, lean=arguments.lean,
+        cache=disk_cache.from_arguments(arguments),
+        abs_tolerance=arguments.abs_tolerance, rel_tolerance=arguments.rel_tolerance)
+
+    summary = {'periods': list(read_periods(arguments.history)), 'ingested': ingested}
+
+    query = None
+    if arguments.stayed:
+        status, count = arguments.stayed
+        keys, periods = stayed(arguments.history, status, int(count), arguments.period)
+        query = f'{status} for the last {count} periods'
+    elif arguments.new:
+        keys, periods = new_status(arguments.history, arguments.new, arguments.period)
+        query = f'new {arguments.new}'
+
+    if query is not None:
+        summary['query'] = {'query': query, 'periods': periods, 'groups': int(len(keys)),
+            'keys': keys.to_dict(orient='records')}
+
+        if arguments.output:
+            rows = group_rows(arguments.history, keys, periods)
+            if arguments.output.lower().endswith('.csv'):
+                rows.to_csv(arguments.output, index=False)
+            else:
+                rows.to_excel(arguments.output, index=False)
+            summary['query']['output'] = arguments.output
+
+    print(json.dumps(summary, indent=2))
+
+    return 0
@@ -0,0 +1,121 @@
+''' Stage-level instrumentation of the pipeline: wall time, CPU time, peak memory and rows in/out.
+    Disabled unless enable() is called, in which case the decorated stages record themselves. '''
+
+import json
+import time
+import cProfile
+import logging
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+class Profiler:
+    '''Records one entry per stage run, in the order the stages finish.'''
+
+    def __init__(self, cprofile=False):
+        self.records = []
+        self._stack = []
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name):
+        '''Measures the code inside the `with`. The yielded record can take
+            extra fields, like 'rows_in' and 'rows_out'.
+        '''
+        # Stages can be nested, and each one resets the peak,
+        # so the enclosing stage keeps the peak it had so far.
+        if self._stack:
+            parent = self._stack[-1]
+            parent['_peak'] = max(parent['_peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+        start_memory = tracemalloc.get_traced_memory()[0]
+        record = {'stage': name, 'rows_in': None, 'rows_out': None, '_peak': 0}
+        self._stack.append(record)
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+
+            self._stack.pop()
+            peak = max(tracemalloc.get_traced_memory()[1], record.pop('_peak'))
+            if self._stack:
+                self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+
+            record.update({
+                'wall_seconds': round(wall, 4),
+                'cpu_seconds': round(cpu, 4),
+                'peak_memory_mb': round((peak - start_memory) / 2**20, 2),
+            })
+            self.records.append(record)
+
+            logging.log(logging.DEBUG, f'Stage {name}: {wall:.3f}s wall, {cpu:.3f}s CPU, '
+                f'{record["peak_memory_mb"]} MB peak, rows {record["rows_in"]} -> {record["rows_out"]}.')
+
+    def write_json(self, filename):
+        with open(filename, 'w') as file:
+            json.dump({'stages': self.records}, file, indent=2)
+        logging.log(logging.INFO, f'Saved stage timings as [{filename}].')
+
+    def write_cprofile(self, filename):
+        self.cprofile.dump_stats(filename)
+        logging.log(logging.INFO, f'Saved cProfile dump as [{filename}].')
+
+# The profiler the decorated stages report to. None when profiling is off.
+active = None
+
+def enable(cprofile=False):
+    global active
+    active = Profiler(cprofile=cprofile)
+    active.start()
+    return active
+
+def disable():
+    global active
+    if active is not None:
+        active.stop()
+    profiler, active = active, None
+    return profiler
+
+def count_rows(values):
+    '''Total rows of the dataframes among `values`, or None if there are none.'''
+    rows = [value.shape[0] for value in values if hasattr(value, 'shape') and len(value.shape) == 2]
+    return sum(rows) if rows else None
+
+def profiled(name=None):
+    '''Decorates a pipeline stage so it is measured while profiling is enabled.
+        Rows in are counted over the dataframe arguments, rows out over the result.
+    '''
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if active is None:
+                return function(*args, **kwargs)
+
+            with active.stage(stage_name) as record:
+                record['rows_in'] = count_rows(list(args) + list(kwargs.values()))
+                result = function(*args, **kwargs)
+                record['rows_out'] = count_rows(result if isinstance(result, tuple) else (result,))
+
+            return result
+
+        return wrapper
+
+    return decorator
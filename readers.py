@@ -0,0 +1,614 @@
+''' Readers for the SOL/TEW exports. They only pull the columns in the mapping, and hand the rows over in chunks. '''
+
+import os
+import logging
+import zipfile
+import tempfile
+import posixpath
+from xml.etree import ElementTree
+import numpy
+import pandas
+from pandas.api.types import union_categoricals
+import diffcount.util as util
+import diffcount.columns as columns
+
+def check_header(header, column_mapping):
+    '''Checks that every column in the mapping is present in the header.
+        Returns the position of each mapped column, keyed by its original name.
+
+        Raises a KeyError with the missing columns, after warning the user about each one.
+    '''
+    header = [str(col).strip() if col is not None else None for col in header]
+
+    missing = []
+    positions = {}
+    for col in column_mapping.values():
+        if col not in header:
+            # Logged rather than printed, so headless runs keep stdout for their JSON summary.
+            logging.log(logging.WARNING, f'Invalid Excel Format. Column named <{col}> not found.')
+            missing.append(col)
+        else:
+            positions[col] = header.index(col)
+
+    if missing:
+        raise KeyError(missing)
+
+    return positions
+
+def header_names(header, column_mapping):
+    '''Checks the header (see check_header), and returns the name each mapped column has in it,
+        keyed by its new name. Headers may have spaces around the names, which check_header
+        ignores, but the readers that pick columns by name need them as they are in the file.
+    '''
+    header = list(header)
+    positions = check_header(header, column_mapping)
+
+    return {col: header[positions[original]] for col, original in column_mapping.items()}
+
+def apply_dtypes(data, column_dtypes):
+    '''Casts the (already renamed) columns to the explicit dtypes, where we have one.'''
+    dtypes = {col: dtype for col, dtype in column_dtypes.items() if col in data.columns}
+    return data.astype(dtypes, copy=False)
+
+def normalize_id(value):
+    '''One id, as normalize_ids gives it.'''
+    if isinstance(value, str):
+        digits = value[1:] if value[:1] == '-' else value
+        if digits.isascii() and digits.isdigit() and (digits[0] != '0' or value == '0'):
+            return int(value)
+        return value
+
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+def normalize_ids(ids):
+    '''Ids as the same values, whatever the format they are read from. openpyxl gives the ids
+        typed as numbers in the sheet as ints, and the others as text. Text that spells a whole
+        number, as CSV files (and text columns of Parquet files) have them, becomes an int too,
+        unless the int reads differently, like '007', which is kept as text, as Excel keeps it.
+    '''
+    if ids.dtype.kind in 'iu':
+        return ids.astype(object)
+
+    # An export has many rows per project, so only the distinct ids are looked at.
+    codes, uniques = pandas.factorize(ids)
+    result = ids.to_numpy(dtype=object, copy=True)
+    if len(uniques):
+        normal = numpy.frompyfunc(normalize_id, 1, 1)(numpy.asarray(uniques, dtype=object))
+        found = codes >= 0
+        result[found] = normal.take(codes[found])
+
+    return pandas.Series(result, index=ids.index, name=ids.name)
+
+def typed_chunk(data, column_dtypes):
+    '''A chunk as every reader hands it over: cast to `column_dtypes` (see apply_dtypes), and with
+        its ids normalised (see normalize_ids), so that the chunks of an export, and the exports
+        of every format, all key their groups alike.
+    '''
+    data = apply_dtypes(data, column_dtypes)
+    for col in columns.ID_COLUMNS:
+        if col in data.columns:
+            data[col] = normalize_ids(data[col])
+
+    return data
+
+def compact_dtypes(data, column_dtypes):
+    '''Memory-lean dtypes for the memory-lean mode: text columns become categoricals, and
+        count columns with only whole numbers (and no missing values) become the smallest
+        integer type that holds them. Anything else keeps its dtype, so the sums stay exact.
+    '''
+    for col, dtype in column_dtypes.items():
+        if col not in data.columns:
+            continue
+
+        if dtype == 'object':
+            data[col] = data[col].astype('category')
+        elif dtype == 'float64' and len(data):
+            values = data[col].to_numpy()
+            if numpy.isfinite(values).all() and (values == numpy.trunc(values)).all():
+                data[col] = pandas.to_numeric(data[col], downcast='integer')
+
+    return data
+
+def has_columns(header, column_mapping):
+    '''Whether every mapped column is in the header. Unlike check_header, nothing is printed.'''
+    header = {str(col).strip() for col in header if col is not None}
+    return set(column_mapping.values()) <= header
+
+def data_worksheets(workbook, column_mapping):
+    '''The sheets of a workbook holding export rows: the first one, and every other one with the
+        mapped columns, as large exports are split across sheets because of Excel's row limit.
+        Other sheets, like pivot tables, are left out.
+    '''
+    worksheets = workbook.worksheets[:1]
+    for sheet in workbook.worksheets[1:]:
+        header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+        if has_columns(header, column_mapping):
+            worksheets.append(sheet)
+
+    return worksheets
+
+def iter_xlsx_chunks(filename, column_mapping, chunksize=columns.READ_CHUNK_SIZE, sheets=None, column_dtypes=None):
+    '''Streams a XLSX file, yielding dataframes of at most `chunksize` rows
+        with only the mapped columns, already renamed and typed.
+
+        The workbook is opened in read-only mode, so openpyxl never builds the
+        whole sheet in memory, and the columns outside the mapping are dropped
+        as soon as the row is read.
+
+        `sheets` are the names of the sheets to read, one after the other. By default,
+        every sheet with export rows (see data_worksheets). `column_dtypes` are the dtypes of
+        the (renamed) columns that have an explicit one, as the load plan has them (see schemas.py).
+    '''
+    # Imported here, as only the XLSX path needs it.
+    import openpyxl
+
+    column_dtypes = column_dtypes or {}
+    renaming = util.reverse_dict(column_mapping)
+
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        worksheets = data_worksheets(workbook, column_mapping) if sheets is None \
+            else [workbook[name] for name in sheets]
+
+        yielded = False
+        for sheet in worksheets:
+            rows = sheet.iter_rows(values_only=True)
+
+            header = next(rows, ())
+            positions = check_header(header, column_mapping)
+
+            original_cols = list(positions.keys())
+            new_cols = [renaming[col] for col in original_cols]
+            indexes = [positions[col] for col in original_cols]
+
+            buffer = []
+            for row in rows:
+                # Read-only sheets may give rows shorter than the header, if the last cells are empty.
+                buffer.append(tuple(row[i] if i < len(row) else None for i in indexes))
+
+                if len(buffer) >= chunksize:
+                    yield typed_chunk(pandas.DataFrame.from_records(buffer, columns=new_cols), column_dtypes)
+                    buffer = []
+                    yielded = True
+
+            if buffer:
+                yield typed_chunk(pandas.DataFrame.from_records(buffer, columns=new_cols), column_dtypes)
+                yielded = True
+
+        # An export without rows still gives one (empty) chunk, so the header is kept.
+        if not yielded:
+            yield typed_chunk(pandas.DataFrame.from_records([], columns=list(column_mapping.keys())), column_dtypes)
+    finally:
+        workbook.close()
+
+def xls_data_sheets(filename, column_mapping):
+    '''Like data_worksheets, for an old .xls file. Returns the sheet names.'''
+    names = pandas.ExcelFile(filename).sheet_names
+    return names[:1] + [name for name in names[1:]
+        if has_columns(pandas.read_excel(filename, sheet_name=name, nrows=0).columns, column_mapping)]
+
+def iter_xls_chunks(filename, column_mapping, chunksize=columns.READ_CHUNK_SIZE, sheets=None, column_dtypes=None):
+    '''Old .xls files cannot be streamed, but we can still only parse the columns we need.
+        `sheets` and `column_dtypes` are as in iter_xlsx_chunks.
+    '''
+    column_dtypes = column_dtypes or {}
+
+    for name in xls_data_sheets(filename, column_mapping) if sheets is None else sheets:
+        names = header_names(pandas.read_excel(filename, sheet_name=name, nrows=0).columns, column_mapping)
+
+        data = pandas.read_excel(filename, sheet_name=name, usecols=list(names.values()))
+        data = data[list(names.values())]
+        data.columns = list(names.keys())
+
+        for start in range(0, max(len(data), 1), chunksize):
+            yield typed_chunk(data.iloc[start:start + chunksize], column_dtypes)
+
+def iter_csv_chunks(filename, column_mapping, chunksize=columns.READ_CHUNK_SIZE, sheets=None, column_dtypes=None):
+    '''Streams a CSV file with the C parser, only parsing the mapped columns.
+        CSV files have no sheets, so `sheets` is left unused.
+    '''
+    column_dtypes = column_dtypes or {}
+
+    names = header_names(pandas.read_csv(filename, nrows=0).columns, column_mapping)
+
+    # Text columns, keys included, are read as text (when the load plan says so), rather than left for pandas to infer
+    # chunk by chunk, which could give an id as a number in one chunk and as text in the next.
+    # The ids are then normalised like those of every other format (see typed_chunk).
+    csv_dtypes = {
+        names[col]: str if dtype == 'object' else dtype
+        for col, dtype in column_dtypes.items() if col in names
+    }
+
+    reader = pandas.read_csv(filename, usecols=list(names.values()),
+        dtype=csv_dtypes, chunksize=chunksize)
+
+    with reader:
+        for chunk in reader:
+            chunk = chunk[list(names.values())]
+            chunk.columns = list(names.keys())
+            yield typed_chunk(chunk, column_dtypes)
+
+def iter_parquet_chunks(filename, column_mapping, chunksize=columns.READ_CHUNK_SIZE, sheets=None, column_dtypes=None):
+    '''Streams a Parquet file by record batches. Only the mapped columns are ever decoded.
+        Parquet files have no sheets, so `sheets` is left unused.
+    '''
+    try:
+        import pyarrow.parquet as parquet
+    except ImportError:
+        raise ImportError('Reading Parquet files needs the `pyarrow` module. Please install it.')
+
+    column_dtypes = column_dtypes or {}
+
+    parquet_file = parquet.ParquetFile(filename)
+    names = header_names(parquet_file.schema_arrow.names, column_mapping)
+
+    renaming = util.reverse_dict(names)
+
+    yielded = False
+    for batch in parquet_file.iter_batches(batch_size=chunksize, columns=list(names.values())):
+        chunk = batch.to_pandas()
+        chunk.columns = [renaming[col] for col in chunk.columns]
+        yield typed_chunk(chunk[list(column_mapping.keys())], column_dtypes)
+        yielded = True
+
+    if not yielded:
+        yield typed_chunk(pandas.DataFrame(columns=list(column_mapping.keys())), column_dtypes)
+
+# First bytes of each binary format we understand. Anything else is treated as CSV.
+FILE_SIGNATURES = {
+    b'PK\x03\x04': 'xlsx',
+    b'\xd0\xcf\x11\xe0': 'xls',
+    b'PAR1': 'parquet',
+}
+
+def detect_format(filename):
+    '''Guesses the format of an export by its first bytes, since exports
+        are often saved with the wrong extension. Falls back to the extension.
+    '''
+    try:
+        with open(filename, 'rb') as file:
+            magic = file.read(4)
+    except IsADirectoryError:
+        magic = b''
+
+    for signature, file_format in FILE_SIGNATURES.items():
+        if magic.startswith(signature):
+            return file_format
+
+    extension = os.path.splitext(str(filename))[1].lower().lstrip('.')
+    if extension in ('xlsx', 'xls', 'parquet'):
+        return extension
+
+    return 'csv'
+
+def local_name(tag):
+    '''The name of an XML tag without its namespace, as XLSX files come in more than one.'''
+    return tag.rsplit('}', 1)[-1]
+
+def xlsx_part_path(target):
+    '''The path in the zip of a part of a XLSX file, from its target in xl/_rels/workbook.xml.rels.'''
+    if target.startswith('/'):
+        return target.lstrip('/')
+
+    return posixpath.normpath(posixpath.join('xl', target))
+
+def column_position(reference):
+    '''The position of the column of a cell reference, counting from 0: 'A1' gives 0, 'AB1' 27.'''
+    position = 0
+    for letter in reference.rstrip('0123456789').upper():
+        position = position * 26 + ord(letter) - ord('A') + 1
+
+    return position - 1
+
+def xlsx_first_row(archive, path):
+    '''The cells of the first row of a sheet of a XLSX file, as a list of (type, text), where the
+        first row is the header. The sheet XML is only parsed up to the end of that row.
+    '''
+    cells = []
+    with archive.open(path) as file:
+        for event, element in ElementTree.iterparse(file, events=('end',)):
+            if local_name(element.tag) != 'row':
+                continue
+
+            if element.get('r', '1') != '1':
+                # The sheet starts further down, so it has no header.
+                return []
+
+            for cell in element:
+                if local_name(cell.tag) != 'c':
+                    continue
+
+                # Empty cells are left out of the XML, so the reference places the next one.
+                if cell.get('r'):
+                    cells.extend([(None, None)] * (column_position(cell.get('r')) - len(cells)))
+
+                cell_type = cell.get('t', 'n')
+                if cell_type == 'inlineStr':
+                    text = ''.join(part.text or '' for part in cell.iter() if local_name(part.tag) == 't')
+                else:
+                    value = next((part for part in cell if local_name(part.tag) == 'v'), None)
+                    text = None if value is None else value.text
+
+                cells.append((cell_type, text))
+            return cells
+
+    return []
+
+def xlsx_shared_strings(archive, path, indexes):
+    '''The shared strings at `indexes`, by index. The table is only parsed up to the last one,
+        and header names are among the first strings of it.
+    '''
+    wanted = set(indexes)
+    found = {}
+    if not wanted:
+        return found
+    last = max(wanted)
+
+    with archive.open(path) as file:
+        index = 0
+        for event, element in ElementTree.iterparse(file, events=('end',)):
+            if local_name(element.tag) != 'si':
+                continue
+
+            if index in wanted:
+                # Plain text, or runs of rich text, leaving out the phonetic hints.
+                parts = [element] + [child for child in element if local_name(child.tag) == 'r']
+                found[index] = ''.join(part.text or '' for parent in parts for part in parent if local_name(part.tag) == 't')
+
+            element.clear()
+            index += 1
+            if index > last:
+                break
+
+    return found
+
+def xlsx_headers(filename):
+    '''The header of each worksheet of a XLSX file, as a list of (sheet name, header), in order.
+
+        Read straight from the XML of the sheets, up to their first row, and only the shared
+        strings those rows use are looked up. openpyxl, even in read-only mode, parses the whole
+        shared strings table of the workbook, which takes seconds on a large export.
+    '''
+    try:
+        return xlsx_xml_headers(filename)
+    except (KeyError, ValueError, StopIteration, zipfile.BadZipFile, ElementTree.ParseError):
+        # A layout the shortcut does not know. openpyxl knows them all, if slowly.
+        pass
+
+    # Imported here, as only the XLSX path needs it.
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        return [(sheet.title, list(next(sheet.iter_rows(max_row=1, values_only=True), ())))
+            for sheet in workbook.worksheets]
+    finally:
+        workbook.close()
+
+def xlsx_xml_headers(filename):
+    '''xlsx_headers, read from the XML of the workbook.'''
+    with zipfile.ZipFile(filename) as archive:
+        relationships = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        targets = {}
+        shared_strings = None
+        for relationship in relationships:
+            kind = relationship.get('Type', '').rsplit('/', 1)[-1]
+            if kind == 'worksheet':
+                targets[relationship.get('Id')] = xlsx_part_path(relationship.get('Target'))
+            elif kind == 'sharedStrings':
+                shared_strings = xlsx_part_path(relationship.get('Target'))
+
+        # Chart sheets have no rows, and openpyxl leaves them out of the worksheets too.
+        sheets = []
+        for sheet in ElementTree.fromstring(archive.read('xl/workbook.xml')).iter():
+            if local_name(sheet.tag) != 'sheet':
+                continue
+            relationship = next(value for key, value in sheet.attrib.items() if local_name(key) == 'id')
+            if relationship in targets:
+                sheets.append((sheet.get('name'), xlsx_first_row(archive, targets[relationship])))
+
+        indexes = [int(text) for name, cells in sheets for cell_type, text in cells if cell_type == 's']
+        strings = xlsx_shared_strings(archive, shared_strings, indexes) if shared_strings else {}
+
+    headers = []
+    for name, cells in sheets:
+        header = [strings[int(text)] if cell_type == 's' else text for cell_type, text in cells]
+        headers.append((name, header))
+
+    return headers
+
+def read_header(filename):
+    '''The column names of an export, reading as little of it as the format allows:
+        the first row of a XLSX (see xlsx_headers) or CSV file, or the footer of a Parquet file.
+        Old .xls files have no way to read part of them, so they are loaded whole.
+    '''
+    file_format = detect_format(filename)
+
+    if file_format == 'xlsx':
+        headers = xlsx_headers(filename)
+        header = headers[0][1] if headers else ()
+    elif file_format == 'xls':
+        header = pandas.read_excel(filename, nrows=0).columns
+    elif file_format == 'parquet':
+        try:
+            import pyarrow.parquet as parquet
+        except ImportError:
+            raise ImportError('Reading Parquet files needs the `pyarrow` module. Please install it.')
+        header = parquet.read_schema(filename).names
+    else:
+        header = pandas.read_csv(filename, nrows=0).columns
+
+    return [str(col).strip() if col is not None else None for col in header]
+
+def data_sheets(filename, column_mapping):
+    '''The names of the sheets of a workbook with export rows (see data_worksheets),
+        or [None] for the formats without sheets.
+    '''
+    file_format = detect_format(filename)
+
+    if file_format == 'xlsx':
+        # Only the first row of each sheet is read (see xlsx_headers), so the rows
+        # are left for the reader to parse the workbook once.
+        headers = xlsx_headers(filename)
+        return [name for i, (name, header) in enumerate(headers) if i == 0 or has_columns(header, column_mapping)]
+
+    if file_format == 'xls':
+        return xls_data_sheets(filename, column_mapping)
+
+    return [None]
+
+CHUNK_READERS = {
+    'xlsx': iter_xlsx_chunks,
+    'xls': iter_xls_chunks,
+    'csv': iter_csv_chunks,
+    'parquet': iter_parquet_chunks,
+}
+
+def iter_dataframe(filename, column_mapping, chunksize=columns.READ_CHUNK_SIZE, lean=False, sheets=None, column_dtypes=None):
+    '''Yields the file as dataframes of at most `chunksize` rows, with the mapped columns only,
+        cast to `column_dtypes` (see iter_xlsx_chunks).
+        With `lean`, each chunk comes with compact dtypes (see compact_dtypes).
+        Workbooks are read from every sheet with export rows, or only from the given `sheets`.
+    '''
+    file_format = detect_format(filename)
+    logging.log(logging.INFO, f"Streaming dataframe from {file_format} file: {filename}")
+
+    column_dtypes = column_dtypes or {}
+    chunks = CHUNK_READERS[file_format](filename, column_mapping, chunksize, sheets=sheets, column_dtypes=column_dtypes)
+    if lean:
+        return (compact_dtypes(chunk, column_dtypes) for chunk in chunks)
+
+    return chunks
+
+def concat_chunks(chunks):
+    '''pandas.concat of the chunks, except that categorical columns stay categorical even if
+        the chunks have different categories (pandas.concat would turn them into objects).
+    '''
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+
+    data = {}
+    for col in chunks[0].columns:
+        parts = [chunk[col] for chunk in chunks]
+        if not all(isinstance(part.dtype, pandas.CategoricalDtype) for part in parts):
+            data[col] = pandas.concat(parts, ignore_index=True)
+            continue
+
+        try:
+            data[col] = pandas.Series(union_categoricals(parts))
+        except TypeError:
+            # Categories of different types, like ids read as numbers in one chunk and text in another.
+            data[col] = pandas.concat(parts, ignore_index=True).astype('category')
+
+    return pandas.DataFrame(data)
+
+def read_dataframe(filename, column_mapping, chunksize=columns.READ_CHUNK_SIZE, lean=False, sheets=None, column_dtypes=None):
+    '''Reads the whole file, chunk by chunk, into a single dataframe with the mapped columns only.
+        With `lean`, each chunk is compacted as soon as it is read (see compact_dtypes), so the
+        plain dtypes are never held for the whole file.
+    '''
+    chunks = list(iter_dataframe(filename, column_mapping, chunksize, lean=lean, sheets=sheets, column_dtypes=column_dtypes))
+
+    if lean:
+        return concat_chunks(chunks)
+
+    data = pandas.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0].reset_index(drop=True)
+    return apply_dtypes(data, column_dtypes or {})
+
+def sidecar_filename(filename):
+    '''The Parquet copy of an export lives right next to it, as 'export.xlsx.parquet'.'''
+    return str(filename) + '.parquet'
+
+def parquet_columns(filename):
+    '''Column names of a Parquet file, read from its footer only. Empty if pyarrow is missing.'''
+    try:
+        import pyarrow.parquet as parquet
+    except ImportError:
+        return []
+
+    return parquet.read_schema(filename).names
+
+def has_fresh_sidecar(filename):
+    '''A sidecar is only trusted if it is newer than the export it was made from.'''
+    sidecar = sidecar_filename(filename)
+
+    return os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(filename)
+
+def sidecar_columns(filename):
+    '''The column names of the fresh sidecar of an export (see has_fresh_sidecar), or None if
+        there is none, or its footer cannot be read, like one cut short by a killed run.
+        Such a sidecar is written again the next time the export is read with --sidecar.
+    '''
+    if detect_format(filename) == 'parquet' or not has_fresh_sidecar(filename):
+        return None
+
+    sidecar = sidecar_filename(filename)
+    try:
+        return parquet_columns(sidecar)
+    except (OSError, ValueError) as ex:
+        logging.log(logging.WARNING, f'Could not read sidecar [{sidecar}], so it is not used: {ex}')
+        return None
+
+def write_sidecar(data, filename, column_mapping):
+    '''Saves the mapped columns of an export, under their original names, as a Parquet sidecar.
+        Returns the sidecar filename, or None if it could not be written.
+    '''
+    sidecar = sidecar_filename(filename)
+
+    # Written aside and moved in place, so no one reads a half-written sidecar, which
+    # would be fresh by its time. Batch workers may share an export, and so its sidecar.
+    file_descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(sidecar) or None, suffix='.tmp')
+    os.close(file_descriptor)
+    try:
+        data.rename(columns=column_mapping).to_parquet(temporary, index=False)
+        os.replace(temporary, sidecar)
+    except (ImportError, OSError, ValueError, TypeError) as ex:
+        # Like ids mixing numbers and text, which Parquet cannot keep (pyarrow raises a TypeError).
+        logging.log(logging.WARNING, f'Could not write sidecar [{sidecar}]: {ex}')
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        return None
+
+    logging.log(logging.INFO, f'Saved columnar copy of {filename} as [{sidecar}].')
+    return sidecar
+
+def usable_sidecar(filename, column_mapping):
+    '''The sidecar of an export, if it is fresh, readable and has all the mapped columns. Otherwise None.'''
+    header = sidecar_columns(filename)
+    if header is None:
+        return None
+
+    sidecar = sidecar_filename(filename)
+    if not set(column_mapping.values()) <= set(header):
+        # Sidecar made with an older mapping.
+        logging.log(logging.INFO, f'Sidecar of {filename} does not have the needed columns.')
+        return None
+
+    logging.log(logging.INFO, f'Using columnar copy [{sidecar}] instead of parsing {filename}.')
+    return sidecar
+
+def read_with_sidecar(filename, column_mapping, chunksize=columns.READ_CHUNK_SIZE, lean=False, column_dtypes=None):
+    '''Reads an export through its Parquet sidecar, creating the sidecar if it is missing or stale.'''
+    sidecar = usable_sidecar(filename, column_mapping)
+    if sidecar is not None:
+        return read_dataframe(sidecar, column_mapping, chunksize, lean=lean, column_dtypes=column_dtypes)
+
+    # The sidecar keeps the plain dtypes, the compact ones are applied after writing it.
+    data = read_dataframe(filename, column_mapping, chunksize, column_dtypes=column_dtypes)
+
+    if detect_format(filename) != 'parquet':
+        write_sidecar(data, filename, column_mapping)
+
+    if lean:
+        return compact_dtypes(data, column_dtypes or {})
+    return data
+
+def iter_with_sidecar(filename, column_mapping, chunksize=columns.READ_CHUNK_SIZE, lean=False, column_dtypes=None):
+    '''Streams an export from its Parquet sidecar if there is a usable one, or else from the export itself.
+        No sidecar is written, as that would need the whole export in memory.
+    '''
+    return iter_dataframe(usable_sidecar(filename, column_mapping) or filename, column_mapping, chunksize, lean=lean,
+        column_dtypes=column_dtypes)
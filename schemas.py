@@ -0,0 +1,69 @@
+''' Versions of the SOL/TEW exports, and the load plan of each one.
+
+    The known layouts are in columns.EXPORT_SCHEMAS. Before an export is read, its header
+    (and only its header) tells which version it is, so a wrong or changed file is turned
+    down right away, instead of after parsing it. The plan of that version says which
+    columns to read, their dtypes, and the columns added up out of them. '''
+
+import logging
+import functools
+from collections import namedtuple
+
+import diffcount.columns as columns
+import diffcount.readers as readers
+
+# What loading one version of an export takes.
+#   role:           'sol' or 'tew'.
+#   version:        its key in columns.EXPORT_SCHEMAS.
+#   column_mapping: {new name: column in the export}, the only columns read.
+#   dtypes:         {new name: dtype}, for the columns that have an explicit one.
+#   derived:        {new column: columns added up to make it}, done after aggregating.
+LoadPlan = namedtuple('LoadPlan', ['role', 'version', 'column_mapping', 'dtypes', 'derived'])
+
+@functools.lru_cache(maxsize=None)
+def compile_plan(role, version):
+    '''The load plan of a version of an export. Made once per version.'''
+    schema = columns.EXPORT_SCHEMAS[role][version]
+    column_mapping = schema['mapping']
+
+    for col, parts in schema['derived'].items():
+        unknown = [part for part in parts if part not in column_mapping]
+        if unknown:
+            raise ValueError(f'{role.upper()} {version}: <{col}> is made of columns that are not read: {unknown}')
+
+    role_dtypes = columns.COLUMN_DTYPES[role]
+    dtypes = {col: role_dtypes[col] for col in column_mapping if col in role_dtypes}
+
+    return LoadPlan(role, version, column_mapping, dtypes, schema['derived'])
+
+def detect_version(role, header):
+    '''The version of an export with this header: the newest one whose columns are all in it.
+
+        Raises a KeyError with the missing columns of the closest version otherwise, after
+        warning the user about each one, as readers.check_header does.
+    '''
+    header = set(header)
+    versions = columns.EXPORT_SCHEMAS[role]
+
+    for version in reversed(list(versions)):
+        if set(versions[version]['mapping'].values()) <= header:
+            return version
+
+    # Probably the wrong file, or a layout not known yet. The version it is closest to
+    # tells the user which columns to look for.
+    closest = min(versions, key=lambda version: len(set(versions[version]['mapping'].values()) - header))
+    readers.check_header(header, versions[closest]['mapping'])
+
+def load_plan(filename, role, sidecar=False):
+    '''Reads the header of an export, and returns the load plan of its version.
+
+        With `sidecar`, the header of a fresh sidecar is read instead, as it is cheaper.
+    '''
+    header = readers.sidecar_columns(filename) if sidecar else None
+    if not header:
+        header = readers.read_header(filename)
+
+    version = detect_version(role, header)
+    logging.log(logging.INFO, f'{role.upper()} file {filename} is a {version} export.')
+
+    return compile_plan(role, version)
@@ -0,0 +1,281 @@
+''' Local HTTP service that keeps the processed reports in memory between comparisons.
+
+    Each SOL/TEW export is read and processed once, in a worker process, and kept by the
+    hash of its contents, so comparing it again (with any other file, by anyone using the
+    service) skips the reading. Run with:
+
+        python -m diffcount serve --port 8765
+
+    Requests:
+        POST /upload?name=may_sol.xlsx  The body is the export. Returns its {"path", "hash"}.
+        POST /compare                   The body is JSON: {"sol": path, "tew": path} (or lists of paths,
+                                        for exports split in several files), and optionally
+                                        "format" ("json", the default, or "xlsx"), "abs_tolerance"
+                                        and "rel_tolerance". Returns the summary (see
+                                        batch.report_summary) or the XLSX report.
+        GET  /status                    The reports kept in memory, and the cache hits/misses.
+'''
+
+import os
+import sys
+import json
+import asyncio
+import logging
+import tempfile
+import functools
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+
+import diffcount.batch as batch
+import diffcount.cache as disk_cache
+import diffcount.util as util
+import diffcount.columns as columns
+import diffcount.diffcount as diffcount
+
+# Processed reports kept in memory. The least recently used ones are dropped first.
+CACHE_ENTRIES = 32
+
+# Largest upload accepted.
+MAX_UPLOAD_BYTES = 1 << 30
+# Largest JSON request accepted.
+MAX_REQUEST_BYTES = 1 << 20
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error',
+}
+
+class HTTPError(Exception):
+    '''Ends a request with the given status, and the message as a JSON error.'''
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ReportCache:
+    '''The processed reports, by role ('sol' or 'tew') and file hash, shared by every request.'''
+
+    def __init__(self, pool, load_options, max_entries=CACHE_ENTRIES):
+        self.pool = pool
+        self.load_options = load_options
+        self.max_entries = max_entries
+        self.reports = OrderedDict()
+        # Loads still running, so two requests for the same file share one.
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, role, filename):
+        '''The processed report of an export, read in the worker pool unless it is already known.'''
+        loop = asyncio.get_running_loop()
+        # Hashing reads the whole file, so it runs off the event loop as well.
+        key = (role, await loop.run_in_executor(None, util.file_hash, filename))
+
+        if key in self.reports:
+            self.hits += 1
+            self.reports.move_to_end(key)
+            logging.log(logging.INFO, f'{role.upper()} file {filename} is already loaded.')
+            return self.reports[key]
+
+        if key in self.loading:
+            self.hits += 1
+        else:
+            self.misses += 1
+            logging.log(logging.INFO, f'Loading {role.upper()} file {filename}.')
+            load = diffcount.load_sol_report if role == 'sol' else diffcount.load_tew_report
+            self.loading[key] = loop.run_in_executor(self.pool, functools.partial(load, filename, **self.load_options))
+
+        try:
+            data = await self.loading[key]
+        finally:
+            self.loading.pop(key, None)
+
+        self.reports[key] = data
+        self.reports.move_to_end(key)
+        while len(self.reports) > self.max_entries:
+            self.reports.popitem(last=False)
+
+        return data
+
+    def status(self):
+        return {
+            'reports': [{'role': role, 'hash': file_hash, 'rows': int(data.shape[0])}
+                for (role, file_hash), data in self.reports.items()],
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+def compare_reports(sol_data, tew_data, abs_tolerance, rel_tolerance):
+    '''Merges two processed reports. The cached reports themselves are left untouched.'''
+    data = diffcount.merge_reports(sol_data, tew_data)
+    return diffcount.fix_merged_dataframe(data, abs_tolerance, rel_tolerance)
+
+def report_bytes(data, constant_memory=False):
+    '''The XLSX report, as style_and_save writes it.'''
+    with tempfile.TemporaryDirectory() as temporary:
+        filename = os.path.join(temporary, 'diffcount.xlsx')
+        diffcount.style_and_save(data, filename, constant_memory=constant_memory)
+        with open(filename, 'rb') as file:
+            return file.read()
+
+class Service:
+    '''Answers the requests. asyncio runs each connection on its own task.'''
+
+    def __init__(self, cache, upload_path, abs_tolerance, rel_tolerance, constant_memory=False):
+        self.cache = cache
+        self.upload_path = upload_path
+        self.abs_tolerance = abs_tolerance
+        self.rel_tolerance = rel_tolerance
+        self.constant_memory = constant_memory
+
+    async def handle(self, reader, writer):
+        '''One request per connection.'''
+        try:
+            status, content_type, body = await self.respond(reader)
+        except HTTPError as ex:
+            status, content_type, body = ex.status, 'application/json', json.dumps({'error': str(ex)}).encode()
+        except Exception as ex:
+            logging.exception(f'Could not answer the request: {ex!r}')
+            status, content_type, body = 500, 'application/json', json.dumps({'error': repr(ex)}).encode()
+
+        header = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n')
+        try:
+            writer.write(header.encode('latin-1') + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+        '''Reads a request and routes it. Returns (status, content type, body).'''
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise HTTPError(400, 'Malformed request line.')
+        method, target, _ = request_line
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, 'Malformed Content-Length.')
+
+        url = urlsplit(target)
+        if url.path == '/upload' and method == 'POST':
+            return await self.upload(reader, length, parse_qs(url.query))
+        if url.path == '/compare' and method == 'POST':
+            if length > MAX_REQUEST_BYTES:
+                raise HTTPError(413, 'Request too large.')
+            return await self.compare(await reader.readexactly(length))
+        if url.path == '/status' and method == 'GET':
+            return 200, 'application/json', json.dumps(self.cache.status()).encode()
+
+        if url.path in ('/upload', '/compare', '/status'):
+            raise HTTPError(405, f'{method} is not allowed on {url.path}.')
+        raise HTTPError(404, f'Nothing at {url.path}.')
+
+    async def upload(self, reader, length, query):
+        '''Saves an uploaded export by its hash, so the same file is only kept once.'''
+        name = query.get('name', [''])[0]
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in columns.INPUT_EXTENSIONS:
+            raise HTTPError(400, f'Uploads need a ?name= ending in one of {", ".join(columns.INPUT_EXTENSIONS)}.')
+        if length > MAX_UPLOAD_BYTES:
+            raise HTTPError(413, 'Upload too large.')
+
+        # Written in blocks as it arrives, instead of holding it all in memory.
+        file_descriptor, temporary = tempfile.mkstemp(dir=self.upload_path, suffix=extension)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as file:
+                remaining = length
+                while remaining:
+                    block = await reader.read(min(remaining, 1 << 20))
+                    if not block:
+                        raise HTTPError(400, 'Upload ended before its Content-Length.')
+                    file.write(block)
+                    remaining -= len(block)
+
+            # Hashing reads the whole file, so it runs off the event loop, as in ReportCache.get.
+            file_hash = await asyncio.get_running_loop().run_in_executor(None, util.file_hash, temporary)
+            filename = os.path.join(self.upload_path, file_hash + extension)
+            os.replace(temporary, filename)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+        logging.log(logging.INFO, f'Saved upload [{name}] as [{filename}].')
+        return 200, 'application/json', json.dumps({'path': filename, 'hash': file_hash}).encode()
+
+    async def compare(self, body):
+        try:
+            request = json.loads(body or b'{}')
+            sol_filename, tew_filename = request['sol'], request['tew']
+            filenames = util.file_list(sol_filename) + util.file_list(tew_filename)
+            abs_tolerance = float(request.get('abs_tolerance', self.abs_tolerance))
+            rel_tolerance = float(request.get('rel_tolerance', self.rel_tolerance))
+        except (ValueError, TypeError, KeyError) as ex:
+            raise HTTPError(400, f'Expected JSON with a "sol" and a "tew" file: {ex!r}')
+
+        response_format = request.get('format', 'json')
+        if response_format not in ('json', 'xlsx'):
+            raise HTTPError(400, f'Unknown format <{response_format}>, expected "json" or "xlsx".')
+
+        for filename in filenames:
+            if not isinstance(filename, str) or not os.path.isfile(filename):
+                raise HTTPError(404, f'No file at [{filename}].')
+
+        try:
+            sol_data, tew_data = await asyncio.gather(
+                self.cache.get('sol', sol_filename), self.cache.get('tew', tew_filename))
+        except KeyError as ex:
+            # Missing columns, like in the interactive mode: probably the wrong file.
+            raise HTTPError(422, f'Wrong file? {ex}')
+
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, compare_reports, sol_data, tew_data, abs_tolerance, rel_tolerance)
+
+        if response_format == 'xlsx':
+            body = await loop.run_in_executor(None, report_bytes, data, self.constant_memory)
+            return 200, XLSX_CONTENT_TYPE, body
+
+        return 200, 'application/json', json.dumps(batch.report_summary(data)).encode()
+
+async def serve(arguments, upload_path):
+    # With `--cache`, the processed reports also outlive the service, on disk.
+    load_options = {'sidecar': arguments.sidecar, 'chunked': arguments.chunked, 'lean': arguments.lean,
+        'cache': disk_cache.from_arguments(arguments)}
+
+    with ProcessPoolExecutor(max_workers=arguments.workers) as pool:
+        cache = ReportCache(pool, load_options, max_entries=arguments.cache_entries or CACHE_ENTRIES)
+        service = Service(cache, upload_path, arguments.abs_tolerance, arguments.rel_tolerance,
+            constant_memory=arguments.constant_memory)
+
+        server = await asyncio.start_server(service.handle, arguments.host, arguments.port)
+        logging.log(logging.INFO, f'Serving on http://{arguments.host}:{arguments.port} with {arguments.workers} workers.')
+
+        async with server:
+            await server.serve_forever()
+
+def run_service(arguments):
+    '''Entry point of `python -m diffcount serve`. Runs until interrupted.'''
+    logging.basicConfig(level=logging.INFO, style='{', datefmt='%H:%M:%S', format='[{asctime} {levelname}] {message}', stream=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as temporary:
+        upload_path = arguments.upload_dir or temporary
+        os.makedirs(upload_path, exist_ok=True)
+
+        try:
+            asyncio.run(serve(arguments, upload_path))
+        except KeyboardInterrupt:
+            logging.log(logging.INFO, 'Stopped.')
+
+    return 0
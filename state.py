@@ -0,0 +1,250 @@
+''' Incremental reconciliation. Keeps the last result in a SQLite file, and on the next run
+    only re-aggregates and re-merges the groups whose source rows changed. '''
+
+import os
+import sqlite3
+import functools
+import logging
+import numpy
+import pandas
+
+import diffcount.util as util
+import diffcount.columns as columns
+import diffcount.readers as readers
+import diffcount.schemas as schemas
+import diffcount.diffcount as diffcount
+
+# How to key the rows of each report. How to read and aggregate them depends on the
+# version of the export (see schemas.py).
+KEY_FIXERS = {
+    'sol': diffcount.fix_sol_keys,
+    'tew': diffcount.fix_tew_keys,
+}
+
+def key_strings(data):
+    '''One text key per row, out of the JOIN_KEY_COLUMNS. Used to compare groups between runs,
+        as ids read back from SQLite are numbers, while the ones from a fresh export may be objects.
+    '''
+    keys = data[columns.JOIN_KEY_COLUMNS].astype(str)
+    return (keys['projectId'] + '\x1f' + keys['target'] + '\x1f' + keys['tgroup']).to_numpy(dtype=object)
+
+def fixed_keys(raw, fix_keys):
+    '''The JOIN_KEY_COLUMNS of raw export rows, named as in the processed report.'''
+    keys = pandas.DataFrame({'projectId': raw['projectId']})
+    keys['target'], keys['tgroup'] = fix_keys(raw)
+
+    return keys
+
+def group_hashes(raw, keys):
+    '''A hash of the source rows of each join key group, independent of the row order.
+
+        Returns a dataframe with the JOIN_KEY_COLUMNS and a `row_hash` column.
+    '''
+    # With --lean, whole-number counts are read as small integers, and numeric ids as categories
+    # of integers (see readers.compact_dtypes), which hash differently than the same floats and
+    # objects. They are hashed as without --lean, so the hashes do not depend on how it was read.
+    as_read = {}
+    for col in raw.columns:
+        if isinstance(raw[col].dtype, pandas.CategoricalDtype):
+            if raw[col].cat.categories.dtype != object:
+                as_read[col] = object
+        elif raw[col].dtype.kind in 'iu':
+            as_read[col] = 'float64'
+    row_hashes = pandas.util.hash_pandas_object(raw.astype(as_read), index=False).to_numpy()
+
+    # Without sorting, groups are numbered in order of first appearance.
+    grouped = keys.groupby(columns.JOIN_KEY_COLUMNS, sort=False)
+    group_ids = grouped.ngroup().to_numpy(dtype='float64', na_value=-1).astype('int64')
+    valid = group_ids >= 0
+
+    # Summing (with uint64 wrap-around) does not depend on the row order, but still sees duplicates.
+    sums = numpy.zeros(grouped.ngroups, dtype='uint64')
+    numpy.add.at(sums, group_ids[valid], row_hashes[valid])
+
+    hashes = keys[valid].drop_duplicates(columns.JOIN_KEY_COLUMNS).reset_index(drop=True)
+    # SQLite only has signed 64 bit integers.
+    hashes['row_hash'] = sums.view('int64')
+
+    return hashes
+
+def combine_hashes(parts):
+    '''The group_hashes of an export read in chunks, out of those of each chunk. The same as
+        the group_hashes of the whole export, as the row hashes of a group are summed.
+    '''
+    hashes = pandas.concat(parts, ignore_index=True)
+
+    grouped = hashes.groupby(columns.JOIN_KEY_COLUMNS, sort=False, observed=True)
+    sums = numpy.zeros(grouped.ngroups, dtype='uint64')
+    numpy.add.at(sums, grouped.ngroup().to_numpy(), hashes['row_hash'].to_numpy().view('uint64'))
+
+    combined = hashes.drop_duplicates(columns.JOIN_KEY_COLUMNS)[columns.JOIN_KEY_COLUMNS].reset_index(drop=True)
+    combined['row_hash'] = sums.view('int64')
+
+    return combined
+
+def iter_raw(filename, plan, sidecar=False, lean=False):
+    '''The raw rows of an export (or of each file of a split one), a chunk at a time.'''
+    read_chunks = readers.iter_with_sidecar if sidecar else readers.iter_dataframe
+    for part in util.file_list(filename):
+        yield from read_chunks(part, plan.column_mapping, chunksize=columns.READ_CHUNK_SIZE, lean=lean, column_dtypes=plan.dtypes)
+
+def changed_groups(hashes, previous_hashes):
+    '''The keys (see key_strings) of the groups whose hash changed since the last run,
+        including the groups that are new or gone.
+    '''
+    current = pandas.Series(hashes['row_hash'].to_numpy(), index=key_strings(hashes))
+    if previous_hashes is None:
+        return current.index.to_numpy(dtype=object)
+
+    previous = pandas.Series(previous_hashes['row_hash'].to_numpy(), index=key_strings(previous_hashes))
+    changed = current.index[~current.index.isin(previous.index)]
+    common = current.index.intersection(previous.index)
+    changed = changed.append(common[current[common].to_numpy() != previous[common].to_numpy()])
+    removed = previous.index[~previous.index.isin(current.index)]
+
+    return changed.append(removed).to_numpy(dtype=object)
+
+def read_table(connection, table):
+    '''A table of the state file, or None if it does not exist yet.'''
+    exists = connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    if exists is None:
+        return None
+
+    return pandas.read_sql(f'SELECT * FROM "{table}"', connection)
+
+def write_table(connection, data, table):
+    data.to_sql(table, connection, if_exists='replace', index=False)
+
+def replace_groups(previous, changed, dirty_keys):
+    '''The previous rows, minus the dirty groups, plus the changed rows.'''
+    if previous is None:
+        return changed.reset_index(drop=True)
+
+    kept = previous[~numpy.isin(key_strings(previous), dirty_keys)]
+    return pandas.concat([kept, changed], ignore_index=True)
+
+def update_report(connection, role, filename, sidecar=False, chunked=False, lean=False):
+    '''Brings the processed report of one role up to date with its export.
+
+        `sidecar` and `lean` read the export as for a full run (see diffcount.get_dataframe).
+        With `chunked`, the export is read twice, a chunk at a time: once to hash its groups,
+        and once to aggregate the rows of the changed ones (see diffcount.aggregate_chunks),
+        so it never needs to fit in memory.
+
+        Returns (processed report, keys of the groups that changed since the last run).
+    '''
+    fix_keys = KEY_FIXERS[role]
+
+    inputs = read_table(connection, 'inputs')
+    previous_hash = None
+    if inputs is not None and (inputs.role == role).any():
+        previous_hash = inputs.loc[inputs.role == role, 'file_hash'].iloc[0]
+
+    previous_groups = read_table(connection, f'{role}_groups')
+
+    current_hash = util.file_hash(filename)
+    if current_hash == previous_hash and previous_groups is not None:
+        logging.log(logging.INFO, f'{role.upper()} file {filename} did not change since the last run.')
+        return previous_groups, numpy.array([], dtype=object)
+
+    # A split export is read with the plan of its first file.
+    plan = schemas.load_plan(util.file_list(filename)[0], role, sidecar=sidecar)
+    if chunked:
+        hashes = combine_hashes([group_hashes(chunk, fixed_keys(chunk, fix_keys))
+            for chunk in iter_raw(filename, plan, sidecar=sidecar, lean=lean)])
+    else:
+        raw = diffcount.get_dataframe(filename, plan.column_mapping, sidecar=sidecar, lean=lean, column_dtypes=plan.dtypes)
+        raw_keys = fixed_keys(raw, fix_keys)
+        hashes = group_hashes(raw, raw_keys)
+
+    dirty_keys = changed_groups(hashes, read_table(connection, f'{role}_hashes'))
+    logging.log(logging.INFO, f'{role.upper()} file {filename}: {len(dirty_keys)} of {len(hashes)} groups changed.')
+
+    # Only the rows of the changed groups are aggregated again.
+    fix_dataframe = functools.partial(diffcount.fix_report_dataframe, plan=plan)
+    if chunked:
+        changed_chunks = (chunk[numpy.isin(key_strings(fixed_keys(chunk, fix_keys)), dirty_keys)]
+            for chunk in iter_raw(filename, plan, sidecar=sidecar, lean=lean))
+        changed = diffcount.aggregate_chunks(changed_chunks, fix_dataframe, diffcount.GROUPBY_COLUMNS[role])
+    else:
+        changed = fix_dataframe(raw[numpy.isin(key_strings(raw_keys), dirty_keys)])
+
+    groups = replace_groups(previous_groups, changed, dirty_keys)
+
+    write_table(connection, groups, f'{role}_groups')
+    write_table(connection, hashes, f'{role}_hashes')
+
+    inputs = inputs[inputs.role != role] if inputs is not None else pandas.DataFrame(columns=['role', 'filename', 'file_hash'])
+    inputs = pandas.concat([inputs, pandas.DataFrame([{'role': role, 'filename': str(filename), 'file_hash': current_hash}])], ignore_index=True)
+    write_table(connection, inputs, 'inputs')
+
+    return groups, dirty_keys
+
+def reconcile_incremental(sol_filename, tew_filename, state_filename,
+        abs_tolerance=columns.MISMATCH_ABS_TOLERANCE, rel_tolerance=columns.MISMATCH_REL_TOLERANCE,
+        sidecar=False, chunked=False, lean=False):
+    '''Runs the comparison, reusing the result kept in `state_filename` for the
+        groups whose source rows did not change. The state file is created if needed.
+        The tolerances only apply to the groups compared again. `sidecar`, `chunked`
+        and `lean` are as for a full run (see update_report).
+
+        Returns (data, delta): the full result, like fix_merged_dataframe gives, and
+        the groups whose status changed since the last run, with their `previous_status`.
+    '''
+    connection = sqlite3.connect(state_filename)
+    try:
+        with connection:
+            sol_groups, sol_dirty = update_report(connection, 'sol', sol_filename, sidecar, chunked, lean)
+            tew_groups, tew_dirty = update_report(connection, 'tew', tew_filename, sidecar, chunked, lean)
+            dirty_keys = numpy.union1d(sol_dirty.astype(str), tew_dirty.astype(str)).astype(object)
+
+            previous = read_table(connection, 'results')
+
+            sol_changed = sol_groups[numpy.isin(key_strings(sol_groups), dirty_keys)]
+            tew_changed = tew_groups[numpy.isin(key_strings(tew_groups), dirty_keys)]
+            changed = diffcount.fix_merged_dataframe(diffcount.merge_reports(sol_changed, tew_changed),
+                abs_tolerance, rel_tolerance)
+
+            data = replace_groups(previous, changed, dirty_keys)
+            data = data.sort_values(by=['projectId'], kind='stable', ignore_index=True)
+
+            write_table(connection, data, 'results')
+    finally:
+        connection.close()
+
+    logging.log(logging.INFO, f'Merged again {len(changed)} of {len(data)} rows.')
+
+    return data, status_delta(previous, changed, dirty_keys)
+
+def status_delta(previous, changed, dirty_keys):
+    '''The rows of the groups whose status is different from the last run, with a
+        `previous_status` column. New groups have no previous status, and groups
+        gone from both reports come with their last row and the status REMOVED.
+    '''
+    new_keys = key_strings(changed)
+    delta = changed.copy()
+
+    if previous is None:
+        delta['previous_status'] = None
+        return delta.reset_index(drop=True)
+
+    old_rows = previous[numpy.isin(key_strings(previous), dirty_keys)]
+    old_keys = key_strings(old_rows)
+
+    old_status = pandas.Series(old_rows['status'].to_numpy(), index=old_keys)
+    old_status = old_status[~old_status.index.duplicated()]
+    delta['previous_status'] = old_status.reindex(new_keys).to_numpy()
+
+    removed = old_rows[~numpy.isin(old_keys, new_keys)].copy()
+    removed['previous_status'] = removed['status']
+    removed['status'] = 'REMOVED'
+
+    delta = pandas.concat([delta, removed], ignore_index=True)
+    delta = delta[delta['status'] != delta['previous_status']]
+
+    return delta.sort_values(by=['projectId'], kind='stable', ignore_index=True)
+
+def delta_filename(result_filename):
+    '''diffcount-2024-05-01.xlsx gives diffcount-2024-05-01-delta.xlsx'''
+    stem, extension = os.path.splitext(result_filename)
+    return f'{stem}-delta{extension}'
@@ -0,0 +1,188 @@
+''' Synthetic SOL/TEW exports, built from the schemas in columns.py, for benchmarks and checks.
+
+    The exports look like the real ones: mostly zeroed rows, LATINIZE and hour ('H') rows
+    in SOL, locale names that need fixing, several SOL rows per TEW row, and a share of
+    groups that mismatch or are missing in one of the reports. '''
+
+import os
+import numpy
+import pandas
+import xlsxwriter
+
+import diffcount.columns as columns
+
+# (SOL target, TEW target) pairs, covering the exceptions and renamings of both reports.
+LOCALES = [
+    ('enUS', 'en_US'), ('deDE', 'de_DE'), ('frFR', 'fr_FR'), ('ptBR', 'pt_BR'), ('jaJP', 'ja_JP'),
+    ('zhCN', 'zh_CN'), ('esES', 'es_ES'), ('itIT', 'it_IT'), ('koKR', 'ko_KR'), ('ruRU', 'ru_RU'),
+    ('ckb', 'ckb'), ('ceb', 'ceb'), ('eo', 'eo'), ('hil', 'hil'), ('cnr', 'sla_ME'),
+    ('srRS', 'sr_RS_Latn'), ('azAZ', 'az_AZ_Latn'), ('bsBA', 'bs_BA_Latn'), ('srCP', 'sr_RS_Cyrl'),
+]
+
+def is_variant(locale):
+    '''Whether a (SOL target, TEW target) pair needs an exception or a renaming to match,
+        instead of just the underscore ('enUS' to 'en_US').
+    '''
+    sol, tew = locale
+    return tew != sol[:2] + '_' + sol[2:]
+
+VENDORS = [f'LSP{i:02}' for i in range(1, 21)]
+
+# TEW columns that are split in two, and summed back by fix_tew_dataframe.
+SPLIT_COLUMNS = ['tew_95', 'tew_85', 'tew_75']
+
+def generate_exports(rows, zero_share=5/6, latinize_share=0.05, hour_share=0.02, null_lsp_share=0.01,
+        negative_share=0.01, mismatch_rate=0.05, missing_rate=0.02, rows_per_group=4,
+        extra_columns=0, locales=LOCALES, variant_share=None, seed=0):
+    '''Makes a SOL export with `rows` rows, and the TEW export that goes with it.
+
+        :param zero_share: share of SOL/TEW rows with a zero total (the real exports have ~5x the content rows).
+        :param latinize_share: share of SOL content rows on the LATINIZE step.
+        :param hour_share: share of SOL content rows billed in hours ('H').
+        :param null_lsp_share: share of SOL content rows without a vendor.
+        :param negative_share: share of SOL content rows with a negative quantity.
+        :param mismatch_rate: share of groups whose TEW counts differ from SOL.
+        :param missing_rate: share of groups left out of TEW, and also of extra groups only in TEW.
+        :param rows_per_group: average SOL content rows per projectId/target/tgroup group.
+        :param extra_columns: unused columns added to both exports, as the real exports are much wider.
+        :param locales: (SOL target, TEW target) pairs the groups are spread over.
+        :param variant_share: share of groups on a locale that needs an exception or a renaming (see is_variant).
+            By default, the groups are spread evenly over `locales`.
+        :return: (sol_export, tew_export), dataframes with the original column names.
+    '''
+    rng = numpy.random.default_rng(seed)
+
+    n_zero = int(rows * zero_share)
+    n_content = rows - n_zero
+    n_groups = max(1, n_content // rows_per_group)
+
+    # Each group is a projectId, a target and a vendor.
+    group_project = 1000000 + rng.permutation(n_groups)
+    group_locale = rng.integers(len(locales), size=n_groups)
+    group_vendor = rng.integers(len(VENDORS), size=n_groups)
+
+    if variant_share is not None:
+        variants = numpy.array([is_variant(locale) for locale in locales], dtype=bool)
+        variant_locales, plain_locales = numpy.flatnonzero(variants), numpy.flatnonzero(~variants)
+        if (variant_share > 0 and not len(variant_locales)) or (variant_share < 1 and not len(plain_locales)):
+            raise ValueError(f'The locales have no variants, or only variants, for a variant share of {variant_share}.')
+
+        on_variant = rng.random(n_groups) < variant_share
+        group_locale[on_variant] = rng.choice(variant_locales, size=on_variant.sum())
+        group_locale[~on_variant] = rng.choice(plain_locales, size=(~on_variant).sum())
+
+    sol_targets = numpy.array([sol for sol, tew in locales], dtype=object)
+    tew_targets = numpy.array([tew for sol, tew in locales], dtype=object)
+    vendors = numpy.array(VENDORS, dtype=object)
+    unit_keys = numpy.array(list(columns.SOL_UNIT_NAME_MAPPING.values()), dtype=object)
+    n_units = len(unit_keys)
+
+    #===================================
+    # 1. SOL
+    #===================================
+    row_group = numpy.concatenate([rng.integers(n_groups, size=n_content), rng.integers(n_groups, size=n_zero)])
+    row_unit = rng.integers(n_units, size=rows)
+
+    quantity = rng.integers(1, 2000, size=rows).astype('float64')
+    quantity[rng.random(rows) < negative_share] *= -1
+    quantity[n_content:] = 0
+
+    content = numpy.arange(rows) < n_content
+    latinize = content & (rng.random(rows) < latinize_share)
+    hours = content & (rng.random(rows) < hour_share)
+    null_lsp = content & (rng.random(rows) < null_lsp_share)
+
+    sol_vendor = vendors[group_vendor[row_group]]
+    sol_vendor[null_lsp] = None
+
+    sol = pandas.DataFrame({
+        'projectId': group_project[row_group],
+        'projectName': numpy.char.add('Project ', group_project[row_group].astype(str)).astype(object),
+        'target': sol_targets[group_locale[row_group]],
+        'tgroup': sol_vendor,
+        'step': numpy.where(latinize, 'LATINIZE', 'TRANSLATE').astype(object),
+        'sol_total': quantity,
+        'sol_total_unit': numpy.where(hours, 'H', 'W').astype(object),
+        'sls_unit': unit_keys[row_unit],
+    })
+    sol = sol.iloc[rng.permutation(rows)].reset_index(drop=True)
+
+    #===================================
+    # 2. TEW, matching what SOL bills
+    #===================================
+    billed = content & ~latinize & ~null_lsp
+    unit_sums = numpy.bincount(row_group[billed] * n_units + row_unit[billed],
+        weights=quantity[billed], minlength=n_groups * n_units).reshape(n_groups, n_units)
+    totals = numpy.bincount(row_group[billed & ~hours], weights=quantity[billed & ~hours], minlength=n_groups)
+
+    tew_counts = {f'tew_{name[4:]}': unit_sums[:, i] for i, name in enumerate(columns.SOL_UNIT_NAME_MAPPING.keys())}
+    tew_counts['tew_total'] = totals
+
+    # Some groups do not match: a category and the total get a few more words.
+    mismatched = rng.random(n_groups) < mismatch_rate
+    extra_words = rng.integers(1, 500, size=n_groups) * mismatched
+    tew_counts['tew_total'] = tew_counts['tew_total'] + extra_words
+    tew_counts['tew_no_match'] = tew_counts['tew_no_match'] + extra_words
+
+    for col in SPLIT_COLUMNS:
+        whole = tew_counts.pop(col)
+        tew_counts[col + '_a'] = numpy.floor(whole * rng.random(n_groups))
+        tew_counts[col + '_b'] = whole - tew_counts[col + '_a']
+
+    tew = pandas.DataFrame({
+        'projectId': group_project,
+        'target': tew_targets[group_locale],
+        'tgroup': numpy.char.add('SAPLSP', vendors[group_vendor].astype(str)).astype(object),
+        'tew_name': numpy.char.add('Project ', group_project.astype(str)).astype(object),
+    })
+    for col in columns.TEW_COLUMN_MAPPING.keys():
+        if col in tew_counts:
+            tew[col] = tew_counts[col]
+
+    # Some groups are only in SOL, and some others only in TEW.
+    tew = tew[rng.random(n_groups) >= missing_rate]
+    n_only_tew = int(n_groups * missing_rate)
+    only_tew = tew.sample(n_only_tew, replace=True, random_state=seed) if len(tew) and n_only_tew else tew.iloc[:0]
+    only_tew = only_tew.assign(projectId=2000000 + numpy.arange(len(only_tew)))
+    only_tew = only_tew.assign(tew_name=numpy.char.add('Project ', only_tew['projectId'].to_numpy().astype(str)).astype(object))
+
+    # And the zeroed rows.
+    n_tew_zero = int(len(tew) * zero_share / (1 - zero_share)) if zero_share < 1 else 0
+    zeroed = tew.sample(n_tew_zero, replace=True, random_state=seed + 1) if len(tew) and n_tew_zero else tew.iloc[:0]
+    zeroed = zeroed.assign(**{col: 0.0 for col in tew.columns if col.startswith('tew_') and col != 'tew_name'})
+
+    tew = pandas.concat([tew, only_tew, zeroed], ignore_index=True)
+    tew = tew.iloc[rng.permutation(len(tew))].reset_index(drop=True)
+
+    #===================================
+    # 3. Original column names
+    #===================================
+    sol = sol.rename(columns=columns.SOL_COLUMN_MAPPING)
+    tew = tew.rename(columns=columns.TEW_COLUMN_MAPPING)[list(columns.TEW_COLUMN_MAPPING.values())]
+
+    for i in range(extra_columns):
+        sol[f'Unused Column {i}'] = 'x'
+        tew[f'UNUSED_COLUMN_{i}'] = 0
+
+    return sol, tew
+
+def write_export(data, filename):
+    '''Saves a synthetic export as XLSX, CSV or Parquet, by its extension.'''
+    extension = os.path.splitext(filename)[1].lower()
+
+    if extension == '.csv':
+        data.to_csv(filename, index=False)
+    elif extension == '.parquet':
+        data.to_parquet(filename, index=False)
+    elif extension == '.xlsx':
+        # Written row by row in constant memory mode, as the exports can be large.
+        workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, list(data.columns))
+        for i, row in enumerate(data.itertuples(index=False, name=None)):
+            worksheet.write_row(i + 1, 0, [None if value != value else value for value in row])
+        workbook.close()
+    else:
+        raise ValueError(f'Cannot write synthetic exports as <{extension}>.')
+
+    return filename
@@ -0,0 +1,13 @@
+''' The repository folder is the diffcount package itself (see __main__.py), so it is made
+    importable as `diffcount` whatever the folder of the checkout is named. '''
+
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'diffcount' not in sys.modules:
+    package = types.ModuleType('diffcount')
+    package.__path__ = [ROOT]
+    sys.modules['diffcount'] = package
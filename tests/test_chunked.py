@@ -0,0 +1,67 @@
+''' aggregate_chunks (--chunked) must give exactly the report of the whole export at once. '''
+
+import functools
+import numpy
+import pandas
+import pytest
+
+import diffcount.columns as columns
+import diffcount.diffcount as diffcount
+
+ROWS = 500
+
+def sol_rows(rng):
+    '''Random raw SOL rows, with whole-number quantities as the exports have, negative, zero
+        and missing ones, hour rows, unknown units, rows without LSP and latinization.
+    '''
+    return pandas.DataFrame({
+        'projectId': rng.choice(numpy.array([1, 2, 3, 'P-4'], dtype=object), ROWS),
+        'projectName': rng.choice(['p1', 'p2'], ROWS),
+        'target': rng.choice(['enUS', 'deDE', 'ckb', 'cnr'], ROWS),
+        'tgroup': rng.choice(numpy.array(['A', 'B', None], dtype=object), ROWS),
+        'step': rng.choice(['TRANSLATE', 'TRANSLATE', 'TRANSLATE', 'LATINIZE'], ROWS),
+        'sol_total': numpy.where(rng.random(ROWS) < 0.05, numpy.nan, rng.integers(-50, 500, ROWS).astype('float64')),
+        'sol_total_unit': rng.choice(['W', 'W', 'W', 'H'], ROWS),
+        'sls_unit': rng.choice(list(columns.SOL_UNIT_NAME_MAPPING.values()) + ['SOMETHING_ELSE'], ROWS),
+    })
+
+def tew_rows(rng):
+    '''Random raw TEW rows, with whole-number counts, negative and zero totals, and rows without LSP.'''
+    data = pandas.DataFrame({
+        'projectId': rng.choice(numpy.array([1, 2, 3, 'P-4'], dtype=object), ROWS),
+        'target': rng.choice(['en_US', 'sr_RS_Latn', 'sr_RS_Cyrl', 'ckb'], ROWS),
+        'tgroup': rng.choice(numpy.array(['SAPLSPA', 'SAPLSPB', None], dtype=object), ROWS),
+        'tew_name': rng.choice(['p1', 'p2'], ROWS),
+    })
+    for col in columns.TEW_COLUMN_MAPPING:
+        if col.startswith('tew_') and col != 'tew_name':
+            data[col] = rng.integers(-20, 300, ROWS).astype('float64')
+    data.loc[rng.random(ROWS) < 0.2, 'tew_total'] = 0
+
+    return data
+
+def chunks_of(data, size):
+    return [data.iloc[start:start + size] for start in range(0, len(data), size)]
+
+@pytest.mark.parametrize('chunksize, combine_rows', [(7, 10), (50, 1), (ROWS, diffcount.COMBINE_ROWS)])
+def test_sol_chunks_match_whole_export(chunksize, combine_rows):
+    data = sol_rows(numpy.random.default_rng(0))
+
+    expected = diffcount.fix_sol_dataframe(data)
+    result = diffcount.aggregate_chunks(chunks_of(data, chunksize), diffcount.fix_sol_dataframe,
+        columns.SOL_GROUPBY_COLUMNS, combine_rows=combine_rows)
+
+    assert len(expected) > 20
+    pandas.testing.assert_frame_equal(result, expected, check_exact=True)
+
+@pytest.mark.parametrize('chunksize, combine_rows', [(7, 10), (50, 1), (ROWS, diffcount.COMBINE_ROWS)])
+def test_tew_chunks_match_whole_export(chunksize, combine_rows):
+    data = tew_rows(numpy.random.default_rng(1))
+    fix_dataframe = functools.partial(diffcount.fix_tew_dataframe, derived=columns.TEW_DERIVED_COLUMNS)
+
+    expected = fix_dataframe(data)
+    result = diffcount.aggregate_chunks(chunks_of(data, chunksize), fix_dataframe,
+        columns.TEW_GROUPBY_COLUMNS, combine_rows=combine_rows)
+
+    assert len(expected) > 20
+    pandas.testing.assert_frame_equal(result, expected, check_exact=True)
@@ -0,0 +1,55 @@
+''' The explain index: the runs of both exports, merged into one file sorted by group. '''
+
+import numpy
+import pandas
+import pyarrow.parquet as parquet
+
+import diffcount.explain as explain
+import diffcount.schemas as schemas
+import diffcount.diffcount as diffcount
+
+from test_chunked import sol_rows, tew_rows
+
+def write_runs(folder, role, data, chunksize):
+    '''The source rows of each chunk of `data`, as runs, like --chunked --explain writes them.'''
+    plan = schemas.compile_plan(role, 'v1')
+    return [explain.write_run(diffcount.source_rows(data.iloc[start:start + chunksize], plan, f'{role}.xlsx', first_row=start), plan, folder)
+        for start in range(0, len(data), chunksize)]
+
+def is_sorted(order):
+    return all(order[i] <= order[i + 1] for i in range(len(order) - 1))
+
+def test_merge_runs_sorts_across_runs(tmp_path):
+    runs = write_runs(str(tmp_path), 'sol', sol_rows(numpy.random.default_rng(0)), 60)
+    assert len(runs) > 5
+
+    merged = pandas.concat(list(explain.merge_runs(runs, batch_rows=7)), ignore_index=True)
+    expected = pandas.concat([pandas.read_parquet(run) for run in runs], ignore_index=True)
+
+    assert is_sorted(explain.group_order(merged))
+    key = ['source_row']
+    pandas.testing.assert_frame_equal(merged.sort_values(key, ignore_index=True), expected.sort_values(key, ignore_index=True))
+
+def test_index_row_groups_are_ordered(tmp_path, monkeypatch):
+    monkeypatch.setattr(explain, 'ROW_GROUP_SIZE', 25)
+    folder = str(tmp_path)
+    runs = write_runs(folder, 'sol', sol_rows(numpy.random.default_rng(0)), 60) \
+        + write_runs(folder, 'tew', tew_rows(numpy.random.default_rng(1)), 45)
+
+    index = str(tmp_path / 'report.explain.parquet')
+    explain.write_index(index, runs)
+
+    rows = pandas.read_parquet(index)
+    assert len(rows) == sum(parquet.ParquetFile(run).metadata.num_rows for run in runs)
+    assert is_sorted(explain.group_order(rows))
+    assert set(rows['role']) == {'sol', 'tew'}
+
+    # Each row group only holds ids from where the one before it ended.
+    metadata = parquet.ParquetFile(index).metadata
+    column = rows.columns.get_loc('projectId')
+    statistics = [metadata.row_group(i).column(column).statistics for i in range(metadata.num_row_groups)]
+    assert metadata.num_row_groups > 5
+    assert all(statistics[i].max <= statistics[i + 1].min for i in range(len(statistics) - 1))
+
+    found = explain.lookup(index, 2)
+    assert len(found) == (rows['projectId'] == '2').sum()
@@ -0,0 +1,134 @@
+''' The export readers, on small files written by the tests. '''
+
+import os
+import pandas
+import pytest
+
+import diffcount.columns as columns
+import diffcount.readers as readers
+
+def sol_export():
+    '''A few SOL export rows, under the export's own column names.'''
+    return pandas.DataFrame({
+        'External Project ID': [1, 2, 3],
+        'Content Name': ['p1', 'p2', 'p3'],
+        'Target Language': ['enUS', 'deDE', 'frFR'],
+        'Vendor (Translator Group)': ['A', 'B', 'C'],
+        'Step': ['TRANSLATE', 'TRANSLATE', 'LATINIZE'],
+        'Billing Quantity': [10.0, 20.0, 30.0],
+        'Unit': ['W', 'W', 'W'],
+        'SLS Unit Key': ['NO_MATCH', 'EDC1', 'MT'],
+    })
+
+@pytest.mark.parametrize('extension', ['.csv', '.parquet'])
+def test_header_names_with_spaces(tmp_path, extension):
+    export = sol_export()
+    spaced = export.rename(columns={'Billing Quantity': 'Billing Quantity ', 'Unit': ' Unit'})
+
+    filename = str(tmp_path / ('export' + extension))
+    if extension == '.csv':
+        spaced.to_csv(filename, index=False)
+    else:
+        spaced.to_parquet(filename, index=False)
+
+    data = readers.read_dataframe(filename, columns.SOL_COLUMN_MAPPING)
+
+    assert list(data.columns) == list(columns.SOL_COLUMN_MAPPING.keys())
+    assert data['sol_total'].tolist() == export['Billing Quantity'].tolist()
+    assert data['sol_total_unit'].tolist() == export['Unit'].tolist()
+
+def test_missing_column_is_a_key_error(tmp_path):
+    filename = str(tmp_path / 'export.csv')
+    sol_export().drop(columns=['Unit']).to_csv(filename, index=False)
+
+    with pytest.raises(KeyError):
+        readers.read_dataframe(filename, columns.SOL_COLUMN_MAPPING)
+
+def test_sidecar_of_mixed_ids_is_skipped(tmp_path):
+    export = sol_export()
+    export['External Project ID'] = ['P-0001', 2, 3]
+    filename = str(tmp_path / 'export.xlsx')
+    export.to_excel(filename, index=False)
+
+    data = readers.read_with_sidecar(filename, columns.SOL_COLUMN_MAPPING)
+
+    assert data['projectId'].tolist() == ['P-0001', 2, 3]
+    assert not os.path.exists(readers.sidecar_filename(filename))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+def test_truncated_sidecar_is_not_used(tmp_path):
+    import diffcount.diffcount as diffcount
+
+    filename = str(tmp_path / 'export.xlsx')
+    sol_export().to_excel(filename, index=False)
+    expected = diffcount.load_sol_report(filename)
+
+    diffcount.load_sol_report(filename, sidecar=True)
+    sidecar = readers.sidecar_filename(filename)
+    with open(sidecar, 'r+b') as file:
+        file.truncate(os.path.getsize(sidecar) // 2)
+
+    assert readers.sidecar_columns(filename) is None
+    pandas.testing.assert_frame_equal(diffcount.load_sol_report(filename, sidecar=True), expected)
+    # Written again in full.
+    assert readers.sidecar_columns(filename) == list(columns.SOL_COLUMN_MAPPING.values())
+
+def test_ids_are_alike_in_every_chunk_and_format(tmp_path):
+    export = pandas.concat([sol_export()] * 3, ignore_index=True)
+    export['External Project ID'] = [1, 2, 3, 4, 5, 6, 'P-0001', '007', 9]
+    expected = [1, 2, 3, 4, 5, 6, 'P-0001', '007', 9]
+    plan_dtypes = columns.SOL_COLUMN_DTYPES
+
+    csv_filename = str(tmp_path / 'export.csv')
+    export.to_csv(csv_filename, index=False)
+    xlsx_filename = str(tmp_path / 'export.xlsx')
+    export.to_excel(xlsx_filename, index=False)
+
+    for filename in (csv_filename, xlsx_filename):
+        # Chunks of 2 rows, so that most of them only hold numeric ids.
+        chunks = readers.iter_dataframe(filename, columns.SOL_COLUMN_MAPPING, chunksize=2, column_dtypes=plan_dtypes)
+        ids = [value for chunk in chunks for value in chunk['projectId']]
+        assert ids == expected
+        assert [type(value) for value in ids] == [type(value) for value in expected]
+
+def test_normalize_ids():
+    ids = pandas.Series(['12', 12.0, 13, 'A-1', '007', None, '1e3', ' 5'], dtype=object)
+    assert readers.normalize_ids(ids).tolist() == [12, 12, 13, 'A-1', '007', None, '1e3', ' 5']
+
+@pytest.mark.parametrize('writer', ['openpyxl', 'xlsxwriter'])
+def test_xlsx_headers_read_like_openpyxl(tmp_path, writer):
+    import openpyxl
+
+    filename = str(tmp_path / 'export.xlsx')
+    sheets = {
+        'Data': [['External Project ID', None, 'Billing Quantity ', 2024], [1, 2, 3, 4]],
+        'Pivot': [[None, 'Sum'], ['a', 1]],
+        'More': [['Unit', 'Step'], ['W', 'TRANSLATE']],
+    }
+    if writer == 'openpyxl':
+        workbook = openpyxl.Workbook()
+        workbook.remove(workbook.active)
+        for name, rows in sheets.items():
+            sheet = workbook.create_sheet(name)
+            for row in rows:
+                sheet.append(row)
+        workbook.save(filename)
+    else:
+        import xlsxwriter
+        # Constant memory mode writes the strings inline, rather than in the shared strings.
+        workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        for name, rows in sheets.items():
+            sheet = workbook.add_worksheet(name)
+            for i, row in enumerate(rows):
+                sheet.write_row(i, 0, row)
+        workbook.close()
+
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    expected = [(sheet.title, [None if value is None else str(value) for value in next(sheet.iter_rows(max_row=1, values_only=True))])
+        for sheet in workbook.worksheets]
+    workbook.close()
+
+    headers = [(name, [None if value is None else str(value) for value in header]) for name, header in readers.xlsx_headers(filename)]
+    # openpyxl pads the first row up to the widest row of the sheet.
+    assert [(name, header + [None] * (len(full) - len(header))) for (name, header), (_, full) in zip(headers, expected)] == expected
+    assert readers.read_header(filename) == ['External Project ID', None, 'Billing Quantity', '2024']
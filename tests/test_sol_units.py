@@ -0,0 +1,78 @@
+''' pivot_sol_units must give the same report as the loop it replaced. '''
+
+import numpy
+import pandas
+
+import diffcount.columns as columns
+import diffcount.diffcount as diffcount
+
+def reference_fix_sol_dataframe(data):
+    '''fix_sol_dataframe as it was before pivot_sol_units, with one numpy.select per SLS_UNIT.'''
+    data = data[data.sol_total != 0].copy()
+    data.loc[:, 'tgroup'] = 'SAPLSP' + data.tgroup
+    data.target = data.target.apply(lambda x: diffcount.fix_sol_target(x))
+
+    data = data[data['tgroup'].isnull() == False]
+
+    data = data[data['step'] != 'LATINIZE']
+    del data['step']
+
+    for new_name, unit_key_name in columns.SOL_UNIT_NAME_MAPPING.items():
+        data[new_name] = \
+            numpy.select(
+               [data.sls_unit != unit_key_name, True],
+               [0, data.sol_total])
+
+    data.loc[data['sol_total_unit'] == 'H', 'sol_total'] = 0
+    del data['sol_total_unit']
+
+    del data['sls_unit']
+
+    data = data.groupby(columns.SOL_GROUPBY_COLUMNS, as_index=False).agg('sum')
+
+    return data
+
+def sol_rows():
+    '''A few raw SOL rows, with the cases the pivot has to get right.'''
+    rows = [
+        # projectId, projectName, target, tgroup, step, sol_total, sol_total_unit, sls_unit
+        (1, 'p1', 'enUS', 'A', 'TRANSLATE', 100.0, 'W', 'NO_MATCH'),
+        (1, 'p1', 'enUS', 'A', 'TRANSLATE', 50.0, 'W', 'NO_MATCH'),
+        (1, 'p1', 'enUS', 'A', 'TRANSLATE', 20.0, 'W', 'EDC7'),
+        # Hours: left out of the total, but still in their unit's column.
+        (1, 'p1', 'enUS', 'A', 'TRANSLATE', 3.0, 'H', 'MT'),
+        # Unknown unit: in the total only.
+        (1, 'p1', 'enUS', 'A', 'TRANSLATE', 7.0, 'W', 'SOMETHING_ELSE'),
+        # Negative quantities.
+        (1, 'p1', 'deDE', 'B', 'TRANSLATE', -40.0, 'W', '100_MATCH'),
+        (1, 'p1', 'deDE', 'B', 'TRANSLATE', 15.0, 'W', '100_MATCH'),
+        # Missing quantities.
+        (2, 'p2', 'ckb', 'A', 'TRANSLATE', numpy.nan, 'W', 'ICE_MATCH'),
+        (2, 'p2', 'ckb', 'A', 'TRANSLATE', 9.0, 'W', 'ICE_MATCH'),
+        # Dropped: no LSP, no project name, latinization, zero quantity.
+        (2, 'p2', 'ckb', None, 'TRANSLATE', 11.0, 'W', 'NO_MATCH'),
+        (3, None, 'frFR', 'A', 'TRANSLATE', 13.0, 'W', 'NO_MATCH'),
+        (2, 'p2', 'cnr', 'C', 'LATINIZE', 17.0, 'W', 'NO_MATCH'),
+        (2, 'p2', 'cnr', 'C', 'TRANSLATE', 0.0, 'W', 'NO_MATCH'),
+        (2, 'p2', 'cnr', 'C', 'TRANSLATE', 19.0, 'W', 'REPETITIONS'),
+    ]
+    return pandas.DataFrame(rows, columns=list(columns.SOL_COLUMN_MAPPING.keys()))
+
+def test_fix_sol_dataframe_matches_reference():
+    expected = reference_fix_sol_dataframe(sol_rows())
+    result = diffcount.fix_sol_dataframe(sol_rows())
+
+    assert len(expected) == 4
+    pandas.testing.assert_frame_equal(result, expected, check_exact=True)
+
+def test_pivot_sol_units_leaves_out_unknown_units_and_missing_groups():
+    sls_unit = pandas.Series(['NO_MATCH', 'EDC7', 'SOMETHING_ELSE', 'NO_MATCH'])
+    quantity = numpy.array([1.0, 2.0, 4.0, 8.0])
+    group_ids = numpy.array([0, 1, 0, -1])
+
+    unit_sums = diffcount.pivot_sol_units(sls_unit, quantity, group_ids, 2)
+
+    expected = numpy.zeros((2, len(columns.SOL_UNIT_NAME_MAPPING)))
+    expected[0, 0] = 1.0
+    expected[1, -1] = 2.0
+    numpy.testing.assert_array_equal(unit_sums, expected)
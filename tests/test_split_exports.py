@@ -0,0 +1,54 @@
+''' An export split across sheets and files must load as the same export in one file. '''
+
+import numpy
+import pandas
+import pytest
+
+import diffcount.columns as columns
+import diffcount.diffcount as diffcount
+
+from test_chunked import sol_rows, tew_rows
+
+MAPPINGS = {'sol': columns.SOL_COLUMN_MAPPING, 'tew': columns.TEW_COLUMN_MAPPING}
+ROW_MAKERS = {'sol': sol_rows, 'tew': tew_rows}
+
+def export_rows(role):
+    '''Random raw rows of an export, under the export's own column names. Parquet has no
+        columns mixing numbers and text, so the ids are all numbers here.
+    '''
+    data = ROW_MAKERS[role](numpy.random.default_rng(2))
+    data['projectId'] = numpy.random.default_rng(3).integers(1, 6, len(data))
+
+    return data.rename(columns=MAPPINGS[role])
+
+def write_split_export(data, folder):
+    '''Writes the rows in four parts: two sheets of a workbook, with a pivot sheet between
+        them, a CSV file and a Parquet file. Returns the list of files.
+    '''
+    parts = numpy.array_split(numpy.arange(len(data)), 4)
+    workbook = str(folder / 'part-1.xlsx')
+    csv_file = str(folder / 'part-2.csv')
+    parquet_file = str(folder / 'part-3.parquet')
+
+    with pandas.ExcelWriter(workbook) as writer:
+        data.iloc[parts[0]].to_excel(writer, sheet_name='Part 1', index=False)
+        pandas.DataFrame({'Sum': [1, 2]}).to_excel(writer, sheet_name='Pivot', index=False)
+        data.iloc[parts[1]].to_excel(writer, sheet_name='Part 2', index=False)
+    data.iloc[parts[2]].to_csv(csv_file, index=False)
+    data.iloc[parts[3]].to_parquet(parquet_file, index=False)
+
+    return [workbook, csv_file, parquet_file]
+
+@pytest.mark.parametrize('role', ['sol', 'tew'])
+@pytest.mark.parametrize('chunked', [False, True])
+@pytest.mark.parametrize('workers', [1, 2])
+def test_split_export_matches_one_file(tmp_path, role, chunked, workers):
+    data = export_rows(role)
+    one_file = str(tmp_path / 'whole.xlsx')
+    data.to_excel(one_file, index=False)
+
+    expected = diffcount.load_report(one_file, role)
+    result = diffcount.load_report(write_split_export(data, tmp_path), role, chunked=chunked, workers=workers)
+
+    assert len(expected) > 20
+    pandas.testing.assert_frame_equal(result, expected, check_exact=True)
@@ -0,0 +1,58 @@
+''' Incremental runs (--state) must give the result of a full run, however the exports are read. '''
+
+import sqlite3
+import numpy
+import pandas
+import pytest
+
+import diffcount.state as state
+import diffcount.columns as columns
+import diffcount.diffcount as diffcount
+
+from test_split_exports import export_rows
+
+def full_run(sol_filename, tew_filename):
+    data = diffcount.merge_reports(diffcount.load_report(sol_filename, 'sol'), diffcount.load_report(tew_filename, 'tew'))
+    return diffcount.fix_merged_dataframe(data)
+
+def sorted_rows(data):
+    data = data.astype({'projectId': 'int64'})
+    return data.sort_values(columns.JOIN_KEY_COLUMNS, ignore_index=True)
+
+def write_exports(folder, sol, tew):
+    sol_filename, tew_filename = str(folder / 'sol.csv'), str(folder / 'tew.csv')
+    sol.to_csv(sol_filename, index=False)
+    tew.to_csv(tew_filename, index=False)
+    return sol_filename, tew_filename
+
+@pytest.mark.parametrize('chunked, lean', [(False, False), (True, False), (True, True)])
+def test_incremental_run_matches_full_run(tmp_path, monkeypatch, chunked, lean):
+    monkeypatch.setattr(columns, 'READ_CHUNK_SIZE', 40)
+    sol, tew = export_rows('sol'), export_rows('tew')
+    state_filename = str(tmp_path / 'state.sqlite')
+
+    files = write_exports(tmp_path, sol, tew)
+    first, delta = state.reconcile_incremental(*files, state_filename, chunked=chunked, lean=lean)
+    pandas.testing.assert_frame_equal(sorted_rows(first), sorted_rows(full_run(*files)), check_dtype=False)
+
+    # Some rows of one project change, the others are kept from the last run.
+    project = sol['External Project ID'] == 2
+    sol.loc[project, 'Billing Quantity'] += 1
+    files = write_exports(tmp_path, sol, tew)
+    data, delta = state.reconcile_incremental(*files, state_filename, chunked=chunked, lean=lean)
+    pandas.testing.assert_frame_equal(sorted_rows(data), sorted_rows(full_run(*files)), check_dtype=False)
+    assert not sorted_rows(data)['sol_total'].equals(sorted_rows(first)['sol_total'])
+
+def test_group_hashes_do_not_depend_on_reading(tmp_path, monkeypatch):
+    monkeypatch.setattr(columns, 'READ_CHUNK_SIZE', 40)
+    files = write_exports(tmp_path, export_rows('sol'), export_rows('tew'))
+
+    hashes = []
+    for chunked, lean in [(False, False), (True, True)]:
+        state_filename = str(tmp_path / f'state-{chunked}-{lean}.sqlite')
+        state.reconcile_incremental(*files, state_filename, chunked=chunked, lean=lean)
+        with sqlite3.connect(state_filename) as connection:
+            hashes.append([sorted_rows(state.read_table(connection, f'{role}_hashes')) for role in ('sol', 'tew')])
+
+    for whole, chunks in zip(*hashes):
+        pandas.testing.assert_frame_equal(whole, chunks)
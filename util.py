@@ -1,5 +1,7 @@
 
 import os
+import hashlib
+import multiprocessing
 from colorama import Fore, Style
 from colorama import init as colorama_init
 
@@ -65,12 +67,58 @@ def choose_file(extensions, path=os.getcwd()):
         elif option in file_list:
             return os.path.join(path,option)
 
-def autowidth_excel_columns(dataframe, worksheet):
-    """ Sets the width of each column as 2 characters more than the largest string. """
-    columnNames = dataframe.columns.values.tolist()
+def pool_workers(tasks):
+    """ How many processes to run `tasks` independent tasks with: one per task, up to one per core.
+    Inside a worker process (of batch, periods, serve or --parallel), the cores are already
+    taken by the other workers, so the tasks are run one after the other instead (1). """
+    if multiprocessing.parent_process() is not None:
+        return 1
 
-    for i,col in enumerate(dataframe.columns):
-        max_len = max([len(str(item)) for item in dataframe[col].values])
+    return max(1, min(tasks, os.cpu_count() or 1))
+
+def file_list(filename):
+    """ An export may be one file, or a list of files split out of one (see diffcount.load_report).
+    Returns the list of files either way. """
+    if isinstance(filename, (str, os.PathLike)):
+        return [filename]
+
+    return list(filename)
+
+def file_hash(filename, block_size=1 << 20):
+    """ SHA-256 of the contents of a file, read in blocks.
+    For a list of files, the SHA-256 of their hashes, in order. """
+    if not isinstance(filename, (str, os.PathLike)):
+        return hashlib.sha256(''.join(file_hash(part, block_size) for part in filename).encode()).hexdigest()
+
+    digest = hashlib.sha256()
+
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def column_text_width(series, sample_size=None):
+    """ Length of the longest value in the column, as text.
+
+    Text columns are always measured in full. Numeric columns, with a `sample_size`,
+    are measured on their smallest and largest values plus a random sample. """
+    if len(series) == 0:
+        return 0
+
+    if sample_size is not None and len(series) > sample_size and series.dtype.kind in 'iuf':
+        sample = series.sample(sample_size, random_state=0)
+        return max(len(str(series.min())), len(str(series.max())), int(sample.astype(str).str.len().max()))
+
+    return int(series.astype(str).str.len().max())
+
+def autowidth_excel_columns(dataframe, worksheet, sample_size=None, column_order=None):
+    """ Sets the width of each column as 2 characters more than the largest string.
+        `column_order` is the order the columns were written in, if not the dataframe's. """
+    columnNames = dataframe.columns.values.tolist() if column_order is None else list(column_order)
+
+    for i,col in enumerate(columnNames):
+        max_len = column_text_width(dataframe[col], sample_size)
         max_len = max([max_len, len(str(columnNames[i]))])
         # (i+1) because the first column is used for row indexes.
         worksheet.set_column(i+1, i+1, width=max_len+2)